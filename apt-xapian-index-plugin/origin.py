@@ -3,6 +3,11 @@
 import apt
 import os
 
+# softwarecenter.paths.APT_XAPIAN_INDEX_CHANNELS_STAMP_PATH, it is not
+# imported so that the plugin keeps working without software-center
+APT_XAPIAN_INDEX_CHANNELS_STAMP_PATH = (
+    "/var/lib/apt-xapian-index/software-center-channels-stamp")
+
 
 class OriginPlugin:
 
@@ -40,7 +45,14 @@ class OriginPlugin:
 
         The progress indicator can be used to report progress.
         """
-        pass
+        # the channel catalogue that software-center recorded is outdated
+        # now, the stamp makes it use the "XOL" terms instead until the
+        # next update-software-center records a new one
+        try:
+            open(APT_XAPIAN_INDEX_CHANNELS_STAMP_PATH, "a").close()
+            os.utime(APT_XAPIAN_INDEX_CHANNELS_STAMP_PATH, None)
+        except (IOError, OSError):
+            pass
 
     def doc(self):
         """
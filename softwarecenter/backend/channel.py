@@ -51,14 +51,48 @@ class ChannelsManager(object):
         pass
 
     # private
-    def _get_channels_from_db(self, installed_only=False):
+    def _get_channel_names_and_origins(self, installed_only=False):
         """
-        (internal) implements 'channels()' and 'channels_installed_only()'
-        properties
+        (internal) return the list of (channel_name, channel_origin) of
+        the channels in the database, ordered by name and with one entry
+        per origin
+
+        With a channel catalogue of the database, a channel that comes
+        from several origins is named by the origin with the most
+        packages, and the channels without installed packages are left
+        out if installed_only is set. Without a catalogue the first
+        document of the channel names its origin.
         """
-        distro_channel_origin = self.distro.get_distro_channel_name()
+        catalogue = self.db.get_channel_catalogue()
+        if catalogue is None:
+            return self._get_channel_names_and_origins_from_terms()
+        # the origin with the most packages names the channel
+        origins = {}
+        installed = {}
+        for (channel_name, channel_origin, component, nr_pkgs,
+             nr_installed) in catalogue:
+            if not channel_name:
+                continue
+            if origins.get(channel_name, ("", -1))[1] < nr_pkgs:
+                origins[channel_name] = (channel_origin, nr_pkgs)
+            installed[channel_name] = (installed.get(channel_name, 0) +
+                                       nr_installed)
+        other_channel_list = []
+        cached_origins = set()
+        for channel_name in sorted(origins):
+            if installed_only and not installed[channel_name]:
+                continue
+            channel_origin = origins[channel_name][0]
+            if channel_origin not in cached_origins:
+                other_channel_list.append((channel_name, channel_origin))
+                cached_origins.add(channel_origin)
+        return other_channel_list
 
-        # gather the set of software channels and order them
+    def _get_channel_names_and_origins_from_terms(self):
+        """
+        (internal) find the channels of _get_channel_names_and_origins()
+        by scanning the "XOL" terms of the database
+        """
         other_channel_list = []
         cached_origins = []
         for channel_iter in self.db.xapiandb.allterms("XOL"):
@@ -80,6 +114,18 @@ class ChannelsManager(object):
             if channel_origin not in cached_origins:
                 other_channel_list.append((channel_name, channel_origin))
                 cached_origins.append(channel_origin)
+        return other_channel_list
+
+    def _get_channels_from_db(self, installed_only=False):
+        """
+        (internal) implements 'channels()' and 'channels_installed_only()'
+        properties
+        """
+        distro_channel_origin = self.distro.get_distro_channel_name()
+
+        # gather the set of software channels and order them
+        other_channel_list = self._get_channel_names_and_origins(
+            installed_only)
 
         dist_channel = None
         other_channels = []
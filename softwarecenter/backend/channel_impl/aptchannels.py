@@ -176,27 +176,8 @@ class AptChannelsManager(ChannelsManager):
         distro_channel_name = self.distro.get_distro_channel_name()
 
         # gather the set of software channels and order them
-        other_channel_list = []
-        cached_origins = []
-        for channel_iter in self.db.xapiandb.allterms("XOL"):
-            if len(channel_iter.term) == 3:
-                continue
-            channel_name = channel_iter.term[3:]
-            channel_origin = ""
-
-            # get origin information for this channel
-            m = self.db.xapiandb.postlist_begin(channel_iter.term)
-            doc = self.db.xapiandb.get_document(m.get_docid())
-            for term_iter in doc.termlist():
-                if (term_iter.term.startswith("XOO") and
-                      len(term_iter.term) > 3):
-                    channel_origin = term_iter.term[3:]
-                    break
-            self._logger.debug("channel_name: %s" % channel_name)
-            self._logger.debug("channel_origin: %s" % channel_origin)
-            if channel_origin not in cached_origins:
-                other_channel_list.append((channel_name, channel_origin))
-                cached_origins.append(channel_origin)
+        other_channel_list = self._get_channel_names_and_origins(
+            installed_only)
 
         dist_channel = None
         partner_channel = None
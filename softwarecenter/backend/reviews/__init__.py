@@ -28,6 +28,7 @@ import shutil
 import subprocess
 import time
 import threading
+import xapian
 
 from bsddb import db as bdb
 
@@ -52,7 +53,7 @@ from softwarecenter.utils import (upstream_version_compare,
 from softwarecenter.paths import (SOFTWARE_CENTER_CACHE_DIR,
                                   XAPIAN_BASE_PATH,
                                   )
-from softwarecenter.enums import ReviewSortMethods
+from softwarecenter.enums import ReviewSortMethods, XapianValues
 
 from softwarecenter.backend.spawn_helper import SpawnHelper
 
@@ -223,6 +224,50 @@ class Review(object):
         return review
 
 
+class RatingQuery(object):
+    """ a xapian.Query that weights every document with the dampened
+        rating of its package (0 for packages without review stats)
+
+        The documents of software-center are looked up by their PKGNAME
+        value. The apt-xapian-index documents have no such value, they
+        are looked up by the "pkgname" value of axi if it has one and by
+        their XP term otherwise.
+
+        The query does not keep its posting sources alive, so the
+        RatingQuery must be referenced until the match is done.
+    """
+
+    def __init__(self, review_stats, axi_values=None):
+        ratings = []
+        for (app, stats) in review_stats.iteritems():
+            # weights must not be negative, pkgname is ascii by
+            # policy so str() is fine here
+            ratings.append((str(app.pkgname), max(0, stats.dampened_rating)))
+        self.sources = []
+        subqueries = [self._get_value_query(XapianValues.PKGNAME, ratings)]
+        if axi_values and "pkgname" in axi_values:
+            subqueries.append(
+                self._get_value_query(axi_values["pkgname"], ratings))
+        else:
+            for (pkgname, rating) in ratings:
+                if not rating:
+                    continue
+                source = xapian.FixedWeightPostingSource(rating)
+                self.sources.append(source)
+                subqueries.append(xapian.Query(xapian.Query.OP_FILTER,
+                                               xapian.Query(source),
+                                               xapian.Query("XP" + pkgname)))
+        self.query = xapian.Query(xapian.Query.OP_OR, subqueries)
+
+    def _get_value_query(self, slot, ratings):
+        source = xapian.ValueMapPostingSource(slot)
+        source.set_default_weight(0)
+        for (pkgname, rating) in ratings:
+            source.add_mapping(pkgname, rating)
+        self.sources.append(source)
+        return xapian.Query(source)
+
+
 class ReviewLoader(GObject.GObject):
     """A loader that returns a review object list"""
 
@@ -236,6 +281,9 @@ class ReviewLoader(GObject.GObject):
     # cache the ReviewStats
     REVIEW_STATS_CACHE = {}
     _cache_version_old = False
+    # the dampened ratings of REVIEW_STATS_CACHE for the xapian matcher,
+    # see get_rating_query()
+    _rating_query = None
     _review_sort_methods = ReviewSortMethods.REVIEW_SORT_METHODS
 
     def __init__(self, cache, db, distro=None):
@@ -264,6 +312,12 @@ class ReviewLoader(GObject.GObject):
                 LOG.exception("review stats cache load failure")
                 os.rename(self.REVIEW_STATS_CACHE_FILE,
                     self.REVIEW_STATS_CACHE_FILE + ".fail")
+        self.connect("refresh-review-stats-finished",
+                     self._on_refresh_review_stats_finished)
+
+    def _on_refresh_review_stats_finished(self, loader, review_stats):
+        # rebuilt with the new stats on the next use
+        self._rating_query = None
 
     def _missing_histogram_in_cache(self):
         '''iterate through review stats to see if it has been fully reloaded
@@ -285,6 +339,26 @@ class ReviewLoader(GObject.GObject):
     def update_review_stats(self, translated_application, stats):
         application = Application("", translated_application.pkgname)
         self.REVIEW_STATS_CACHE[application] = stats
+        self._rating_query = None
+
+    def get_rating_query(self):
+        """ return a RatingQuery that weights every document with the
+            dampened rating of its package (0 for packages without
+            review stats)
+
+            Sorting a query that is combined with it by relevance gives
+            the top rated order without calling into python for every
+            document. The RatingQuery is built once for every refresh of
+            the review stats, a match that uses it must keep a reference
+            to it as the next refresh drops it here.
+        """
+        if self._rating_query is None:
+            axi_values = None
+            if self.db:
+                axi_values = self.db._axi_values
+            self._rating_query = RatingQuery(self.REVIEW_STATS_CACHE,
+                                             axi_values)
+        return self._rating_query
 
     def get_review_stats(self, translated_application):
         """return a ReviewStats (number of reviews, rating)
@@ -1,5 +1,9 @@
+import threading
+import weakref
 import xapian
 
+from gi.repository import GObject
+
 from softwarecenter.distro import get_distro
 from softwarecenter.enums import (XapianValues,
                                   AVAILABLE_FOR_PURCHASE_MAGIC_CHANNEL_NAME,
@@ -17,6 +21,100 @@ def get_global_filter():
     return global_filter
 
 
+def get_pkgnames_query(pkgnames):
+    """ return a flat xapian query that matches the documents of the
+        given pkgnames (and nothing if the list is empty)
+    """
+    terms = []
+    for pkgname in pkgnames:
+        terms.append("AP" + pkgname)
+        terms.append("XP" + pkgname)
+    if not terms:
+        return xapian.Query(xapian.Query.OP_AND_NOT,
+                            xapian.Query(""), xapian.Query(""))
+    return xapian.Query(xapian.Query.OP_OR, terms)
+
+
+class PackageStateQueries(object):
+    """ an in-memory overlay of the package states of the cache as xapian
+        queries over the pkgname terms of the database
+
+        The queries are built on first use and dropped again when the
+        database gets reopened or the package cache got reloaded.
+    """
+
+    def __init__(self, db, cache):
+        self.db = db
+        self.cache = cache
+        self.distro = get_distro()
+        self._queries = {}
+        self._pkgnames = None
+        self._lock = threading.Lock()
+        db.connect("reopen", self._on_invalidate)
+        if isinstance(cache, GObject.GObject):
+            cache.connect("cache-ready", self._on_invalidate)
+
+    def _on_invalidate(self, *args):
+        with self._lock:
+            self._queries = {}
+            self._pkgnames = None
+
+    def _get_pkgnames(self):
+        """ return the set of pkgnames that have documents in the db """
+        if self._pkgnames is None:
+            pkgnames = set()
+            for prefix in ("AP", "XP"):
+                for item in self.db.xapiandb.allterms(prefix):
+                    pkgname = item.term[len(prefix):]
+                    # skip terms of other (uppercase) prefixes that
+                    # start with the same letters
+                    if pkgname[:1].islower() or pkgname[:1].isdigit():
+                        pkgnames.add(pkgname)
+            self._pkgnames = pkgnames
+        return self._pkgnames
+
+    def _make_query(self, state):
+        cache = self.cache
+        pkgnames = self._get_pkgnames()
+        if state == "installed":
+            return get_pkgnames_query(
+                [pkgname for pkgname in pkgnames
+                 if pkgname in cache and cache[pkgname].is_installed])
+        elif state == "unavailable":
+            # items that are available for purchase are not in the cache
+            return xapian.Query(
+                xapian.Query.OP_AND_NOT,
+                get_pkgnames_query(
+                    [pkgname for pkgname in pkgnames
+                     if pkgname not in cache]),
+                xapian.Query("AH" + AVAILABLE_FOR_PURCHASE_MAGIC_CHANNEL_NAME))
+        elif state == "supported":
+            # the distro implementations only look at the cache
+            return get_pkgnames_query(
+                [pkgname for pkgname in pkgnames
+                 if self.distro.is_supported(cache, None, pkgname)])
+        raise ValueError("unknown package state '%s'" % state)
+
+    def get_query(self, state):
+        """ return the query that matches the documents of the packages in
+            the given state ("installed", "unavailable" or "supported")
+        """
+        with self._lock:
+            if state not in self._queries:
+                self._queries[state] = self._make_query(state)
+            return self._queries[state]
+
+
+_package_state_queries = weakref.WeakKeyDictionary()
+
+
+def get_package_state_queries(db, cache):
+    """ return the PackageStateQueries shared by all filters of the db """
+    if db not in _package_state_queries:
+        _package_state_queries[db] = PackageStateQueries(db, cache)
+    return _package_state_queries[db]
+
+
 class AppFilter(xapian.MatchDecider):
     """
     Filter that can be hooked into xapian get_mset to filter for criteria that
@@ -33,6 +131,8 @@ class AppFilter(xapian.MatchDecider):
         self.installed_only = False
         self.not_installed_only = False
         self.restricted_list = False
+        # the number of documents that got filtered in python
+        self.nr_calls = 0
 
     @property
     def required(self):
@@ -76,8 +176,51 @@ class AppFilter(xapian.MatchDecider):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def get_state(self):
+        """ return the state of the filter as a hashable tuple """
+        if self.restricted_list is not False:
+            restricted_list = frozenset(self.restricted_list)
+        else:
+            restricted_list = False
+        return (self.available_only,
+                global_filter.supported_only,
+                self.installed_only,
+                self.not_installed_only,
+                restricted_list)
+
+    def filter_query(self, query):
+        """ return the query restricted to the documents that pass the
+            filter or None if the package cache is not ready yet, the
+            filter has to be used as a MatchDecider then
+        """
+        if self.restricted_list is not False:
+            query = xapian.Query(xapian.Query.OP_FILTER, query,
+                                 get_pkgnames_query(self.restricted_list))
+        if not (self.available_only or
+                global_filter.supported_only or
+                self.installed_only or
+                self.not_installed_only):
+            return query
+        if not self.cache.ready:
+            return None
+        states = get_package_state_queries(self.db, self.cache)
+        if self.available_only:
+            query = xapian.Query(xapian.Query.OP_AND_NOT, query,
+                                 states.get_query("unavailable"))
+        if self.installed_only:
+            query = xapian.Query(xapian.Query.OP_FILTER, query,
+                                 states.get_query("installed"))
+        if self.not_installed_only:
+            query = xapian.Query(xapian.Query.OP_AND_NOT, query,
+                                 states.get_query("installed"))
+        if global_filter.supported_only:
+            query = xapian.Query(xapian.Query.OP_FILTER, query,
+                                 states.get_query("supported"))
+        return query
+
     def __call__(self, doc):
         """return True if the package should be displayed"""
+        self.nr_calls += 1
         # get pkgname from document
         pkgname = self.db.get_pkgname(doc)
         #logging.debug(
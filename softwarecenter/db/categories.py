@@ -148,8 +148,11 @@ class RecommendedForYouCategory(Category):
                                    ),
         }
 
-    def __init__(self, subcategory=None):
+    def __init__(self, subcategory=None, db=None):
         self.subcategory = subcategory
+        # the recommendations of a subcategory are looked up in the
+        # category members of the db if there is one
+        self.db = db
         if subcategory:
             # this is the set of recommendations for a given subcategory
             cat_title = u"Recommended For You in %s" % (
@@ -178,7 +181,12 @@ class RecommendedForYouCategory(Category):
         pkgs = []
         for item in result_list['data']:
             pkgs.append(item['package_name'])
-        if self.subcategory:
+        if self.subcategory and self.db:
+            self.query = get_query_for_pkgnames(
+                [pkgname for pkgname in pkgs
+                 if self.db.pkg_in_category(pkgname,
+                                            self.subcategory.query)])
+        elif self.subcategory:
             self.query = xapian.Query(xapian.Query.OP_AND,
                                   get_query_for_pkgnames(pkgs),
                                   self.subcategory.query)
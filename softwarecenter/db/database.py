@@ -16,16 +16,24 @@
 # this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import json
 import locale
 import logging
 import os
 import re
 import string
-import threading
 import xapian
 from softwarecenter.db.application import Application
-from softwarecenter.db.utils import get_query_for_pkgnames
+from softwarecenter.db.utils import (
+    get_current_generation,
+    get_query_for_pkgnames,
+    lock_generation,
+    )
+from softwarecenter.db.lookup import DocidLookupIndex
 from softwarecenter.db.pkginfo import get_pkg_info
+from softwarecenter.db.pool import XapianConnectionPool
+from softwarecenter.db.profiling import QueryProfile, QueryProfiler
+from softwarecenter.utils import utf8
 import softwarecenter.paths
 
 from gi.repository import GObject, Gio
@@ -42,6 +50,19 @@ from gettext import gettext as _
 
 LOG = logging.getLogger(__name__)
 
+# partial words that expand to more terms than this are not expanded
+# (LP: #634449)
+MAX_PARTIAL_TERMS = 1000
+
+# the number of matches that are checked for a count that does not need
+# to be exact, the count is an estimate above that
+COUNT_CHECK_AT_LEAST = 200
+
+# the number of categories that get_category_counts() counts in a single
+# match, the weight of a match has one bit per category and a double has
+# 53 bits of mantissa
+CATEGORY_COUNT_CHUNK = 48
+
 
 def parse_axi_values_file(filename="/var/lib/apt-xapian-index/values"):
     """ parse the apt-xapian-index "values" file and provide the
@@ -59,6 +80,29 @@ def parse_axi_values_file(filename="/var/lib/apt-xapian-index/values"):
     return axi_values
 
 
+def get_axi_stamp():
+    """ return the mtime of the apt-xapian-index update stamp or None if
+        there is no apt-xapian-index
+    """
+    try:
+        return os.path.getmtime(
+            softwarecenter.paths.APT_XAPIAN_INDEX_UPDATE_STAMP_PATH)
+    except OSError:
+        return None
+
+
+def get_channels_stamp():
+    """ return the mtime of the stamp that the origin plugin of
+        apt-xapian-index touches when it reindexes the channels or None
+        if it never did
+    """
+    try:
+        return os.path.getmtime(
+            softwarecenter.paths.APT_XAPIAN_INDEX_CHANNELS_STAMP_PATH)
+    except OSError:
+        return None
+
+
 class SearchQuery(list):
     """ a list wrapper for a search query. it can take a search string
         or a list of search strings
@@ -89,32 +133,132 @@ class SearchQuery(list):
         return "[%s]" % ",".join([str(q) for q in self])
 
 
+def get_sort_key_locale():
+    """ return the collation locale that locale.strxfrm() uses, the
+        XapianValues.APPNAME_SORT_KEY values of the index are only valid
+        for the locale they were built with
+    """
+    return locale.setlocale(locale.LC_COLLATE)
+
+
+def make_sort_key(name):
+    """ return the XapianValues.APPNAME_SORT_KEY value of the given name
+        for the current collation locale
+    """
+    return locale.strxfrm(utf8(name))
+
+
+class SearchSession(object):
+    """ a search-as-you-type session of a search entry
+
+        While typing, the new search term usually only extends the last
+        word of the previous one ("fire" -> "firef"). The terms of the
+        database that start with the last word are kept, so the partial
+        word gets expanded by narrowing them instead of walking the terms
+        of the whole database again. Search terms with xapian prefixes or
+        boolean operators are parsed by the QueryParser as usual.
+    """
+
+    # set to False to always use the full QueryParser expansion
+    incremental = True
+
+    SIMPLE_SEARCH_RE = re.compile(r"^[^\W_]+(\s+[^\W_]+)*$", re.UNICODE)
+    BOOLEAN_OPERATORS = ("AND", "OR", "NOT", "XOR", "NEAR", "ADJ")
+
+    def __init__(self, db):
+        self.db = db
+        self._partial_word = None
+        self._partial_terms = []
+        db.connect("reopen", self._on_reopen)
+
+    def _on_reopen(self, db):
+        self.reset()
+
+    def reset(self):
+        """ forget the cached expansion of the last word """
+        self._partial_word = None
+        self._partial_terms = []
+
+    def get_partial_terms(self, word):
+        """ return the terms of the database that start with word """
+        narrow = (self._partial_word is not None and
+                  word.startswith(self._partial_word))
+        if narrow:
+            terms = [term for term in self._partial_terms
+                     if term.startswith(word)]
+        else:
+            terms = [item.term for item in self.db.xapiandb.allterms(word)]
+        self._partial_word = word
+        self._partial_terms = terms
+        return terms
+
+    def get_fuzzy_query(self, search_term):
+        """ return the query of the search term with the last word
+            expanded as a partial word or None if the search term needs
+            the QueryParser
+        """
+        if not self.incremental:
+            return None
+        search_term = unicode(search_term, "utf-8", "ignore")
+        if not self.SIMPLE_SEARCH_RE.match(search_term):
+            return None
+        words = search_term.split()
+        for word in words:
+            if word in self.BOOLEAN_OPERATORS:
+                return None
+        words = [word.lower().encode("utf-8") for word in words]
+        terms = self.get_partial_terms(words[-1])
+        if len(terms) > MAX_PARTIAL_TERMS:
+            return None
+        # this is what the QueryParser does with FLAG_PARTIAL
+        query = xapian.Query(words[-1])
+        if terms:
+            query = xapian.Query(xapian.Query.OP_OR,
+                                 xapian.Query(xapian.Query.OP_SYNONYM, terms),
+                                 query)
+        if len(words) > 1:
+            query = xapian.Query(xapian.Query.OP_AND,
+                                 [xapian.Query(word) for word in words[:-1]] +
+                                 [query])
+        return query
+
+
 class LocaleSorter(xapian.KeyMaker):
     """ Sort in a locale friendly way by using locale.xtrxfrm """
     def __init__(self, db):
         super(LocaleSorter, self).__init__()
         self.db = db
+        self.nr_calls = 0
 
     def __call__(self, doc):
+        self.nr_calls += 1
         return locale.strxfrm(
             doc.get_value(self.db._axi_values["display_name"]))
 
 
-class TopRatedSorter(xapian.KeyMaker):
-    """ Sort using the top rated data """
-    def __init__(self, db, review_loader):
-        super(TopRatedSorter, self).__init__()
-        self.db = db
-        self.review_loader = review_loader
+class CategoryTally(xapian.MatchSpy):
+    """ tally the weights of the matches of _count_categories(), a weight
+        is the set of the categories of a document as bits
+    """
+    def __init__(self):
+        super(CategoryTally, self).__init__()
+        self.tally = {}
 
-    def __call__(self, doc):
-        app = Application(self.db.get_appname(doc),
-                          self.db.get_pkgname(doc))
-        stats = self.review_loader.get_review_stats(app)
-        import xapian
-        if stats:
-            return xapian.sortable_serialise(stats.dampened_rating)
-        return xapian.sortable_serialise(0)
+    def __call__(self, doc, weight):
+        bits = int(round(weight))
+        self.tally[bits] = self.tally.get(bits, 0) + 1
+
+
+class DocidCollector(xapian.MatchSpy):
+    """ collect the docids of all the matches of a query, see
+        StoreDatabase._get_category_members()
+    """
+    def __init__(self):
+        super(DocidCollector, self).__init__()
+        self.docids = set()
+
+    def __call__(self, doc, weight):
+        self.docids.add(doc.get_docid())
 
 
 class StoreDatabase(GObject.GObject):
@@ -148,48 +292,82 @@ class StoreDatabase(GObject.GObject):
         self._additional_databases = []
         # the xapian values as read from /var/lib/apt-xapian-index/values
         self._axi_values = {}
-        # we open one db per thread, thread names are reused eventually
-        # so no memory leak
-        self._db_per_thread = {}
-        self._parser_per_thread = {}
+        # every thread uses its own reader handle of the pool
+        self._pool = XapianConnectionPool(self._get_new_xapiandb)
+        # the docids of the apps and packages, rebuilt after a reopen
+        self._docid_index = DocidLookupIndex(self)
+        # the number of documents of the categories, see
+        # get_category_counts()
+        self._category_counts = {}
+        # the docids of the documents of the category queries, see
+        # get_categories_for_docid()
+        self._category_members = {}
+        # the timings of the queries, see QueryProfiler
+        self.profiler = QueryProfiler()
+        # the "mimetype-table" metadata, see
+        # get_most_popular_applications_for_mimetypes()
+        self._mimetype_table = None
+        self._other_mimetypes = set()
         self._axi_stamp_monitor = None
+        # the generation directory of the database that is used and the
+        # reader lock that keeps it from being garbage collected
+        self._generation_path = None
+        self._generation_lock = None
+        # the apt-xapian-index update stamp when the database got opened
+        self._opened_axi_stamp = None
 
     @property
     def xapiandb(self):
         """ returns a per thread db """
-        thread_name = threading.current_thread().name
-        if not thread_name in self._db_per_thread:
-            self._db_per_thread[thread_name] = self._get_new_xapiandb()
-        return self._db_per_thread[thread_name]
+        return self._pool.get().xapiandb
 
     @property
     def xapian_parser(self):
         """ returns a per thread query parser """
-        thread_name = threading.current_thread().name
-        if not thread_name in self._parser_per_thread:
-            xapian_parser = self._get_new_xapian_parser()
-            self._parser_per_thread[thread_name] = xapian_parser
-        return self._parser_per_thread[thread_name]
+        conn = self._pool.get()
+        if conn.parser is None:
+            conn.parser = self._get_new_xapian_parser()
+        return conn.parser
+
+    def release_xapiandb(self):
+        """ give the reader handle of the current thread back to the
+            pool, e.g. once a query job is done
+        """
+        self._pool.release()
+
+    def get_pool_stats(self):
+        """ return the statistics of the pool of xapian reader handles """
+        return self._pool.get_stats()
 
     def _get_new_xapiandb(self):
-        xapiandb = xapian.Database(self._db_pathname)
+        # all threads use the same generation, even if a new one got
+        # published in the meantime
+        xapiandb = xapian.Database(
+            self._generation_path or self._db_pathname)
+        for db in self._get_other_databases():
+            xapiandb.add_database(db)
+        return xapiandb
+
+    def _get_other_databases(self):
+        """ return the list of the databases that are searched together
+            with the software-center database
+        """
+        databases = []
         if self._use_axi:
             try:
-                axi = xapian.Database(
-                    softwarecenter.paths.APT_XAPIAN_INDEX_DB_PATH)
-                xapiandb.add_database(axi)
+                databases.append(xapian.Database(
+                    softwarecenter.paths.APT_XAPIAN_INDEX_DB_PATH))
             except:
                 LOG.exception("failed to add apt-xapian-index")
         if (self._use_agent and
             os.path.exists(XAPIAN_BASE_PATH_SOFTWARE_CENTER_AGENT)):
             try:
-                sca = xapian.Database(XAPIAN_BASE_PATH_SOFTWARE_CENTER_AGENT)
-                xapiandb.add_database(sca)
+                databases.append(
+                    xapian.Database(XAPIAN_BASE_PATH_SOFTWARE_CENTER_AGENT))
             except Exception as e:
                 logging.warn("failed to add sca db %s" % e)
-        for db in self._additional_databases:
-            xapiandb.add_database(db)
-        return xapiandb
+        databases.extend(self._additional_databases)
+        return databases
 
     def _get_new_xapian_parser(self):
         xapian_parser = xapian.QueryParser()
@@ -211,8 +389,18 @@ class StoreDatabase(GObject.GObject):
         if pathname:
             self._db_pathname = pathname
         # clean existing DBs on open
-        self._db_per_thread = {}
-        self._parser_per_thread = {}
+        self._pool.reset()
+        self._docid_index = DocidLookupIndex(self)
+        self._category_counts = {}
+        self._category_members = {}
+        self._mimetype_table = None
+        self._other_mimetypes = set()
+        # lock the current generation before the old one is released
+        old_lock = self._generation_lock
+        (self._generation_path,
+         self._generation_lock) = lock_generation(self._db_pathname)
+        if old_lock:
+            old_lock.close()
         # add the apt-xapian-database for here (we don't do this
         # for now as we do not have a good way to integrate non-apps
         # with the UI)
@@ -220,6 +408,7 @@ class StoreDatabase(GObject.GObject):
         self._use_axi = use_axi
         self._use_agent = use_agent
         if use_axi:
+            self._opened_axi_stamp = get_axi_stamp()
             if self._axi_stamp_monitor:
                 self._axi_stamp_monitor.disconnect_by_func(
                     self._on_axi_stamp_changed)
@@ -251,7 +440,12 @@ class StoreDatabase(GObject.GObject):
         if self._timeout_id:
             GObject.source_remove(self._timeout_id)
             self._timeout_id = None
-        self._timeout_id = GObject.timeout_add(500, self.reopen)
+        self._timeout_id = GObject.timeout_add(500, self._on_axi_timeout)
+
+    def _on_axi_timeout(self):
+        self._timeout_id = None
+        self.reopen_if_changed()
+        return False
 
     def add_database(self, database):
         self._additional_databases.append(database)
@@ -270,6 +464,35 @@ class StoreDatabase(GObject.GObject):
         """
         return self.xapiandb.get_metadata("db-schema-version")
 
+    def has_new_generation(self):
+        """ return True if a new generation of the database got published
+            since it was opened, this is only a readlink() and cheap
+            enough to be called often
+        """
+        return (get_current_generation(self._db_pathname) !=
+                self._generation_path)
+
+    def reopen_if_changed(self):
+        """ reopen the database unless it is a generation that is still
+            current and apt-xapian-index did not get updated since it was
+            opened, return True if it got reopened
+        """
+        if (self._generation_path is not None and
+                not self.has_new_generation() and
+                (not self._use_axi or
+                 get_axi_stamp() == self._opened_axi_stamp)):
+            LOG.debug("database did not change, not reopening it")
+            return False
+        self.reopen()
+        return True
+
+    def has_sort_keys(self):
+        """ return True if the XapianValues.APPNAME_SORT_KEY values of the
+            database were built for the current collation locale
+        """
+        return (self.xapiandb.get_metadata("sort-key-locale") ==
+                get_sort_key_locale())
+
     def reopen(self):
         """ reopen the database """
         LOG.info("reopen() database")
@@ -283,10 +506,99 @@ class StoreDatabase(GObject.GObject):
         assert popcon_max > 0
         return popcon_max
 
+    def get_category_counts(self, categories, query=None):
+        """ return a dict of Category to the number of documents of the
+            given categories and all their subcategories, optionally only
+            counting the documents that match the query, counts[None] is
+            the number of all the documents (that match the query)
+
+            The categories that were not counted yet are counted with a
+            single match (per CATEGORY_COUNT_CHUNK categories), see
+            _count_categories(). The counts are kept until the database
+            gets reopened.
+        """
+        if query is None:
+            restrict = None
+        else:
+            restrict = str(query)
+        all_cats = []
+        uncounted = {}
+        categories = list(categories)
+        while categories:
+            cat = categories.pop()
+            categories.extend(cat.subcategories)
+            all_cats.append(cat)
+            key = (str(cat.query), restrict)
+            if key not in self._category_counts:
+                uncounted[key] = cat.query
+        uncounted = uncounted.items()
+        chunks = [uncounted[i:i + CATEGORY_COUNT_CHUNK]
+                  for i in range(0, len(uncounted), CATEGORY_COUNT_CHUNK)]
+        total_key = (None, restrict)
+        if total_key not in self._category_counts:
+            # the first match counts all the documents too
+            chunks = chunks or [[]]
+            self._count_categories(chunks.pop(0), query, total_key)
+        for chunk in chunks:
+            self._count_categories(chunk, query)
+        counts = {None: self._category_counts[total_key]}
+        for cat in all_cats:
+            counts[cat] = self._category_counts[(str(cat.query), restrict)]
+        return counts
+
+    def _count_categories(self, keys_and_queries, query=None,
+                          total_key=None):
+        """ count the documents of the (key, category query) pairs with a
+            single match and store the counts in self._category_counts,
+            the number of all the documents is stored as total_key if
+            it is given
+
+            Every category query filters a FixedWeightPostingSource that
+            is scaled to its own bit, so the weight of a match is the set
+            of the categories the document is in. A CategoryTally match
+            spy counts the matches per weight, so the match does not
+            build a mset of all the documents.
+        """
+        sources = []
+        subqueries = []
+        for (bit, (key, cat_query)) in enumerate(keys_and_queries):
+            # the query does not keep the python object alive
+            source = xapian.FixedWeightPostingSource(1.0)
+            sources.append(source)
+            subqueries.append(xapian.Query(
+                xapian.Query.OP_SCALE_WEIGHT,
+                xapian.Query(xapian.Query.OP_FILTER,
+                             xapian.Query(source), cat_query),
+                float(1 << bit)))
+        if total_key is not None:
+            # the documents that are in no category have the weight 0
+            subqueries.append(xapian.Query(xapian.Query.OP_SCALE_WEIGHT,
+                                           xapian.Query(""), 0))
+        count_query = xapian.Query(xapian.Query.OP_OR, subqueries)
+        if query is not None:
+            count_query = xapian.Query(xapian.Query.OP_FILTER,
+                                       count_query, query)
+        enquire = xapian.Enquire(self.xapiandb)
+        enquire.set_query(count_query)
+        tally = CategoryTally()
+        enquire.add_matchspy(tally)
+        # the spy sees every match, the mset itself stays empty
+        enquire.get_mset(0, 0, self.xapiandb.get_doccount())
+        enquire.clear_matchspies()
+        # most documents are in the same few combinations of categories
+        for (bit, (key, cat_query)) in enumerate(keys_and_queries):
+            self._category_counts[key] = sum(
+                [nr_docs for (doc_bits, nr_docs) in tally.tally.items()
+                 if doc_bits & (1 << bit)])
+        if total_key is not None:
+            self._category_counts[total_key] = sum(tally.tally.values())
+
     def get_query_list_from_search_entry(self, search_term,
-        category_query=None):
+        category_query=None, session=None, query_class="search"):
         """ get xapian.Query from a search term string and a limit the
-            search to the given category
+            search to the given category, the optional SearchSession
+            reuses the expansion of the previous search term, the parsing
+            is profiled under the given query_class (see QueryProfiler)
         """
         def _add_category_to_query(query):
             """ helper that adds the current category to the query"""
@@ -337,14 +649,21 @@ class StoreDatabase(GObject.GObject):
         if not ':' in search_term:  # ie, not a mimetype query
             # we need this to work around xapian oddness
             search_term = search_term.replace('-', '_')
-        fuzzy_query = self.xapian_parser.parse_query(search_term,
-                                           xapian.QueryParser.FLAG_PARTIAL |
-                                           xapian.QueryParser.FLAG_BOOLEAN)
-        # if the query size goes out of hand, omit the FLAG_PARTIAL
-        # (LP: #634449)
-        if fuzzy_query.get_length() > 1000:
-            fuzzy_query = self.xapian_parser.parse_query(search_term,
-                                            xapian.QueryParser.FLAG_BOOLEAN)
+        profile = QueryProfile(query_class)
+        with profile.measure("parse"):
+            fuzzy_query = None
+            if session is not None:
+                fuzzy_query = session.get_fuzzy_query(search_term)
+            if fuzzy_query is None:
+                fuzzy_query = self.xapian_parser.parse_query(search_term,
+                    xapian.QueryParser.FLAG_PARTIAL |
+                    xapian.QueryParser.FLAG_BOOLEAN)
+            # if the query size goes out of hand, omit the FLAG_PARTIAL
+            # (LP: #634449)
+            if fuzzy_query.get_length() > MAX_PARTIAL_TERMS:
+                fuzzy_query = self.xapian_parser.parse_query(search_term,
+                    xapian.QueryParser.FLAG_BOOLEAN)
+        self.profiler.record(profile)
         # now add categories
         fuzzy_query = _add_category_to_query(fuzzy_query)
         return SearchQuery([pkg_query, fuzzy_query])
@@ -367,6 +686,32 @@ class StoreDatabase(GObject.GObject):
         matches = self.get_matches_from_query(query, start, end, category)
         return [m.document for m in matches]
 
+    def get_matches_count(self, query, xfilter=None, exact=True,
+                          check_at_least=COUNT_CHECK_AT_LEAST):
+        """ return the number of documents that match the xapian.Query
+            (and the optional xapian.MatchDecider xfilter)
+
+            The matches are only counted, no mset gets built. If exact
+            is False the count is exact up to check_at_least matches and
+            an estimate above that. Without a filter the count of a
+            single term query is the term frequency, that needs no match
+            at all.
+        """
+        if xfilter is None:
+            if str(query) == str(xapian.Query("")):
+                return self.xapiandb.get_doccount()
+            terms = [term for term in query]
+            single_term = (len(terms) == 1 and
+                           str(query) == str(xapian.Query(terms[0])))
+            if single_term:
+                return self.xapiandb.get_termfreq(terms[0])
+        if exact:
+            check_at_least = self.xapiandb.get_doccount()
+        enquire = xapian.Enquire(self.xapiandb)
+        enquire.set_query(query)
+        matches = enquire.get_mset(0, 0, check_at_least, None, xfilter)
+        return matches.get_matches_estimated()
+
     def get_spelling_correction(self, search_term):
         # get a search query
         if not ':' in search_term:  # ie, not a mimetype query
@@ -381,6 +726,79 @@ class StoreDatabase(GObject.GObject):
         """ return a list of the most popular applications for the given
             mimetype
         """
+        return self.get_most_popular_applications_for_mimetypes(
+            [mimetype], only_uninstalled, num)[mimetype]
+
+    def get_most_popular_applications_for_mimetypes(self, mimetypes,
+                                                    only_uninstalled=True,
+                                                    num=3):
+        """ return a dict with the list of the most popular applications
+            for each of the given mimetypes
+
+            The applications are read from the table that got recorded at
+            index time, no query is needed for them. The table only covers
+            the software-center database, the mimetypes that the other
+            databases (e.g. the one of the software-center-agent) have
+            applications for are looked up with a query. The installed
+            state of every application is looked up only once for all the
+            mimetypes.
+        """
+        table = self._get_mimetype_table()
+        uninstalled = {}
+        result = {}
+        for mimetype in mimetypes:
+            if table is None or mimetype in self._other_mimetypes:
+                result[mimetype] = (
+                    self._get_most_popular_applications_from_query(
+                        mimetype, only_uninstalled, num, uninstalled))
+                continue
+            apps = []
+            for (appname, pkgname, popcon) in table.get(mimetype, ()):
+                app = Application(appname, pkgname, popcon=popcon)
+                if only_uninstalled:
+                    if not self._is_uninstalled(app, uninstalled):
+                        continue
+                apps.append(app)
+                if len(apps) == num:
+                    break
+            result[mimetype] = apps
+        return result
+
+    def _is_uninstalled(self, app, uninstalled):
+        """ return True if the pkg_state of the application is
+            UNINSTALLED, the dict uninstalled keeps the states
+        """
+        key = (app.appname, app.pkgname)
+        if key not in uninstalled:
+            uninstalled[key] = (
+                app.get_details(self).pkg_state == PkgStates.UNINSTALLED)
+        return uninstalled[key]
+
+    def _get_mimetype_table(self):
+        """ return the dict of mimetype to (appname, pkgname, popcon)
+            lists of the database, most popular first, or None if the
+            database has no table
+        """
+        if self._mimetype_table is None:
+            table = self.xapiandb.get_metadata("mimetype-table")
+            if not table:
+                return None
+            mimetype_table = {}
+            for mimetype, apps in json.loads(table).items():
+                mimetype_table[utf8(mimetype)] = tuple(
+                    [(utf8(appname), utf8(pkgname), popcon)
+                     for (appname, pkgname, popcon) in apps])
+            self._mimetype_table = mimetype_table
+            # the mimetypes of the documents that are not in the table
+            self._other_mimetypes = set()
+            for db in self._get_other_databases():
+                self._other_mimetypes.update(
+                    [item.term[2:] for item in db.allterms("AM")])
+        return self._mimetype_table
+
+    def _get_most_popular_applications_from_query(self, mimetype,
+                                                  only_uninstalled, num,
+                                                  uninstalled=None):
         # sort by popularity by default
         enquire = xapian.Enquire(self.xapiandb)
         enquire.set_sort_by_value_then_relevance(XapianValues.POPCON)
@@ -389,13 +807,15 @@ class StoreDatabase(GObject.GObject):
         enquire.set_query(query)
         # mset just needs to be "big enough""
         matches = enquire.get_mset(0, 100)
+        if uninstalled is None:
+            uninstalled = {}
         apps = []
         for match in matches:
             doc = match.document
             app = Application(self.get_appname(doc), self.get_pkgname(doc),
                               popcon=self.get_popcon(doc))
             if only_uninstalled:
-                if app.get_details(self).pkg_state == PkgStates.UNINSTALLED:
+                if self._is_uninstalled(app, uninstalled):
                     apps.append(app)
             else:
                 apps.append(app)
@@ -452,27 +872,58 @@ class StoreDatabase(GObject.GObject):
         iconname = doc.get_value(XapianValues.ICON)
         return iconname
 
+    def _get_category_members(self, cat_query):
+        """ return the frozenset of the docids that match the category
+            query, it is computed once per query until the database
+            gets reopened
+        """
+        key = str(cat_query)
+        members = self._category_members.get(key)
+        if members is None:
+            terms = list(cat_query)
+            if cat_query.get_length() == 1 and len(terms) == 1:
+                # a single term (or "" for all documents) is just its
+                # posting list
+                members = frozenset(
+                    [p.docid for p in self.xapiandb.postlist(terms[0])])
+            else:
+                # only the docids are needed, the spy sees all of them
+                # without building a mset of the whole database
+                enquire = xapian.Enquire(self.xapiandb)
+                enquire.set_query(cat_query)
+                enquire.set_weighting_scheme(xapian.BoolWeight())
+                collector = DocidCollector()
+                enquire.add_matchspy(collector)
+                enquire.get_mset(0, 0, self.xapiandb.get_doccount())
+                members = frozenset(collector.docids)
+            self._category_members[key] = members
+        return members
+
     def pkg_in_category(self, pkgname, cat_query):
         """ Return True if the given pkg is in the given category """
-        pkg_query1 = xapian.Query("AP" + pkgname)
-        pkg_query2 = xapian.Query("XP" + pkgname)
-        pkg_query = xapian.Query(xapian.Query.OP_OR, pkg_query1, pkg_query2)
-        pkg_and_cat_query = xapian.Query(xapian.Query.OP_AND, pkg_query,
-            cat_query)
-        enquire = xapian.Enquire(self.xapiandb)
-        enquire.set_query(pkg_and_cat_query)
-        matches = enquire.get_mset(0, len(self))
-        if matches:
-            return True
+        members = self._get_category_members(cat_query)
+        for prefix in ("AP", "XP"):
+            for docid in self._docid_index.get_docids(prefix, pkgname):
+                if docid in members:
+                    return True
         return False
 
+    def get_categories_for_pkgname(self, pkgname, categories):
+        """ Return the list of the given categories that the pkg is in """
+        return [cat for cat in categories
+                if self.pkg_in_category(pkgname, cat.query)]
+
+    def get_categories_for_docid(self, docid, categories):
+        """ Return the list of the given categories that the document
+            with the given docid is in
+        """
+        return [cat for cat in categories
+                if docid in self._get_category_members(cat.query)]
+
     def get_apps_for_pkgname(self, pkgname):
         """ Return set of docids with the matching applications for the
             given pkgname """
-        result = set()
-        for m in self.xapiandb.postlist("AP" + pkgname):
-            result.add(m.docid)
-        return result
+        return set(self._docid_index.get_docids("AP", pkgname))
 
     def get_icon_download_url(self, doc):
         """ Return the url of the icon or None """
@@ -496,19 +947,15 @@ class StoreDatabase(GObject.GObject):
         #LOG.debug("get_xapian_document app='%s' pkg='%s'" % (appname,
         #    pkgname))
         # first search for appname in the app-install-data namespace
-        for m in self.xapiandb.postlist("AA" + appname):
-            doc = self.xapiandb.get_document(m.docid)
-            if doc.get_value(XapianValues.PKGNAME) == pkgname:
-                return doc
-        # then search for pkgname in the app-install-data namespace
-        for m in self.xapiandb.postlist("AP" + pkgname):
-            doc = self.xapiandb.get_document(m.docid)
-            if doc.get_value(XapianValues.PKGNAME) == pkgname:
-                return doc
+        for docid in self._docid_index.get_app_docids(appname, pkgname):
+            return self.xapiandb.get_document(docid)
+        # then search for pkgname in the app-install-data namespace, the
+        # pkgname value of these documents is the pkgname of the term
+        for docid in self._docid_index.get_docids("AP", pkgname):
+            return self.xapiandb.get_document(docid)
         # then look for matching packages from a-x-i
-        for m in self.xapiandb.postlist("XP" + pkgname):
-            doc = self.xapiandb.get_document(m.docid)
-            return doc
+        for docid in self._docid_index.get_docids("XP", pkgname):
+            return self.xapiandb.get_document(docid)
         # no matching document found
         raise IndexError("No app '%s' for '%s' in database" % (appname,
             pkgname))
@@ -517,10 +964,7 @@ class StoreDatabase(GObject.GObject):
         """Check if the given appname is stored multiple times in the db
            This can happen for generic names like "Terminal"
         """
-        for (i, m) in enumerate(self.xapiandb.postlist("AA" + appname)):
-            if i > 0:
-                return True
-        return False
+        return len(self._docid_index.get_docids("AA", appname)) > 1
 
     def get_installed_purchased_packages(self):
         """ return a set() of packagenames of purchased apps that are
@@ -547,6 +991,32 @@ class StoreDatabase(GObject.GObject):
                 origins.add(term.term[3:])
         return list(origins)
 
+    def get_channel_catalogue(self):
+        """ return the list of (label, origin, component, nr_pkgs,
+            nr_installed) tuples of the channels that got recorded at
+            index time or None if there is no catalogue for the
+            apt-xapian-index that is used, the channels are then found
+            with get_origins_from_db() and the "XOL" terms
+        """
+        if not self._use_axi:
+            return None
+        catalogue = self.xapiandb.get_metadata("channel-catalogue")
+        if not catalogue:
+            return None
+        catalogue = json.loads(catalogue)
+        # the catalogue is only valid for the apt-xapian-index it got
+        # built with, a later axi update may have added channels (the
+        # origin plugin touches its stamp as soon as it reindexes them)
+        if (catalogue.get("axi-stamp") != get_axi_stamp() or
+                catalogue.get("channels-stamp") != get_channels_stamp()):
+            return None
+        channels = []
+        for (label, origin, component, nr_pkgs,
+             nr_installed) in catalogue["channels"]:
+            channels.append((utf8(label), utf8(origin), utf8(component),
+                             nr_pkgs, nr_installed))
+        return channels
+
     def get_exact_matches(self, pkgnames=[]):
         """Returns a list of fake MSetItems. If the pkgname is available, then
            MSetItem.document is pkgnames proper xapian document. If the pkgname
@@ -558,10 +1028,10 @@ class StoreDatabase(GObject.GObject):
             if '?' in pkgname:
                 app.request = pkgname.split('?')[1]
             match = app
-            for m in  self.xapiandb.postlist("XP" + app.pkgname):
-                match = self.xapiandb.get_document(m.docid)
-            for m in self.xapiandb.postlist("AP" + app.pkgname):
-                match = self.xapiandb.get_document(m.docid)
+            for prefix in ("XP", "AP"):
+                docids = self._docid_index.get_docids(prefix, app.pkgname)
+                if docids:
+                    match = self.xapiandb.get_document(docids[-1])
             matches.append(FakeMSetItem(match))
         return matches
 
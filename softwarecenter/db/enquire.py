@@ -18,10 +18,12 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
 import logging
-import time
 import threading
+import weakref
 import xapian
 
+from collections import OrderedDict, Sequence, namedtuple
+
 from gi.repository import GObject
 
 from softwarecenter.enums import (SortMethods,
@@ -29,12 +31,154 @@ from softwarecenter.enums import (SortMethods,
                                   NonAppVisibility,
                                   DEFAULT_SEARCH_LIMIT)
 from softwarecenter.db.database import (
-    SearchQuery, LocaleSorter, TopRatedSorter)
+    SearchQuery, LocaleSorter)
+from softwarecenter.db.executor import QueryJob, get_query_executor
+from softwarecenter.db.profiling import QueryProfile
 from softwarecenter.distro import get_distro
 from softwarecenter.utils import ExecutionTime
 
 LOG = logging.getLogger(__name__)
 
+# the number of query results that are cached per database
+RESULT_CACHE_SIZE = 32
+
+# the number of matches that paginated queries fetch at once
+MATCHES_PAGE_SIZE = 200
+
+
+class PaginatedMatches(Sequence):
+    """ the xapian.MSetItems of a query that are fetched page by page
+        when they are used
+
+        It is a read-only sequence that can be used like the list of
+        matches (len, indexing, slicing, iteration, in, index and count),
+        the number of matches is known up front.
+    """
+
+    def __init__(self, get_mset, nr_matches, page_size=MATCHES_PAGE_SIZE):
+        self._get_mset = get_mset
+        self._nr_matches = nr_matches
+        self.page_size = page_size
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._nr_matches
+
+    def _get_page(self, nr):
+        with self._lock:
+            if nr not in self._pages:
+                self._pages[nr] = list(self._get_mset(nr * self.page_size,
+                                                      self.page_size))
+            return self._pages[nr]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("match index out of range")
+        return self._get_page(index // self.page_size)[index % self.page_size]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_loaded_matches(self):
+        """ return the matches of the pages that got fetched so far """
+        with self._lock:
+            pages = [self._pages[nr] for nr in sorted(self._pages)]
+        return [match for page in pages for match in page]
+
+
+# the parameters of a search, they are frozen when the search gets
+# submitted so that set_query() does not change a running search
+SearchParams = namedtuple("SearchParams",
+                          ("search_query", "limit", "sortmode", "filter",
+                           "nonapps_visible", "exact_counts", "paginated",
+                           "match_docids", "query_class"))
+
+
+class SearchResult(object):
+    """ the matches and counts of a search
+
+        They are built by the search alone and set on the AppEnquire
+        in the main loop once the search is done (if it did not get
+        superseded by a newer one).
+    """
+
+    def __init__(self, params):
+        self.matches = []
+        self.match_docids = set(params.match_docids)
+        self.nr_apps = 0
+        self.nr_pkgs = 0
+        self.nonapps_visible = params.nonapps_visible
+
+
+class QueryResultCache(object):
+    """ a LRU cache of AppEnquire query results
+
+        It is cleared when the database gets reopened or the package
+        cache got reloaded. Results of queries that started before the
+        cache was cleared are not stored.
+    """
+
+    def __init__(self, db, cache, size=RESULT_CACHE_SIZE):
+        self.size = size
+        self.generation = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        db.connect("reopen", self._on_invalidate)
+        if isinstance(cache, GObject.GObject):
+            cache.connect("cache-ready", self._on_invalidate)
+
+    def _on_invalidate(self, *args):
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.generation += 1
+
+    def get(self, key):
+        """ return the cached result for key or None """
+        with self._lock:
+            result = self._results.pop(key, None)
+            if result is not None:
+                # most recently used
+                self._results[key] = result
+            return result
+
+    def put(self, key, result, generation):
+        """ store the result of a query that started at the given
+            generation of the cache
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._results.pop(key, None)
+            self._results[key] = result
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+
+
+_result_caches = weakref.WeakKeyDictionary()
+
+
+def get_result_cache(db, cache):
+    """ return the QueryResultCache of the given StoreDatabase """
+    if db not in _result_caches:
+        _result_caches[db] = QueryResultCache(db, cache)
+    return _result_caches[db]
+
+
+def get_nr_calls(callback):
+    """ return the number of calls of a python MatchDecider or KeyMaker
+        (or 0 for None)
+    """
+    return getattr(callback, "nr_calls", 0)
+
 
 class AppEnquire(GObject.GObject):
     """
@@ -69,10 +213,21 @@ class AppEnquire(GObject.GObject):
         self.limit = DEFAULT_SEARCH_LIMIT
         self.filter = None
         self.exact = False
+        # if False nr_apps and nr_pkgs are estimates for large results
+        self.exact_counts = True
+        # if True unlimited queries fetch their matches page by page
+        # when they are used instead of all at once
+        self.paginated = False
+        # the class of the queries in the histograms of the QueryProfiler
+        # of the db, like "search", "category", "channel" or "installed"
+        self.query_class = "other"
         self.nr_pkgs = 0
         self.nr_apps = 0
         self._matches = []
         self.match_docids = set()
+        self._search_job = None
+        self._search_lock = threading.Lock()
+        self._result_cache = get_result_cache(db, cache)
 
     def __len__(self):
         return len(self._matches)
@@ -82,72 +237,179 @@ class AppEnquire(GObject.GObject):
         """ return the list of matches as xapian.MSetItem """
         return self._matches
 
-    def _threaded_perform_search(self):
-        self._perform_search_complete = False
-        # generate a name and ensure we never have two threads
-        # with the same name
-        names = [thread.name for thread in threading.enumerate()]
-        for i in range(threading.active_count() + 1, 0, -1):
-            thread_name = 'ThreadedQuery-%s' % i
-            if not thread_name in names:
-                break
-        # create and start it
-        t = threading.Thread(
-            target=self._blocking_perform_search, name=thread_name)
-        t.start()
-        # don't block the UI while the thread is running
-        context = GObject.main_context_default()
-        while not self._perform_search_complete:
-            time.sleep(0.02)  # 50 fps
-            while context.pending():
-                context.iteration()
-        t.join()
+    def _get_search_params(self):
+        """ return the SearchParams of the current query """
+        match_docids = set(self.match_docids)
+        return SearchParams(self.search_query, self.limit, self.sortmode,
+                            self.filter, self.nonapps_visible,
+                            self.exact_counts, self.paginated, match_docids,
+                            self.query_class)
+
+    def _on_search_job_done(self, job, cache_key, generation):
+        if job.cancelled or job is not self._search_job:
+            # superseded by a newer query that emits query-complete
+            return
+        self._search_job = None
+        result = job.result
+        if result is None:
+            # the search failed
+            result = SearchResult(job.params)
+        elif cache_key is not None:
+            self._result_cache.put(cache_key, result, generation)
+        self._set_search_result(result)
 
         # call the query-complete callback
         self.emit("query-complete")
 
-    def _get_estimate_nr_apps_and_nr_pkgs(self, enquire, q, xfilter):
-        # filter out docs of pkgs of which there exists a doc of the app
-        enquire.set_query(xapian.Query(xapian.Query.OP_AND,
-                                       q, xapian.Query("ATapplication")))
+    def _set_search_result(self, result):
+        self._matches = result.matches
+        self.match_docids = result.match_docids
+        self.nr_apps = result.nr_apps
+        self.nr_pkgs = result.nr_pkgs
+        self.nonapps_visible = result.nonapps_visible
 
+    def _get_estimate_nr_apps_and_nr_pkgs(self, q, xfilter, exact=True):
+        # the counts are needed for every search, so only count the
+        # matches instead of building full msets
         try:
-            tmp_matches = enquire.get_mset(0, len(self.db), None, xfilter)
+            nr_apps = self.db.get_matches_count(
+                xapian.Query(xapian.Query.OP_AND,
+                             q, xapian.Query("ATapplication")),
+                xfilter, exact=exact)
+            # filter out docs of pkgs of which there exists a doc of the app
+            nr_pkgs = self.db.get_matches_count(
+                xapian.Query(xapian.Query.OP_AND_NOT,
+                             q, xapian.Query("XD")),
+                xfilter, exact=exact) - nr_apps
         except Exception:
             LOG.exception("_get_estimate_nr_apps_and_nr_pkgs failed")
             return (0, 0)
+        return (nr_apps, max(0, nr_pkgs))
 
-        nr_apps = tmp_matches.get_matches_estimated()
-        enquire.set_query(xapian.Query(xapian.Query.OP_AND_NOT,
-                                       q, xapian.Query("XD")))
-        tmp_matches = enquire.get_mset(0, len(self.db), None, xfilter)
-        nr_pkgs = tmp_matches.get_matches_estimated() - nr_apps
-        return (nr_apps, nr_pkgs)
-
-    def _blocking_perform_search(self):
+    def _blocking_perform_search(self, job):
+        """ run the search with the job.params and return its SearchResult
+            or None if the job got cancelled
+        """
         # WARNING this call may run in a thread, so its *not*
         #         allowed to touch gtk, otherwise hell breaks loose
 
-        # performance only: this is only needed to avoid the
-        # python __call__ overhead for each item if we can avoid it
-
+        # only one query at a time, a cancelled one stops at the next
+        # sub-query and makes way for the query that superseded it
+        with self._search_lock:
+            if job.cancelled:
+                return None
+            params = job.params
+            profile = QueryProfile(params.query_class)
+            xfilter = params.filter
+            nr_calls = get_nr_calls(xfilter)
+            result = self._do_perform_search(job, params, profile)
+            profile.nr_callbacks += get_nr_calls(xfilter) - nr_calls
+            if job.cancelled:
+                return None
+            self.db.profiler.record(profile)
+            return result
+
+    def _run_search_job(self, job):
+        """ run the search of a job of the query executor """
+        try:
+            return self._blocking_perform_search(job)
+        finally:
+            # the worker gets a handle again for its next job
+            self.db.release_xapiandb()
+
+    def _get_enquire(self, q, sortmode, nonapps_visible):
+        """ return a xapian.Enquire of the current thread for the query
+            that sorts the matches according to the sortmode, the python
+            KeyMaker it uses (or None) and the RatingQuery it uses (or
+            None), both must be kept alive until the match is done
+        """
         # use a unique instance of both enquire and xapian database
         # so concurrent queries dont result in an inconsistent database
 
         # an alternative would be to serialise queries
         enquire = xapian.Enquire(self.db.xapiandb)
+        enquire.set_query(q)
+        keymaker = None
+        rating_query = None
+
+        # sort results
+
+        # cataloged time - what's new category
+        if sortmode == SortMethods.BY_CATALOGED_TIME:
+            if (self.db._axi_values and
+                "catalogedtime" in self.db._axi_values):
+                enquire.set_sort_by_value(
+                    self.db._axi_values["catalogedtime"], reverse=True)
+            else:
+                LOG.warning("no catelogedtime in axi")
+        elif sortmode == SortMethods.BY_TOP_RATED:
+            from softwarecenter.backend.reviews import get_review_loader
+            review_loader = get_review_loader(self.cache, self.db)
+            # the relevance of the documents is their rating only
+            rating_query = review_loader.get_rating_query()
+            enquire.set_query(xapian.Query(
+                xapian.Query.OP_AND_MAYBE,
+                xapian.Query(xapian.Query.OP_SCALE_WEIGHT, q, 0),
+                rating_query.query))
+            # the unrated documents (and the ones with the same rating)
+            # all get the same weight, order them by name so that the
+            # order does not change between queries
+            if self.db.has_sort_keys():
+                enquire.set_sort_by_relevance_then_value(
+                    XapianValues.APPNAME_SORT_KEY, False)
+            else:
+                enquire.set_sort_by_relevance_then_value(
+                    XapianValues.PKGNAME, False)
+        # search ranking - when searching
+        elif sortmode == SortMethods.BY_SEARCH_RANKING:
+            #enquire.set_sort_by_value(XapianValues.POPCON)
+            # use the default enquire.set_sort_by_relevance()
+            pass
+        # display name - all categories / channels, the documents
+        # of apt-xapian-index have no precomputed sort key so the
+        # slow LocaleSorter is only used if they can be in the result
+        elif (self.db.has_sort_keys() and
+              (nonapps_visible != NonAppVisibility.ALWAYS_VISIBLE or
+               not self.db._use_axi)):
+            enquire.set_sort_by_value(XapianValues.APPNAME_SORT_KEY,
+                                      reverse=False)
+        elif (self.db._axi_values and
+              "display_name" in self.db._axi_values):
+            keymaker = LocaleSorter(self.db)
+            enquire.set_sort_by_key(keymaker, reverse=False)
+            # fallback to pkgname - if needed?
+        # fallback to pkgname - if needed?
+        else:
+            enquire.set_sort_by_value_then_relevance(
+                XapianValues.PKGNAME, False)
+        return enquire, keymaker, rating_query
+
+    def _do_perform_search(self, job, params, profile=None):
+        if profile is None:
+            profile = QueryProfile(params.query_class)
+        result = SearchResult(params)
+
+        # performance only: this is only needed to avoid the
+        # python __call__ overhead for each item if we can avoid it
 
-        if self.filter and self.filter.required:
-            xfilter = self.filter
+        if params.filter and params.filter.required:
+            xfilter = params.filter
         else:
             xfilter = None
 
+        # only a single query without a duplicate filter can be paginated
+        paginated = (params.paginated and
+                     params.limit == 0 and
+                     len(params.search_query) == 1 and
+                     not params.match_docids)
+
         # go over the queries
-        self.nr_apps, self.nr_pkgs = 0, 0
-        _matches = self._matches
-        match_docids = self.match_docids
+        _matches = result.matches
+        match_docids = result.match_docids
 
-        for q in self.search_query:
+        for q in params.search_query:
+            if job.cancelled:
+                return result
             LOG.debug("initial query: '%s'" % q)
 
             # for searches we may want to disable show/hide
@@ -155,14 +417,23 @@ class AppEnquire(GObject.GObject):
             exact_pkgname_query = (len(terms) == 1 and
                                    terms[0].startswith("XP"))
 
-            with ExecutionTime("calculate nr_apps and nr_pkgs: "):
+            # a filter that can be compiled into the query is much faster
+            # than a MatchDecider that calls into python for every doc
+            decider = xfilter
+            if xfilter is not None:
+                filtered_q = xfilter.filter_query(q)
+                if filtered_q is not None:
+                    q, decider = filtered_q, None
+
+            with ExecutionTime("calculate nr_apps and nr_pkgs: "), \
+                    profile.measure("count"):
                 nr_apps, nr_pkgs = self._get_estimate_nr_apps_and_nr_pkgs(
-                    enquire, q, xfilter)
-                self.nr_apps += nr_apps
-                self.nr_pkgs += nr_pkgs
+                    q, decider, params.exact_counts)
+                result.nr_apps += nr_apps
+                result.nr_pkgs += nr_pkgs
 
             # only show apps by default (unless in always visible mode)
-            if self.nonapps_visible != NonAppVisibility.ALWAYS_VISIBLE:
+            if params.nonapps_visible != NonAppVisibility.ALWAYS_VISIBLE:
                 if not exact_pkgname_query:
                     q = xapian.Query(xapian.Query.OP_AND,
                                      xapian.Query("ATapplication"),
@@ -172,44 +443,23 @@ class AppEnquire(GObject.GObject):
 
             # filter out docs of pkgs of which there exists a doc of the app
             # FIXME: make this configurable again?
-            enquire.set_query(xapian.Query(xapian.Query.OP_AND_NOT,
-                                           q, xapian.Query("XD")))
-
-            # sort results
-
-            # cataloged time - what's new category
-            if self.sortmode == SortMethods.BY_CATALOGED_TIME:
-                if (self.db._axi_values and
-                    "catalogedtime" in self.db._axi_values):
-                    enquire.set_sort_by_value(
-                        self.db._axi_values["catalogedtime"], reverse=True)
-                else:
-                    LOG.warning("no catelogedtime in axi")
-            elif self.sortmode == SortMethods.BY_TOP_RATED:
-                from softwarecenter.backend.reviews import get_review_loader
-                review_loader = get_review_loader(self.cache, self.db)
-                sorter = TopRatedSorter(self.db, review_loader)
-                enquire.set_sort_by_key(sorter, reverse=True)
-            # search ranking - when searching
-            elif self.sortmode == SortMethods.BY_SEARCH_RANKING:
-                #enquire.set_sort_by_value(XapianValues.POPCON)
-                # use the default enquire.set_sort_by_relevance()
-                pass
-            # display name - all categories / channels
-            elif (self.db._axi_values and
-                  "display_name" in self.db._axi_values):
-                enquire.set_sort_by_key(LocaleSorter(self.db), reverse=False)
-                # fallback to pkgname - if needed?
-            # fallback to pkgname - if needed?
-            else:
-                enquire.set_sort_by_value_then_relevance(
-                    XapianValues.PKGNAME, False)
-
+            q = xapian.Query(xapian.Query.OP_AND_NOT, q, xapian.Query("XD"))
+            if paginated:
+                result.matches = _matches = self._get_paginated_matches(
+                    q, decider, exact_pkgname_query, params, result, profile)
+                continue
+
+            enquire, keymaker, rating_query = self._get_enquire(
+                q, params.sortmode, params.nonapps_visible)
             #~ try:
-            if self.limit == 0:
-                matches = enquire.get_mset(0, len(self.db), None, xfilter)
-            else:
-                matches = enquire.get_mset(0, self.limit, None, xfilter)
+            with profile.measure("mset"):
+                if params.limit == 0:
+                    matches = enquire.get_mset(0, len(self.db), None,
+                                               decider)
+                else:
+                    matches = enquire.get_mset(0, params.limit, None,
+                                               decider)
+            profile.nr_callbacks += get_nr_calls(keymaker)
             LOG.debug("found ~%i matches" % matches.get_matches_estimated())
             #~ except:
                 #~ logging.exception("get_mset")
@@ -218,8 +468,8 @@ class AppEnquire(GObject.GObject):
             # promote exact matches to a "app", this will make the
             # show/hide technical items work correctly
             if exact_pkgname_query and len(matches) == 1:
-                self.nr_apps += 1
-                self.nr_pkgs -= 2
+                result.nr_apps += 1
+                result.nr_pkgs -= 2
 
             # add matches, but don't duplicate docids
             with ExecutionTime("append new matches to existing ones:"):
@@ -231,23 +481,35 @@ class AppEnquire(GObject.GObject):
         # if we have no results, try forcing pkgs to be displayed
         # if not NonAppVisibility.NEVER_VISIBLE is set
         if (not _matches and
-            self.nonapps_visible not in (NonAppVisibility.ALWAYS_VISIBLE,
-                                         NonAppVisibility.NEVER_VISIBLE)):
-            self.nonapps_visible = NonAppVisibility.ALWAYS_VISIBLE
-            self._blocking_perform_search()
-
-        # wake up the UI if run in a search thread
-        self._perform_search_complete = True
-
-    def get_estimated_matches_count(self, query):
+            not job.cancelled and
+            params.nonapps_visible not in (NonAppVisibility.ALWAYS_VISIBLE,
+                                           NonAppVisibility.NEVER_VISIBLE)):
+            params = params._replace(
+                nonapps_visible=NonAppVisibility.ALWAYS_VISIBLE)
+            return self._do_perform_search(job, params, profile)
+        return result
+
+    def _get_paginated_matches(self, q, decider, exact_pkgname_query,
+                               params, result, profile):
+        with profile.measure("count"):
+            nr_matches = self.db.get_matches_count(q, decider)
+        LOG.debug("found %i matches" % nr_matches)
+        # promote exact matches to a "app", this will make the
+        # show/hide technical items work correctly
+        if exact_pkgname_query and nr_matches == 1:
+            result.nr_apps += 1
+            result.nr_pkgs -= 2
+
+        def _get_mset(offset, size):
+            # the pages are fetched by the thread that uses the matches
+            enquire, keymaker, rating_query = self._get_enquire(
+                q, params.sortmode, params.nonapps_visible)
+            return enquire.get_mset(offset, size, None, decider)
+        return PaginatedMatches(_get_mset, nr_matches)
+
+    def get_estimated_matches_count(self, query, exact=True):
         with ExecutionTime("estimate item count for query: '%s'" % query):
-            enquire = xapian.Enquire(self.db.xapiandb)
-            enquire.set_query(query)
-            # no performance difference between the two
-            #tmp_matches = enquire.get_mset(0, 1, None, None)
-            #nr_pkgs = tmp_matches.get_matches_estimated()
-            tmp_matches = enquire.get_mset(0, len(self.db), None, None)
-            nr_pkgs = len(tmp_matches)
+            nr_pkgs = self.db.get_matches_count(query, exact=exact)
         return nr_pkgs
 
     def set_query(self, search_query,
@@ -278,7 +540,9 @@ class AppEnquire(GObject.GObject):
                               apps result if no matching apps is found)
         - `nonblocking_load`: set to False to execute the query inside the
                               current thread.  Defaults to True to allow the
-                              search to be performed without blocking the UI.
+                              search to be performed without blocking the UI,
+                              the matches are set and query-complete is
+                              emitted from the main loop once it is done.
         - 'persistent_duplicate_filter': if True allows filtering of duplicate
                                          matches across multiple queries
         """
@@ -301,22 +565,71 @@ class AppEnquire(GObject.GObject):
             self.sortmode = SortMethods.BY_ALPHABET
             self.limit = 0
 
-        # flush old query matches
+        # a query that is still running for us is outdated now
+        if self._search_job:
+            self._search_job.cancel()
+            self._search_job = None
+
+        # flush old query matches, the duplicate filter needs all the
+        # docids of paginated matches
+        paginated = isinstance(self._matches, PaginatedMatches)
+        if persistent_duplicate_filter and paginated:
+            self.match_docids = self.match_docids.union(
+                [m.docid for m in self._matches])
         self._matches = []
         if not persistent_duplicate_filter:
             self.match_docids = set()
 
+        # the result depends on the previous query with a persistent
+        # duplicate filter, so it can not be cached
+        if persistent_duplicate_filter:
+            cache_key = None
+        else:
+            cache_key = self._get_result_cache_key()
+            result = self._result_cache.get(cache_key)
+            if result is not None:
+                self._set_search_result(result)
+                if self.nonblocking_load:
+                    self.emit("query-complete")
+                return True
+        generation = self._result_cache.generation
+
         # we support single and list search_queries,
         # if list we append them one by one
-        with ExecutionTime("populate model from query: '%s' (threaded: %s)" % (
-                " ; ".join([str(q) for q in self.search_query]),
-                self.nonblocking_load), with_traceback=False):
-            if self.nonblocking_load:
-                self._threaded_perform_search()
-            else:
-                self._blocking_perform_search()
+        params = self._get_search_params()
+        if self.nonblocking_load:
+            # don't block the UI, the matches are set and query-complete
+            # is emitted from the main loop once the search is done
+            self._search_job = get_query_executor().submit(
+                self._run_search_job,
+                lambda job: self._on_search_job_done(job, cache_key,
+                                                     generation),
+                params)
+            return True
+        job = QueryJob(self._blocking_perform_search, params=params)
+        with ExecutionTime("populate model from query: '%s'" % (
+                " ; ".join([str(q) for q in self.search_query])),
+                with_traceback=False):
+            result = self._blocking_perform_search(job)
+        if cache_key is not None:
+            self._result_cache.put(cache_key, result, generation)
+        self._set_search_result(result)
         return True
 
+    def _get_result_cache_key(self):
+        if self.filter:
+            filter_state = self.filter.get_state()
+        else:
+            filter_state = None
+        return (tuple([str(q) for q in self.search_query]),
+                filter_state,
+                self.sortmode,
+                self.limit,
+                self.nonapps_visible,
+                self.exact,
+                self.exact_counts,
+                self.paginated)
+
 #    def get_pkgnames(self):
 #        xdb = self.db.xapiandb
 #        pkgnames = []
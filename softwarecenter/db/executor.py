@@ -0,0 +1,110 @@
+# Copyright (C) 2012 Canonical
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import logging
+import threading
+
+from gi.repository import GObject
+
+# py3 compat
+try:
+    import queue
+    queue  # pyflakes
+except ImportError:
+    import Queue as queue
+
+LOG = logging.getLogger(__name__)
+
+# the number of worker threads of the default QueryExecutor
+NR_QUERY_WORKERS = 2
+
+
+class QueryJob(object):
+    """ a query that got submitted to the QueryExecutor """
+
+    def __init__(self, func, callback=None, params=None):
+        self.func = func
+        self.callback = callback
+        # the parameters of the query, frozen when it got submitted
+        self.params = params
+        self.cancelled = False
+        self.result = None
+        self.error = None
+
+    def cancel(self):
+        """ cancel the job, a job that did not start yet is skipped and a
+            running one can check job.cancelled to stop early (the
+            callback is called in both cases)
+        """
+        self.cancelled = True
+
+
+class QueryExecutor(object):
+    """ a small pool of worker threads that run queries
+
+        The workers keep their thread name for their whole life, so the
+        per thread xapian handles of StoreDatabase get reused by all the
+        queries they run. The completion callbacks are called from the
+        main loop via GObject.idle_add().
+    """
+
+    def __init__(self, nr_workers=NR_QUERY_WORKERS):
+        # the main loop must release the GIL while it waits for events,
+        # otherwise the workers would not run
+        GObject.threads_init()
+        self._queue = queue.Queue()
+        self.workers = []
+        for i in range(nr_workers):
+            worker = threading.Thread(target=self._run,
+                                      name="QueryExecutor-%i" % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, func, callback=None, params=None):
+        """ run func(job) in a worker thread and callback(job) in the
+            main loop once it is done, returns the QueryJob (func gets
+            the given params as job.params)
+        """
+        job = QueryJob(func, callback, params)
+        self._queue.put(job)
+        return job
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if not job.cancelled:
+                try:
+                    job.result = job.func(job)
+                except Exception as e:
+                    LOG.exception("query job failed")
+                    job.error = e
+            if job.callback:
+                GObject.idle_add(self._complete, job)
+
+    def _complete(self, job):
+        job.callback(job)
+        return False
+
+
+_query_executor = None
+
+
+def get_query_executor():
+    """ return the QueryExecutor singleton """
+    global _query_executor
+    if _query_executor is None:
+        _query_executor = QueryExecutor()
+    return _query_executor
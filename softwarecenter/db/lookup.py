@@ -0,0 +1,83 @@
+# Copyright (C) 2012 Canonical
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import logging
+import threading
+
+from softwarecenter.enums import XapianValues
+from softwarecenter.utils import ExecutionTime, utf8
+
+LOG = logging.getLogger(__name__)
+
+
+class DocidLookupIndex(object):
+    """ an in-memory index of the docids of the app and package documents
+        of a StoreDatabase
+
+        The docids of the terms with a given prefix (like "AP" for the
+        pkgnames of apps or "XP" for the pkgnames of apt-xapian-index)
+        and of the (appname, pkgname) pairs of the apps are read from the
+        postlists on their first use. The docids are kept as tuples in
+        postlist order. A new index is needed after the database got
+        reopened.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._by_prefix = {}
+        self._by_app = None
+        self._lock = threading.Lock()
+
+    def _get_prefix_index(self, prefix):
+        # must be called with the lock held
+        if prefix not in self._by_prefix:
+            with ExecutionTime("build the '%s' docid index" % prefix):
+                xapiandb = self.db.xapiandb
+                index = {}
+                for item in xapiandb.allterms(prefix):
+                    docids = tuple([m.docid
+                                    for m in xapiandb.postlist(item.term)])
+                    index[intern(item.term[len(prefix):])] = docids
+                self._by_prefix[prefix] = index
+        return self._by_prefix[prefix]
+
+    def _get_app_index(self):
+        # must be called with the lock held
+        if self._by_app is None:
+            with ExecutionTime("build the app docid index"):
+                pkgnames = {}
+                for item in self.db.xapiandb.valuestream(
+                        XapianValues.PKGNAME):
+                    pkgnames[item.docid] = intern(item.value)
+                index = {}
+                for appname, docids in self._get_prefix_index("AA").items():
+                    for docid in docids:
+                        key = (appname, pkgnames.get(docid, ""))
+                        index[key] = index.get(key, ()) + (docid,)
+                self._by_app = index
+        return self._by_app
+
+    def get_docids(self, prefix, name):
+        """ return the docids of the documents with the term prefix+name """
+        with self._lock:
+            return self._get_prefix_index(prefix).get(utf8(name), ())
+
+    def get_app_docids(self, appname, pkgname):
+        """ return the docids of the apps with the given appname and
+            pkgname
+        """
+        with self._lock:
+            return self._get_app_index().get((utf8(appname), utf8(pkgname)),
+                                             ())
@@ -187,6 +187,12 @@ class PackageInfo(GObject.GObject):
         """ :return: unique origin as string """
         return ''
 
+    def get_all_channels(self):
+        """ :return: a list of (label, origin, component, nr_pkgs,
+                     nr_installed) tuples or None if not supported
+        """
+        return None
+
     def get_addons(self, pkgname, ignore_installed=False):
         """ :return: a tuple of pkgnames (recommends, suggests) """
         return ([], [])
@@ -347,6 +347,28 @@ class AptCache(PackageInfo):
                     origins.add(item.origin)
         return origins
 
+    def get_all_channels(self):
+        """
+        return a list of (label, origin, component, nr_pkgs, nr_installed)
+        tuples of the channels of the package candidates in the apt.Cache,
+        packages that are not downloadable are counted in the
+        "notdownloadable" channel
+        """
+        channels = {}
+        for pkg in self._cache:
+            candidate = pkg.candidate
+            if not candidate:
+                continue
+            keys = [(item.label, item.origin, item.component)
+                    for item in candidate.origins]
+            if not candidate.downloadable:
+                keys.append(("notdownloadable", "", ""))
+            for key in set(keys):
+                nr_pkgs, nr_installed = channels.get(key, (0, 0))
+                channels[key] = (nr_pkgs + 1,
+                                 nr_installed + int(pkg.is_installed))
+        return [key + counts for key, counts in channels.items()]
+
     def get_origins(self, pkgname):
         """
         return package origins from apt.Cache
@@ -0,0 +1,199 @@
+# Copyright (C) 2012 Canonical
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import logging
+import threading
+import time
+import weakref
+
+LOG = logging.getLogger(__name__)
+
+# the number of reader handles that are kept for reuse
+CONNECTION_POOL_SIZE = 4
+
+# the seconds a thread waits for a handle once all the handles of the
+# pool are in use, before it opens one beyond the size of the pool
+CONNECTION_WAIT_TIMEOUT = 5.0
+
+
+def format_pool_stats(stats):
+    """ return the XapianConnectionPool.get_stats() statistics as text """
+    return ("xapian handles: %(handles)i open, %(free)i free, "
+            "%(opens)i opened in %(open_seconds).3fs "
+            "(%(max_open_seconds).3fs max), %(hits)i reused, "
+            "%(waits)i waits, %(overflows)i overflows, "
+            "%(dropped)i dropped, generation %(generation)i" % stats)
+
+
+class PooledConnection(object):
+    """ a xapian reader handle (and its query parser) of the pool """
+
+    def __init__(self, xapiandb, generation):
+        self.xapiandb = xapiandb
+        self.parser = None
+        self.generation = generation
+
+
+class XapianConnectionPool(object):
+    """ a bounded pool of reusable xapian reader handles
+
+        A thread gets a handle on its first use of the database and keeps
+        it until it calls release() (e.g. at the end of a query job) or
+        is gone, so all the documents and queries of a thread come from
+        the same handle until then. Once the size of the pool is checked
+        out, a thread waits for a handle to come back. If none comes back
+        within the timeout, it opens a handle beyond the size that is
+        dropped again on its checkin (xapian closes it once the last
+        enquire or match that uses it is gone). The pool has a generation
+        number, reset() invalidates all handles and they get reopened
+        lazily on their next use.
+    """
+
+    def __init__(self, open_func, size=CONNECTION_POOL_SIZE,
+                 timeout=CONNECTION_WAIT_TIMEOUT):
+        self.open_func = open_func
+        self.size = size
+        self.timeout = timeout
+        self.generation = 0
+        self._free = []
+        # the handles of the current generation, in use or free
+        self._nr_handles = 0
+        self._local = threading.local()
+        # thread weakref -> the PooledConnection the thread uses, the
+        # weakref (and its callback) lives as long as the thread
+        self._thread_conns = {}
+        self._lock = threading.Lock()
+        # notified when a handle gets free or closed
+        self._handle_available = threading.Condition(self._lock)
+        self._stats = {"opens": 0,
+                       "hits": 0,
+                       "waits": 0,
+                       "overflows": 0,
+                       "dropped": 0,
+                       "open_seconds": 0.0,
+                       "max_open_seconds": 0.0,
+                       }
+
+    def get_stats(self):
+        """ return a dict with the number of opened handles, the number
+            of reused ones, the number of checkouts that had to wait for
+            a handle, the number of handles opened beyond the size of the
+            pool, the number of those that got dropped again, the number
+            of open and free handles and the time spent opening handles
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["generation"] = self.generation
+            stats["handles"] = self._nr_handles
+            stats["free"] = len(self._free)
+            return stats
+
+    def reset(self):
+        """ invalidate all handles, e.g. after the database got reopened """
+        with self._lock:
+            self.generation += 1
+            self._free = []
+            self._nr_handles = 0
+            self._handle_available.notify_all()
+
+    def get(self):
+        """ return the PooledConnection of the current thread """
+        conn = getattr(self._local, "connection", None)
+        if conn is not None and conn.generation == self.generation:
+            return conn
+        if conn is not None:
+            self.release()
+        conn = self._checkout()
+        self._local.connection = conn
+        ref = getattr(self._local, "thread_ref", None)
+        if ref is None:
+            # give the handle back to the pool once the thread is gone,
+            # a thread keeps its weakref when it gets a new handle
+            ref = weakref.ref(threading.current_thread(),
+                              self._on_thread_gone)
+            self._local.thread_ref = ref
+        with self._lock:
+            self._thread_conns[ref] = conn
+        return conn
+
+    def release(self):
+        """ give the handle of the current thread back to the pool, the
+            thread gets a handle again on its next use of the database
+        """
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            return
+        self._local.connection = None
+        ref = getattr(self._local, "thread_ref", None)
+        with self._lock:
+            self._thread_conns.pop(ref, None)
+        self._checkin(conn)
+
+    def _on_thread_gone(self, ref):
+        with self._lock:
+            conn = self._thread_conns.pop(ref, None)
+        if conn is not None:
+            self._checkin(conn)
+
+    def _checkout(self):
+        with self._lock:
+            if not self._free and self._nr_handles >= self.size:
+                self._stats["waits"] += 1
+                deadline = time.time() + self.timeout
+                while not self._free and self._nr_handles >= self.size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._handle_available.wait(remaining)
+            if self._free:
+                self._stats["hits"] += 1
+                return self._free.pop()
+            generation = self.generation
+            if self._nr_handles >= self.size:
+                LOG.warning("no free xapian handle after %.1fs, opening "
+                            "one beyond the size of the pool" % self.timeout)
+                self._stats["overflows"] += 1
+            self._nr_handles += 1
+        start = time.time()
+        try:
+            xapiandb = self.open_func()
+        except:
+            with self._lock:
+                if generation == self.generation:
+                    self._nr_handles -= 1
+                    self._handle_available.notify()
+            raise
+        duration = time.time() - start
+        LOG.debug("opened xapian handle in %.3fs" % duration)
+        with self._lock:
+            self._stats["opens"] += 1
+            self._stats["open_seconds"] += duration
+            self._stats["max_open_seconds"] = max(
+                self._stats["max_open_seconds"], duration)
+        return PooledConnection(xapiandb, generation)
+
+    def _checkin(self, conn):
+        with self._lock:
+            if conn.generation != self.generation:
+                # reset() forgot about it already
+                return
+            if self._nr_handles > self.size:
+                # an overflow handle, drop it so that the pool shrinks
+                # back to its size
+                self._nr_handles -= 1
+                self._stats["dropped"] += 1
+            else:
+                self._free.append(conn)
+                self._handle_available.notify()
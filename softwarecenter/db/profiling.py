@@ -0,0 +1,150 @@
+# Copyright (C) 2012 Canonical
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+# the upper bounds (in seconds) of the buckets of the latency histograms,
+# the last bucket takes everything that is slower
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+                   1.0, 2.0, 5.0)
+
+# the number of the most recent queries per query class that the
+# histograms cover
+PROFILE_WINDOW = 500
+
+# the stages of a query: parsing the search entry, counting the matches
+# and building the mset
+QUERY_STAGES = ("parse", "count", "mset")
+
+
+class QueryProfile(object):
+    """ the time spent in the stages of a single query and the number of
+        python MatchDecider and KeyMaker callbacks it caused
+    """
+
+    def __init__(self, query_class):
+        self.query_class = query_class
+        self.seconds = {}
+        self.nr_callbacks = 0
+
+    @contextmanager
+    def measure(self, stage):
+        """ add the time spent in the with block to the given stage """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = (self.seconds.get(stage, 0.0) +
+                                   time.time() - start)
+
+
+class QueryProfiler(object):
+    """ rolling latency histograms of the queries by query class (like
+        "search", "category", "channel" or "installed")
+
+        Only the last window queries of every class are kept, so the
+        histograms show how the views behave now and not since startup.
+    """
+
+    def __init__(self, window=PROFILE_WINDOW):
+        self.window = window
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    def record(self, profile):
+        """ add a finished QueryProfile """
+        with self._lock:
+            if profile.query_class not in self._profiles:
+                self._profiles[profile.query_class] = deque(
+                    maxlen=self.window)
+            self._profiles[profile.query_class].append(profile)
+
+    def reset(self):
+        """ forget all recorded queries """
+        with self._lock:
+            self._profiles = {}
+
+    def get_histograms(self):
+        """ return a dict of query class to a dict with the number of
+            "queries", the number of "callbacks" and a dict of stage to
+            the "histogram" (the number of samples per LATENCY_BUCKETS
+            bucket plus one for the slower ones), the number of
+            "samples" and the "total" and "max" seconds
+        """
+        with self._lock:
+            profiles = dict([(query_class, list(profiles))
+                             for (query_class, profiles)
+                             in self._profiles.items()])
+        result = {}
+        for query_class, profiles in profiles.items():
+            stages = {}
+            for profile in profiles:
+                for stage, seconds in profile.seconds.items():
+                    if stage not in stages:
+                        stages[stage] = {
+                            "histogram": [0] * (len(LATENCY_BUCKETS) + 1),
+                            "samples": 0,
+                            "total": 0.0,
+                            "max": 0.0,
+                            }
+                    data = stages[stage]
+                    bucket = len(LATENCY_BUCKETS)
+                    for i, limit in enumerate(LATENCY_BUCKETS):
+                        if seconds <= limit:
+                            bucket = i
+                            break
+                    data["histogram"][bucket] += 1
+                    data["samples"] += 1
+                    data["total"] += seconds
+                    data["max"] = max(data["max"], seconds)
+            # the parsing of the search entry is recorded on its own
+            queries = [p for p in profiles
+                       if "count" in p.seconds or "mset" in p.seconds]
+            result[query_class] = {
+                "queries": len(queries),
+                "callbacks": sum([p.nr_callbacks for p in profiles]),
+                "stages": stages,
+                }
+        return result
+
+    def format_histograms(self):
+        """ return the histograms of get_histograms() as text """
+        labels = ["<=%gms" % (limit * 1000) for limit in LATENCY_BUCKETS]
+        labels.append(">%gms" % (LATENCY_BUCKETS[-1] * 1000))
+        lines = []
+        histograms = self.get_histograms()
+        for query_class in sorted(histograms):
+            data = histograms[query_class]
+            lines.append("%s: %i queries, %i callbacks" % (
+                query_class, data["queries"], data["callbacks"]))
+            stages = data["stages"]
+            for stage in QUERY_STAGES + tuple(
+                    sorted(set(stages) - set(QUERY_STAGES))):
+                if stage not in stages:
+                    continue
+                stage_data = stages[stage]
+                lines.append("  %s: %i samples, %.3fs avg, %.3fs max" % (
+                    stage, stage_data["samples"],
+                    stage_data["total"] / stage_data["samples"],
+                    stage_data["max"]))
+                lines.append("    " + " ".join(
+                    ["%s:%i" % (label, count)
+                     for (label, count)
+                     in zip(labels, stage_data["histogram"]) if count]))
+        return "\n".join(lines)
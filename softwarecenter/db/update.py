@@ -17,6 +17,7 @@
 # this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import hashlib
 import logging
 import json
 import re
@@ -26,6 +27,7 @@ import shutil
 import time
 import xapian
 
+from collections import namedtuple
 from gi.repository import GObject
 from piston_mini_client import PistonResponseObject
 
@@ -59,7 +61,20 @@ from softwarecenter.enums import (XapianValues,
                                   AVAILABLE_FOR_PURCHASE_MAGIC_CHANNEL_NAME,
                                   PURCHASED_NEEDS_REINSTALL_MAGIC_CHANNEL_NAME,
                                   )
-from softwarecenter.db.database import parse_axi_values_file
+from softwarecenter.db.database import (
+    get_axi_stamp,
+    get_channels_stamp,
+    get_sort_key_locale,
+    make_sort_key,
+    parse_axi_values_file,
+    )
+from softwarecenter.db.utils import (
+    READER_LOCK,
+    collect_generations,
+    get_new_generation_path,
+    lock_generation,
+    publish_generation,
+    )
 
 from locale import getdefaultlocale
 import gettext
@@ -79,9 +94,22 @@ WEIGHT_APT_PKGNAME = 8
 WEIGHT_APT_SUMMARY = 5
 WEIGHT_APT_DESCRIPTION = 1
 
+# the indexer commits a write batch after this many documents or once the
+# process grew by this many bytes (0 disables the limit), see
+# BatchedWritableDatabase
+BATCH_MAX_DOCS = 5000
+BATCH_MAX_MEMORY = 256 * 1024 * 1024
+
+# the number of applications per mimetype that are kept in the
+# "mimetype-table" metadata, see set_mimetype_table()
+MIMETYPE_TABLE_SIZE = 100
+
 # some globals (FIXME: that really need to go into a new Update class)
 popcon_max = 0
 seen = set()
+# unique id terms of the documents indexed while reindexing a changed
+# source in update_incremental(), None if nobody is interested
+indexed_unique_ids = None
 LOG = logging.getLogger(__name__)
 
 # init axi
@@ -143,6 +171,20 @@ class AppInfoParserBase(object):
     def desktopf(self):
         """ return the file that the AppInfo comes from """
 
+    @property
+    def source(self):
+        """ return the source file that is indexed, this is used to find
+            the documents of a source again on incremental updates
+        """
+        return self.desktopf
+
+    @property
+    def entry_id(self):
+        """ return the id of the entry that is unique within its source,
+            sources with a single entry per file use the file
+        """
+        return self.desktopf
+
 
 class SCAApplicationParser(AppInfoParserBase):
     """ map the data we get from the software-center-agent """
@@ -335,9 +377,10 @@ class JsonTagSectionParser(AppInfoParserBase):
                'Categories': 'categories',
               }
 
-    def __init__(self, tag_section, url):
+    def __init__(self, tag_section, url, entry_nr=0):
         self.tag_section = tag_section
         self.url = url
+        self.entry_nr = entry_nr
 
     def get_desktop(self, key, translated=True):
         return self.tag_section[self._apply_mapping(key)]
@@ -349,6 +392,10 @@ class JsonTagSectionParser(AppInfoParserBase):
     def desktopf(self):
         return self.url
 
+    @property
+    def entry_id(self):
+        return "%s#%i" % (self.url, self.entry_nr)
+
 
 class AppStreamXMLParser(AppInfoParserBase):
 
@@ -372,9 +419,10 @@ class AppStreamXMLParser(AppInfoParserBase):
 
     locale = getdefaultlocale(('LANGUAGE','LANG','LC_CTYPE','LC_ALL'))[0]
 
-    def __init__(self, appinfo_xml, xmlfile):
+    def __init__(self, appinfo_xml, xmlfile, entry_nr=0):
         self.appinfo_xml = appinfo_xml
         self.xmlfile = xmlfile
+        self.entry_nr = entry_nr
 
     def get_desktop(self, key, translated=True):
         if key in self.STATIC_DATA:
@@ -434,11 +482,94 @@ class AppStreamXMLParser(AppInfoParserBase):
 
         return subelm.text
 
+    @property
+    def source(self):
+        return self.xmlfile
+
+    @property
+    def entry_id(self):
+        # the <id> of an application is not required to be unique
+        return "%s#%i" % (self.desktopf, self.entry_nr)
+
+
+class LocaleKeyTable(object):
+    """ the translated key names to try for the locale environment, in
+        the order they should be tried, and the gettext translations of
+        the domains used by the desktop files
+
+        The lookup of the locale and the translation files is done only
+        once per table instead of for every key that gets translated,
+        use get_locale_key_table() to get the table of the current
+        environment.
+    """
+
+    def __init__(self):
+        self.locales = []
+        try:
+            locale = getdefaultlocale(('LANGUAGE', 'LANG', 'LC_CTYPE',
+                'LC_ALL'))[0]
+        except ValueError:
+            locale = None
+        if locale:
+            self.locales.append(locale)
+            if "_" in locale:
+                self.locales.append(locale.split("_")[0])
+        self._keys = {}
+        self._translations = {}
+
+    def get_keys(self, key, key_format, lower=False):
+        """ return the tuple of the translated key names of key (built
+            with key_format from the key and the locale) followed by
+            the untranslated key
+        """
+        try:
+            return self._keys[(key, key_format, lower)]
+        except KeyError:
+            pass
+        keys = [key_format % (key, locale) for locale in self.locales]
+        keys.append(key)
+        if lower:
+            keys = [k.lower() for k in keys]
+        keys = self._keys[(key, key_format, lower)] = tuple(keys)
+        return keys
+
+    def dgettext(self, domain, value):
+        """ like gettext.dgettext() but the translation of the domain is
+            only looked up once
+        """
+        try:
+            translation = self._translations[domain]
+        except KeyError:
+            try:
+                translation = gettext.translation(
+                    domain, gettext.bindtextdomain(domain))
+            except IOError:
+                translation = None
+            self._translations[domain] = translation
+        if translation is None:
+            return value
+        return translation.gettext(value)
+
+
+_locale_key_tables = {}
+
+
+def get_locale_key_table():
+    """ return the LocaleKeyTable of the current locale environment """
+    environ = (os.environ.get("LANGUAGE"), os.environ.get("LANG"),
+               os.environ.get("LC_CTYPE"), os.environ.get("LC_ALL"))
+    try:
+        return _locale_key_tables[environ]
+    except KeyError:
+        table = _locale_key_tables[environ] = LocaleKeyTable()
+        return table
+
 
 class DesktopTagSectionParser(AppInfoParserBase):
-    def __init__(self, tag_section, tagfile):
+    def __init__(self, tag_section, tagfile, entry_nr=0):
         self.tag_section = tag_section
         self.tagfile = tagfile
+        self.entry_nr = entry_nr
 
     def get_desktop(self, key, translated=True):
         # strip away bogus prefixes
@@ -447,30 +578,22 @@ class DesktopTagSectionParser(AppInfoParserBase):
         # shortcut
         if not translated:
             return self.tag_section[key]
+        locale_keys = get_locale_key_table()
         # FIXME: make i18n work similar to get_desktop
         # first try dgettext
         if "Gettext-Domain" in self.tag_section:
             value = self.tag_section.get(key)
             if value:
                 domain = self.tag_section["Gettext-Domain"]
-                translated_value = gettext.dgettext(domain, value)
+                translated_value = locale_keys.dgettext(domain, value)
                 if value != translated_value:
                     return translated_value
         # then try the i18n version of the key (in [de_DE] or
-        # [de]) but ignore errors and return the untranslated one then
-        try:
-            locale = getdefaultlocale(('LANGUAGE', 'LANG', 'LC_CTYPE',
-                'LC_ALL'))[0]
-            if locale:
-                if self.has_option_desktop("%s-%s" % (key, locale)):
-                    return self.tag_section["%s-%s" % (key, locale)]
-                if "_" in locale:
-                    locale_short = locale.split("_")[0]
-                    if self.has_option_desktop("%s-%s" % (key, locale_short)):
-                        return self.tag_section["%s-%s" % (key, locale_short)]
-        except ValueError:
-            pass
-        # and then the untranslated field
+        # [de]) and then the untranslated field
+        for k in locale_keys.get_keys(key, "%s-%s"):
+            if k in self.tag_section:
+                return self.tag_section[k]
+        # raises the KeyError of the missing untranslated field
         return self.tag_section[key]
 
     def has_option_desktop(self, key):
@@ -483,6 +606,10 @@ class DesktopTagSectionParser(AppInfoParserBase):
     def desktopf(self):
         return self.tagfile
 
+    @property
+    def entry_id(self):
+        return "%s#%i" % (self.tagfile, self.entry_nr)
+
 
 class DesktopConfigParser(RawConfigParser, AppInfoParserBase):
     " thin wrapper that is tailored for xdg Desktop files "
@@ -496,37 +623,26 @@ class DesktopConfigParser(RawConfigParser, AppInfoParserBase):
         # shortcut
         if not translated:
             return self.get(self.DE, key)
+        locale_keys = get_locale_key_table()
+        # raises the NoSectionError or NoOptionError of a missing field
+        value = self.get(self.DE, key)
         # first try dgettext
-        if self.has_option_desktop("X-Ubuntu-Gettext-Domain"):
-            value = self.get(self.DE, key)
-            if value:
-                domain = self.get(self.DE, "X-Ubuntu-Gettext-Domain")
-                translated_value = gettext.dgettext(domain, value)
-                if value != translated_value:
-                    return translated_value
+        if value and self.has_option_desktop("X-Ubuntu-Gettext-Domain"):
+            domain = self.get(self.DE, "X-Ubuntu-Gettext-Domain")
+            translated_value = locale_keys.dgettext(domain, value)
+            if value != translated_value:
+                return translated_value
         # then try app-install-data
-        value = self.get(self.DE, key)
         if value:
-            translated_value = gettext.dgettext("app-install-data", value)
+            translated_value = locale_keys.dgettext("app-install-data", value)
             if value != translated_value:
                 return translated_value
         # then try the i18n version of the key (in [de_DE] or
-        # [de]) but ignore errors and return the untranslated one then
-        try:
-            locale = getdefaultlocale(('LANGUAGE', 'LANG', 'LC_CTYPE',
-                'LC_ALL'))[0]
-            if locale:
-                if self.has_option_desktop("%s[%s]" % (key, locale)):
-                    return self.get(self.DE, "%s[%s]" % (key, locale))
-                if "_" in locale:
-                    locale_short = locale.split("_")[0]
-                    if self.has_option_desktop("%s[%s]" % (key, locale_short)):
-                        return self.get(self.DE, "%s[%s]" %
-                            (key, locale_short))
-        except ValueError:
-            pass
-        # and then the untranslated field
-        return self.get(self.DE, key)
+        # [de]) and then the untranslated field
+        for k in locale_keys.get_keys(key, "%s[%s]"):
+            if self.has_option_desktop(k):
+                return self.get(self.DE, k)
+        return value
 
     def has_option_desktop(self, key):
         " test if there is the option under 'Desktop Entry'"
@@ -541,6 +657,77 @@ class DesktopConfigParser(RawConfigParser, AppInfoParserBase):
         return self._filename
 
 
+# the data of a package candidate that the indexer needs, origins is a
+# tuple of (archive, component, label, origin, site) tuples
+PackageRecord = namedtuple("PackageRecord",
+                           ("section", "summary", "description", "origins"))
+
+
+class PackageMetadataSnapshot(object):
+    """ compact table of the package data that the indexer needs
+
+        The data of a pkgname is read from the PackageInfo only once and
+        kept as a PackageRecord, the indexer does not need to go through
+        the PackageInfo (and its python-apt wrappers) for every lookup
+        then. Everything else is forwarded to the wrapped PackageInfo.
+
+        The table is filled on first lookup and not in one pass over the
+        cache when it is created: the sources only reference a small part
+        of the archive and an incremental update often reindexes a single
+        source, an eager pass would read the description of every package
+        for nothing. The PackageInfo is not reopened while indexing, so
+        the records are still a consistent view of the cache.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._records = {}
+
+    @staticmethod
+    def make_record(cache, pkgname):
+        """ return the PackageRecord of pkgname read from the given
+            PackageInfo or None if there is no candidate for it
+        """
+        if pkgname not in cache:
+            return None
+        pkg = cache[pkgname]
+        candidate = pkg.candidate
+        if not candidate:
+            return None
+        origins = tuple([(origin.archive, origin.component, origin.label,
+                          origin.origin, origin.site)
+                         for origin in candidate.origins])
+        return PackageRecord(pkg.section, candidate.summary,
+                             candidate.description, origins)
+
+    def get(self, pkgname):
+        """ return the PackageRecord of pkgname or None """
+        try:
+            return self._records[pkgname]
+        except KeyError:
+            record = self.make_record(self._cache, pkgname)
+            self._records[pkgname] = record
+            return record
+
+    def __contains__(self, pkgname):
+        return pkgname in self._cache
+
+    def __getitem__(self, pkgname):
+        return self._cache[pkgname]
+
+    def __getattr__(self, name):
+        return getattr(self._cache, name)
+
+
+def get_package_record(cache, pkgname):
+    """ return the PackageRecord of pkgname from the given
+        PackageMetadataSnapshot or PackageInfo
+    """
+    if isinstance(cache, PackageMetadataSnapshot):
+        return cache.get(pkgname)
+    return PackageMetadataSnapshot.make_record(cache, pkgname)
+
+
 def ascii_upper(key):
     """Translate an ASCII string to uppercase
     in a locale-independent manner."""
@@ -549,6 +736,15 @@ def ascii_upper(key):
     return key.translate(ascii_trans_table)
 
 
+def get_unique_id_term(parser, pkgname, untranslated_name):
+    """ return the term that uniquely identifies the document of the
+        given application of the entry of the parser in its source
+    """
+    return "AU" + hashlib.md5("%s\0%s\0%s\0%s" % (
+        utf8(parser.source), utf8(parser.entry_id), utf8(pkgname),
+        utf8(untranslated_name))).hexdigest()
+
+
 def index_name(doc, name, term_generator):
     """ index the name of the application """
     doc.add_value(XapianValues.APPNAME, name)
@@ -557,11 +753,161 @@ def index_name(doc, name, term_generator):
     term_generator.index_text_without_positions(name, w)
 
 
-def update(db, cache, datadir=None):
+class MainLoopProgress(object):
+    """ the default progress of the indexer, it keeps the GLib main loop
+        (and with it e.g. dbus or a UI) responsive while indexing
+    """
+
+    def __init__(self):
+        self.context = GObject.main_context_default()
+
+    def update(self, item=None):
+        """ called for every source file or entry that gets indexed, item
+            is None if the indexer is just waiting for something
+        """
+        while self.context.pending():
+            self.context.iteration()
+
+
+class RateLimitedProgress(object):
+    """ progress for headless indexing that never touches the GLib main
+        loop, callback(nr_items, item) is called at most once per interval
+        seconds (by default the progress is logged)
+    """
+
+    def __init__(self, callback=None, interval=1.0):
+        self.callback = callback
+        self.interval = interval
+        self.nr_items = 0
+        self._last_report = 0
+
+    def update(self, item=None):
+        if item is None:
+            return
+        self.nr_items += 1
+        now = time.time()
+        if now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        if self.callback:
+            self.callback(self.nr_items, item)
+        else:
+            LOG.info("indexed %i items (%s)" % (self.nr_items, item))
+
+
+def get_rss():
+    """ return the resident set size of the process in bytes (or 0 if
+        it is unknown)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, IndexError, ValueError):
+        return 0
+
+
+class BatchedWritableDatabase(xapian.WritableDatabase):
+    """ a xapian.WritableDatabase that groups the document writes into
+        explicit transactions instead of leaving it to the automatic
+        flushing of xapian
+
+        A batch is committed once max_docs documents were written or the
+        process grew by more than max_memory bytes since the batch was
+        started (the module wide BATCH_MAX_DOCS and BATCH_MAX_MEMORY are
+        used by default). The (nr_docs, seconds) of every commit are
+        recorded in commit_timings.
+    """
+
+    # check the memory use only every n documents, reading it is not free
+    MEMORY_CHECK_INTERVAL = 100
+
+    def __init__(self, path, action, max_docs=None, max_memory=None):
+        xapian.WritableDatabase.__init__(self, path, action)
+        if max_docs is None:
+            max_docs = BATCH_MAX_DOCS
+        if max_memory is None:
+            max_memory = BATCH_MAX_MEMORY
+        self.max_docs = max_docs
+        self.max_memory = max_memory
+        self.commit_timings = []
+        self._in_batch = False
+        self._batch_docs = 0
+        self._batch_rss = 0
+
+    def _begin_write(self):
+        if self._in_batch:
+            return
+        self.begin_transaction()
+        self._in_batch = True
+        self._batch_docs = 0
+        if self.max_memory:
+            self._batch_rss = get_rss()
+
+    def _end_write(self):
+        self._batch_docs += 1
+        if self.max_docs and self._batch_docs >= self.max_docs:
+            self.commit_batch()
+        elif (self.max_memory and
+              self._batch_docs % self.MEMORY_CHECK_INTERVAL == 0 and
+              get_rss() - self._batch_rss > self.max_memory):
+            self.commit_batch()
+
+    def add_document(self, doc):
+        self._begin_write()
+        docid = xapian.WritableDatabase.add_document(self, doc)
+        self._end_write()
+        return docid
+
+    def replace_document(self, unique, doc):
+        self._begin_write()
+        docid = xapian.WritableDatabase.replace_document(self, unique, doc)
+        self._end_write()
+        return docid
+
+    def delete_document(self, unique):
+        self._begin_write()
+        xapian.WritableDatabase.delete_document(self, unique)
+        self._end_write()
+
+    def commit_batch(self):
+        """ commit the current batch (if there is one) to disk """
+        if not self._in_batch:
+            return
+        start = time.time()
+        self.commit_transaction()
+        seconds = time.time() - start
+        self._in_batch = False
+        self.commit_timings.append((self._batch_docs, seconds))
+        LOG.debug("committed %i documents in %.3fs" % (
+            self._batch_docs, seconds))
+
+    def flush(self):
+        # a flush inside a transaction is not allowed by xapian, but
+        # committing the transaction has the same effect
+        if self._in_batch:
+            self.commit_batch()
+        else:
+            xapian.WritableDatabase.flush(self)
+
+    def close(self):
+        self.commit_batch()
+        xapian.WritableDatabase.close(self)
+
+    def log_commit_timings(self):
+        """ log a summary of the commit_timings """
+        if not self.commit_timings:
+            return
+        seconds = [t for (nr_docs, t) in self.commit_timings]
+        LOG.info("committed %i documents in %i batches, %.3fs total, "
+                 "%.3fs max" % (sum([n for (n, t) in self.commit_timings]),
+                                len(seconds), sum(seconds), max(seconds)))
+
+
+def update(db, cache, datadir=None, progress=None):
     if not datadir:
         datadir = softwarecenter.paths.APP_INSTALL_DESKTOP_PATH
-    update_from_app_install_data(db, cache, datadir)
-    update_from_var_lib_apt_lists(db, cache)
+    update_from_app_install_data(db, cache, datadir, progress)
+    update_from_var_lib_apt_lists(db, cache, progress=progress)
     # add db global meta-data
     LOG.debug("adding popcon_max_desktop '%s'" % popcon_max)
     db.set_metadata("popcon_max_desktop",
@@ -571,13 +917,13 @@ def update(db, cache, datadir=None):
 def update_from_json_string(db, cache, json_string, origin):
     """ index from a json string, should include origin url (free form string)
     """
-    for sec in json.loads(json_string):
-        parser = JsonTagSectionParser(sec, origin)
+    for (i, sec) in enumerate(json.loads(json_string)):
+        parser = JsonTagSectionParser(sec, origin, i)
         index_app_info_from_parser(parser, db, cache)
     return True
 
 
-def update_from_var_lib_apt_lists(db, cache, listsdir=None):
+def update_from_var_lib_apt_lists(db, cache, listsdir=None, progress=None):
     """ index the files in /var/lib/apt/lists/*AppInfo """
     try:
         import apt_pkg
@@ -585,32 +931,62 @@ def update_from_var_lib_apt_lists(db, cache, listsdir=None):
         return False
     if not listsdir:
         listsdir = apt_pkg.config.find_dir("Dir::State::lists")
-    context = GObject.main_context_default()
+    if progress is None:
+        progress = MainLoopProgress()
     for appinfo in glob("%s/*AppInfo" % listsdir):
         LOG.debug("processing %s" % appinfo)
-        # process events
-        while context.pending():
-            context.iteration()
-        tagf = apt_pkg.TagFile(open(appinfo))
-        for section in tagf:
-            parser = DesktopTagSectionParser(section, appinfo)
-            index_app_info_from_parser(parser, db, cache)
+        progress.update(appinfo)
+        update_from_single_appinfo_file(db, cache, appinfo)
     return True
 
 
+def update_from_single_appinfo_file(db, cache, appinfo):
+    """ index a single /var/lib/apt/lists/*AppInfo file """
+    import apt_pkg
+    tagf = apt_pkg.TagFile(open(appinfo))
+    for (i, section) in enumerate(tagf):
+        parser = DesktopTagSectionParser(section, appinfo, i)
+        index_app_info_from_parser(parser, db, cache)
+
+
+def iterparse_appstream_applications(filename):
+    """ yield the <application> elements of the given AppStream file
+        one by one
+
+        The file is never read as a whole, elements that got yielded are
+        freed again so that the memory used does not depend on the size
+        of the file.
+    """
+    from lxml import etree
+    for (event, appinfo) in etree.iterparse(filename, tag="application"):
+        yield appinfo
+        appinfo.clear()
+        # the root still references the cleared elements, drop them too
+        while appinfo.getprevious() is not None:
+            del appinfo.getparent()[0]
+
+
 def update_from_single_appstream_file(db, cache, filename):
     from lxml import etree
 
-    tree = etree.parse(open(filename))
-    root = tree.getroot()
-    if not root.tag == "applications":
+    # only look at the start of the root tag
+    root = None
+    with open(filename) as f:
+        try:
+            for (event, root) in etree.iterparse(f, events=("start",)):
+                break
+        except etree.XMLSyntaxError as e:
+            # e.g. an empty file
+            LOG.debug("no root tag in '%s' (%s)" % (filename, e))
+    if root is None or not root.tag == "applications":
         LOG.error("failed to read '%s' expected Applications root tag" %
             filename)
         return
 
     if hasattr(cache, 'prefill_cache'):
+        # cheap first pass that only collects the pkgnames
         needed = []
-        for appinfo in root.iter("application"):
+        for appinfo in iterparse_appstream_applications(filename):
             pkgname_node = appinfo.find('pkgname')
             if pkgname_node is not None:
                 needed.append(pkgname_node.text)
@@ -618,15 +994,17 @@ def update_from_single_appstream_file(db, cache, filename):
         cache.prefill_cache(wanted_pkgs=needed, prefill_descriptions=False, only_newest=False)
         cache.prefill_cache(wanted_pkgs=needed, prefill_descriptions=True, only_newest=True)
 
-    for appinfo in root.iter("application"):
-        parser = AppStreamXMLParser(appinfo, filename)
+    for (i, appinfo) in enumerate(
+            iterparse_appstream_applications(filename)):
+        parser = AppStreamXMLParser(appinfo, filename, i)
         index_app_info_from_parser(parser, db, cache)
 
 
-def update_from_appstream_xml(db, cache, xmldir=None):
+def update_from_appstream_xml(db, cache, xmldir=None, progress=None):
     if not xmldir:
         xmldir = softwarecenter.paths.APPSTREAM_XML_PATH
-    context = GObject.main_context_default()
+    if progress is None:
+        progress = MainLoopProgress()
 
     if os.path.isfile(xmldir):
         update_from_single_appstream_file(db, cache, xmldir)
@@ -634,40 +1012,42 @@ def update_from_appstream_xml(db, cache, xmldir=None):
 
     for appstream_xml in glob(os.path.join(xmldir, "*.xml")):
         LOG.debug("processing %s" % appstream_xml)
-        # process events
-        while context.pending():
-            context.iteration()
+        progress.update(appstream_xml)
         update_from_single_appstream_file(db, cache, appstream_xml)
     return True
 
 
-def update_from_app_install_data(db, cache, datadir=None):
+def update_from_app_install_data(db, cache, datadir=None, progress=None):
     """ index the desktop files in $datadir/desktop/*.desktop """
     if not datadir:
         datadir = softwarecenter.paths.APP_INSTALL_DESKTOP_PATH
-    context = GObject.main_context_default()
+    if progress is None:
+        progress = MainLoopProgress()
     for desktopf in glob(datadir + "/*.desktop"):
         LOG.debug("processing %s" % desktopf)
-        # process events
-        while context.pending():
-            context.iteration()
-        try:
-            parser = DesktopConfigParser()
-            parser.read(desktopf)
-            index_app_info_from_parser(parser, db, cache)
-        except Exception as e:
-            # Print a warning, no error (Debian Bug #568941)
-            LOG.debug("error processing: %s %s" % (desktopf, e))
-            warning_text = _(
-                "The file: '%s' could not be read correctly. The application "
-                "associated with this file will not be included in the "
-                "software catalog. Please consider raising a bug report "
-                "for this issue with the maintainer of that "
-                "application") % desktopf
-            LOG.warning(warning_text)
+        progress.update(desktopf)
+        update_from_single_desktop_file(db, cache, desktopf)
     return True
 
 
+def update_from_single_desktop_file(db, cache, desktopf):
+    """ index a single app-install-data desktop file """
+    try:
+        parser = DesktopConfigParser()
+        parser.read(desktopf)
+        index_app_info_from_parser(parser, db, cache)
+    except Exception as e:
+        # Print a warning, no error (Debian Bug #568941)
+        LOG.debug("error processing: %s %s" % (desktopf, e))
+        warning_text = _(
+            "The file: '%s' could not be read correctly. The application "
+            "associated with this file will not be included in the "
+            "software catalog. Please consider raising a bug report "
+            "for this issue with the maintainer of that "
+            "application") % desktopf
+        LOG.warning(warning_text)
+
+
 def add_from_purchased_but_needs_reinstall_data(
     purchased_but_may_need_reinstall_list, db, cache):
     """Add application that have been purchased but may require a reinstall
@@ -706,9 +1086,11 @@ def add_from_purchased_but_needs_reinstall_data(
     return query
 
 
-def update_from_software_center_agent(db, cache, ignore_cache=False,
-                                      include_sca_qa=False):
-    """ update index based on the software-center-agent data """
+def get_sca_entries(ignore_cache=False, include_sca_qa=False):
+    """ return a tuple (entries, good_data) with the entries that the
+        software-center-agent has available, good_data is False if the
+        agent sent an error
+    """
     def _available_cb(sca, available):
         # print "available: ", available
         LOG.debug("available: '%s'" % available)
@@ -738,20 +1120,116 @@ def update_from_software_center_agent(db, cache, ignore_cache=False,
     context = GObject.main_context_default()
     loop = GObject.MainLoop(context)
     loop.run()
-    # process data
-    for entry in sca.available:
-        # process events
-        while context.pending():
-            context.iteration()
+    return (sca.available, sca.good_data)
+
+
+def update_from_software_center_agent(db, cache, ignore_cache=False,
+                                      include_sca_qa=False, progress=None):
+    """ update index based on the software-center-agent data """
+    (entries, good_data) = get_sca_entries(ignore_cache, include_sca_qa)
+    # process data, without good data we can not tell which entries got
+    # removed from the agent
+    update_from_sca_entries(db, cache, entries,
+                            remove_missing=good_data, progress=progress)
+    # return true if we have updated entries (this can also be an empty list)
+    # but only if we did not got a error from the agent
+    return good_data
+
+
+def _normalize_sca_value(value):
+    """ return value with the nested objects of a software-center-agent
+        entry turned into plain dicts, their default str() contains the
+        memory address
+    """
+    if isinstance(value, dict):
+        return dict((key, _normalize_sca_value(item))
+                    for (key, item) in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_normalize_sca_value(item) for item in value]
+    if hasattr(value, "__dict__"):
+        return _normalize_sca_value(vars(value))
+    return value
+
+
+def get_sca_fingerprint(entry):
+    """ return a fingerprint of the data of a software-center-agent entry,
+        it changes whenever the agent sends different data for the entry
+    """
+    data = json.dumps(_normalize_sca_value(entry), sort_keys=True,
+                      default=str)
+    return hashlib.md5(data).hexdigest()
+
+
+def sca_entries_changed(db, entries, remove_missing=True):
+    """ return True if update_from_sca_entries() would index or remove
+        any of the entries of db
+    """
+    old_fingerprints = json.loads(db.get_metadata("sca-fingerprints") or "{}")
+    new_fingerprints = set(get_sca_fingerprint(entry) for entry in entries)
+    if new_fingerprints - set(old_fingerprints):
+        return True
+    return bool(remove_missing and set(old_fingerprints) - new_fingerprints)
+
+
+def update_from_sca_entries(db, cache, entries, remove_missing=True,
+                            progress=None):
+    """ index the software-center-agent entries that changed since the
+        last run into db and return the number of indexed and removed
+        entries
+
+        The fingerprints of the indexed entries and the unique ids of
+        their documents are kept in the "sca-fingerprints" metadata, an
+        entry with a known fingerprint is skipped. If remove_missing is
+        True the documents of the entries that are no longer sent by
+        the agent are deleted.
+    """
+    global indexed_unique_ids
+    if progress is None:
+        progress = MainLoopProgress()
+    old_fingerprints = json.loads(db.get_metadata("sca-fingerprints") or "{}")
+    new_fingerprints = {}
+    nr_indexed = 0
+    nr_removed = 0
+    for entry in entries:
+        progress.update(entry)
+        # the parser modifies the entry, so get the fingerprint first
+        fingerprint = get_sca_fingerprint(entry)
+        if fingerprint in old_fingerprints:
+            new_fingerprints[fingerprint] = old_fingerprints[fingerprint]
+            continue
+        indexed_unique_ids = set()
         try:
             # now the normal parser
             parser = SCAApplicationParser(entry)
             index_app_info_from_parser(parser, db, cache)
         except Exception as e:
             LOG.warning("error processing: %s " % e)
-    # return true if we have updated entries (this can also be an empty list)
-    # but only if we did not got a error from the agent
-    return sca.good_data
+            continue
+        finally:
+            unique_ids = indexed_unique_ids
+            indexed_unique_ids = None
+        new_fingerprints[fingerprint] = sorted(
+            set(new_fingerprints.get(fingerprint, [])) | unique_ids)
+        nr_indexed += 1
+    if remove_missing:
+        # a changed entry replaced its old document already and different
+        # entries may share a document
+        current_unique_ids = set()
+        for unique_ids in new_fingerprints.values():
+            current_unique_ids.update(unique_ids)
+        for fingerprint in set(old_fingerprints) - set(new_fingerprints):
+            for unique_id in old_fingerprints[fingerprint]:
+                if unique_id not in current_unique_ids:
+                    db.delete_document(unique_id)
+            nr_removed += 1
+    else:
+        # keep what we know about the entries we did not see this time
+        for fingerprint in set(old_fingerprints) - set(new_fingerprints):
+            new_fingerprints[fingerprint] = old_fingerprints[fingerprint]
+    LOG.debug("indexed %i changed and removed %i software-center-agent "
+              "entries" % (nr_indexed, nr_removed))
+    db.set_metadata("sca-fingerprints", json.dumps(new_fingerprints))
+    return nr_indexed + nr_removed
 
 
 def make_doc_from_parser(parser, cache):
@@ -806,9 +1284,14 @@ def make_doc_from_parser(parser, cache):
         doc.add_term(pkgname.replace('-', '_'))
     doc.add_value(XapianValues.PKGNAME, pkgname)
     doc.add_value(XapianValues.DESKTOP_FILE, parser.desktopf)
+    # the source and a unique id term for incremental updates
+    doc.add_term("AF" + parser.source)
+    doc.add_term(get_unique_id_term(parser, pkgname, untranslated_name))
     # display name
     if "display_name" in axi_values:
         doc.add_value(axi_values["display_name"], name)
+    # precomputed collation key for the sorting by name
+    doc.add_value(XapianValues.APPNAME_SORT_KEY, make_sort_key(name))
     # cataloged_times
     if "catalogedtime" in axi_values:
         if pkgname in cataloged_times:
@@ -820,9 +1303,9 @@ def make_doc_from_parser(parser, cache):
         doc.add_term("AS" + archive_section)
         doc.add_value(XapianValues.ARCHIVE_SECTION, archive_section)
     # section (mail, base, ..)
-    if pkgname in cache and cache[pkgname].candidate:
-        section = cache[pkgname].section
-        doc.add_term("AE" + section)
+    record = get_package_record(cache, pkgname)
+    if record:
+        doc.add_term("AE" + record.section)
     # channel (third party stuff)
     if parser.has_option_desktop("X-AppInstall-Channel"):
         archive_channel = parser.get_desktop("X-AppInstall-Channel")
@@ -978,9 +1461,8 @@ def make_doc_from_parser(parser, cache):
         s = parser.get_desktop("GenericName")
         if s != name:
             doc.add_value(XapianValues.SUMMARY, s)
-    elif pkgname in cache and cache[pkgname].candidate:
-        s = cache[pkgname].candidate.summary
-        doc.add_value(XapianValues.SUMMARY, s)
+    elif record:
+        doc.add_value(XapianValues.SUMMARY, record.summary)
 
     return doc
 
@@ -1034,19 +1516,18 @@ def index_app_info_from_parser(parser, db, cache):
                 w = 1
             term_generator.index_text_without_positions(s, w)
         # add data from the apt cache
-        if pkgname in cache and cache[pkgname].candidate:
-            s = cache[pkgname].candidate.summary
-            term_generator.index_text_without_positions(s,
+        record = get_package_record(cache, pkgname)
+        if record:
+            term_generator.index_text_without_positions(record.summary,
                 WEIGHT_APT_SUMMARY)
-            s = cache[pkgname].candidate.description
-            term_generator.index_text_without_positions(s,
+            term_generator.index_text_without_positions(record.description,
                 WEIGHT_APT_DESCRIPTION)
-            for origin in cache[pkgname].candidate.origins:
-                doc.add_term("XOA" + origin.archive)
-                doc.add_term("XOC" + origin.component)
-                doc.add_term("XOL" + origin.label)
-                doc.add_term("XOO" + origin.origin)
-                doc.add_term("XOS" + origin.site)
+            for (archive, component, label, origin, site) in record.origins:
+                doc.add_term("XOA" + archive)
+                doc.add_term("XOC" + component)
+                doc.add_term("XOL" + label)
+                doc.add_term("XOO" + origin)
+                doc.add_term("XOS" + site)
 
         # add our keywords (with high priority)
         keywords = None
@@ -1059,72 +1540,497 @@ def index_app_info_from_parser(parser, db, cache):
                 if s:
                     term_generator.index_text_without_positions(s,
                         WEIGHT_DESKTOP_KEYWORD)
-        # now add it
-        db.add_document(doc)
+        # now add it, an older version of the same document gets replaced
+        unique_id = get_unique_id_term(
+            parser, pkgname,
+            doc.get_value(XapianValues.APPNAME_UNTRANSLATED))
+        db.replace_document(unique_id, doc)
+        if indexed_unique_ids is not None:
+            indexed_unique_ids.add(unique_id)
+
+
+# the functions that index a single source file, the parallel index
+# build dispatches the (kind, path) tuples from get_index_sources() to them
+INDEX_SOURCE_HANDLERS = {
+    "desktop": update_from_single_desktop_file,
+    "appinfo": update_from_single_appinfo_file,
+    "appstream": update_from_single_appstream_file,
+    }
+
+# the cache used by the worker processes of the parallel index build, it
+# is inherited on fork() as a PackageInfo object can not be pickled
+_shard_cache = None
+
+
+def get_index_source_kinds(debian_sources=True, appstream_sources=False):
+    """ return the set of the kinds of the sources that
+        get_index_sources() looks for
+    """
+    kinds = set()
+    if debian_sources:
+        kinds.update(["desktop", "appinfo"])
+    if appstream_sources:
+        kinds.add("appstream")
+    return kinds
 
 
-def rebuild_database(pathname, debian_sources=True, appstream_sources=False):
-    #cache = apt.Cache(memonly=True)
-    cache = get_pkg_info()
-    cache.open()
-    old_path = pathname + "_old"
-    rebuild_path = pathname + "_rb"
+def get_index_sources(debian_sources=True, appstream_sources=False,
+                      datadir=None, listsdir=None, xmldir=None):
+    """ return a list of (kind, path) tuples of the files that
+        rebuild_database() would index, kind is a key of
+        INDEX_SOURCE_HANDLERS
+    """
+    sources = []
+    if debian_sources:
+        if not datadir:
+            datadir = softwarecenter.paths.APP_INSTALL_DESKTOP_PATH
+        for desktopf in glob(datadir + "/*.desktop"):
+            sources.append(("desktop", desktopf))
+        if not listsdir:
+            try:
+                import apt_pkg
+                listsdir = apt_pkg.config.find_dir("Dir::State::lists")
+            except ImportError:
+                pass
+        if listsdir:
+            for appinfo in glob("%s/*AppInfo" % listsdir):
+                sources.append(("appinfo", appinfo))
+    if appstream_sources:
+        if not xmldir:
+            xmldir = softwarecenter.paths.APPSTREAM_XML_PATH
+        if os.path.isfile(xmldir):
+            sources.append(("appstream", xmldir))
+        else:
+            for appstream_xml in glob(os.path.join(xmldir, "*.xml")):
+                sources.append(("appstream", appstream_xml))
+    return sources
+
+
+def _index_sources_into_shard(args):
+    """ worker of update_parallel(), index the given sources into a new
+        database at shard_path and return the popcon_max of the shard
+    """
+    (shard_path, sources) = args
+    global popcon_max
+    popcon_max = 0
+    db = BatchedWritableDatabase(shard_path, xapian.DB_CREATE_OR_OVERWRITE)
+    for (kind, path) in sources:
+        LOG.debug("processing %s" % path)
+        INDEX_SOURCE_HANDLERS[kind](db, _shard_cache, path)
+    db.flush()
+    db.log_commit_timings()
+    return popcon_max
+
+
+def merge_shard(db, shard_path):
+    """ copy all documents and spelling data of the database at shard_path
+        into db and remove the shard afterwards
+    """
+    shard = xapian.Database(shard_path)
+    for m in shard.postlist(""):
+        db.add_document(shard.get_document(m.docid))
+    for spelling in shard.spellings():
+        db.add_spelling(spelling.term, spelling.termfreq)
+    shard.close()
+    shutil.rmtree(shard_path)
+
+
+def update_parallel(db, cache, sources, shard_basepath, jobs=0,
+                    progress=None):
+    """ index the given (kind, path) sources with multiple worker processes
+
+        Every worker writes into its own shard database next to
+        shard_basepath, the shards are merged into db once all workers
+        are finished. If jobs is 0 one worker per cpu is used.
+
+        :return: the popcon_max of all indexed sources
+    """
+    import multiprocessing
+    global popcon_max, _shard_cache
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(sources))
+    if jobs < 1:
+        return popcon_max
+    # deal out the biggest sources first so that the shards end up
+    # with roughly the same amount of work
+    sources = sorted(sources, key=lambda source: os.path.getsize(source[1]),
+                     reverse=True)
+    work = [("%s_shard%i" % (shard_basepath, i), sources[i::jobs])
+            for i in range(jobs)]
+    _shard_cache = cache
+    pool = multiprocessing.Pool(jobs)
+    try:
+        result = pool.map_async(_index_sources_into_shard, work)
+        if progress is None:
+            progress = MainLoopProgress()
+        while not result.ready():
+            progress.update()
+            result.wait(0.1)
+        shards_popcon_max = result.get()
+    finally:
+        pool.close()
+        pool.join()
+        _shard_cache = None
+    popcon_max = max([popcon_max] + shards_popcon_max)
+    for (shard_path, shard_sources) in work:
+        LOG.debug("merging %s (%i sources)" % (shard_path,
+                                               len(shard_sources)))
+        merge_shard(db, shard_path)
+    return popcon_max
+
+
+def index_sources(db, cache, sources, shard_basepath, jobs=1,
+                  progress=None):
+    """ index the given (kind, path) sources into db, in parallel with
+        update_parallel() if jobs is not 1, and record the
+        popcon_max_desktop of all of them
+
+        Both ways use the same handlers for the same sources, so they
+        produce the same documents and metadata.
+    """
+    global popcon_max
+    popcon_max = 0
+    if jobs != 1:
+        update_parallel(db, cache, sources, shard_basepath, jobs, progress)
+    else:
+        if progress is None:
+            progress = MainLoopProgress()
+        for (kind, path) in sources:
+            LOG.debug("processing %s" % path)
+            progress.update(path)
+            INDEX_SOURCE_HANDLERS[kind](db, cache, path)
+    LOG.debug("adding popcon_max_desktop '%s'" % popcon_max)
+    db.set_metadata("popcon_max_desktop",
+                    xapian.sortable_serialise(float(popcon_max)))
+
+
+def get_source_stamp(path):
+    """ return a string that changes whenever the given source file
+        changes
+    """
+    st = os.stat(path)
+    return "%s:%s" % (st.st_mtime, st.st_size)
+
+
+def make_source_stamps(sources):
+    """ return a dict of path -> [kind, stamp] for the given (kind, path)
+        sources
+    """
+    stamps = {}
+    for (kind, path) in sources:
+        stamps[path] = [kind, get_source_stamp(path)]
+    return stamps
+
 
-    if not os.path.exists(rebuild_path):
+def get_source_stamps(db):
+    """ return the dict of path -> [kind, stamp] of the sources that db
+        was built from
+    """
+    stamps = db.get_metadata("source-stamps")
+    if not stamps:
+        return {}
+    return json.loads(stamps)
+
+
+def get_apt_lists_stamp(listsdir=None):
+    """ return a string that changes whenever apt got new package lists
+        (e.g. after an apt-get update or when a PPA got added) or "" if
+        there are none, the documents embed the summaries, origins and
+        sections of the packages from them
+    """
+    if not listsdir:
         try:
-            os.makedirs(rebuild_path)
-        except:
-            LOG.warn("Problem creating rebuild path '%s'." % rebuild_path)
-            LOG.warn("Please check you have the relevant permissions.")
-            return False
+            import apt_pkg
+            listsdir = apt_pkg.config.find_dir("Dir::State::lists")
+        except ImportError:
+            return ""
+    try:
+        return get_source_stamp(listsdir)
+    except OSError:
+        return ""
+
+
+def get_popcon_max(db):
+    """ return the highest popcon of the documents of db (0 if none
+        has one)
+    """
+    enquire = xapian.Enquire(db)
+    enquire.set_query(xapian.Query(""))
+    enquire.set_sort_by_value(XapianValues.POPCON, True)
+    for match in enquire.get_mset(0, 1):
+        popcon = match.document.get_value(XapianValues.POPCON)
+        if popcon:
+            return xapian.sortable_unserialise(popcon)
+    return 0
+
+
+def get_app_install_mo_time():
+    """ return the ctime of the app-install-data translations as string
+        or "" if there are none
+    """
+    mofile = gettext.find("app-install-data")
+    if not mofile:
+        return ""
+    return str(os.path.getctime(mofile))
+
+
+def _get_appstream_xmldir():
+    # prefer the appdata of a local checkout
+    if os.path.exists('./data/app-stream/appdata.xml'):
+        return './data/app-stream/appdata.xml'
+    return None
+
+
+def update_incremental(db, cache, sources, progress=None, kinds=None):
+    """ reindex only the (kind, path) sources that changed since db was
+        last updated
+
+        The documents of a changed source are replaced using their unique
+        id term, documents that are no longer part of a changed source or
+        that belong to a removed source are deleted. Unchanged sources
+        are not touched at all. Only the sources of the given kinds
+        (all kinds by default) got looked for, the documents of the
+        sources of other kinds are kept.
+
+        :return: the number of changed or removed sources
+    """
+    global indexed_unique_ids
+    if kinds is None:
+        kinds = set(INDEX_SOURCE_HANDLERS)
+    old_stamps = get_source_stamps(db)
+    new_stamps = make_source_stamps(sources)
+    # the sources that were not looked for are kept as they are
+    for (path, (kind, stamp)) in old_stamps.items():
+        if kind not in kinds and path not in new_stamps:
+            new_stamps[path] = [kind, stamp]
+    nr_changed = 0
+    if progress is None:
+        progress = MainLoopProgress()
+    for (kind, path) in sources:
+        if old_stamps.get(path) == new_stamps[path]:
+            continue
+        LOG.debug("reindexing changed source %s" % path)
+        progress.update(path)
+        stale_docids = set([m.docid for m in db.postlist("AF" + path)])
+        indexed_unique_ids = set()
+        try:
+            INDEX_SOURCE_HANDLERS[kind](db, cache, path)
+            for unique_id in indexed_unique_ids:
+                for m in db.postlist(unique_id):
+                    stale_docids.discard(m.docid)
+        finally:
+            indexed_unique_ids = None
+        for docid in stale_docids:
+            db.delete_document(docid)
+        nr_changed += 1
+    for path in set(old_stamps) - set(new_stamps):
+        LOG.debug("removing documents of source %s" % path)
+        db.delete_document("AF" + path)
+        nr_changed += 1
+    db.set_metadata("source-stamps", json.dumps(new_stamps))
+    return nr_changed
+
+
+def set_channel_catalogue(db, cache):
+    """ record the channels of the packages in the cache as the
+        "channel-catalogue" metadata of db, see
+        StoreDatabase.get_channel_catalogue()
+    """
+    # the stamps are taken first, an axi update while the cache gets read
+    # makes the catalogue look outdated rather than current
+    axi_stamp = get_axi_stamp()
+    channels_stamp = get_channels_stamp()
+    channels = cache.get_all_channels()
+    if channels is None:
+        return
+    LOG.debug("recording %i channels" % len(channels))
+    db.set_metadata("channel-catalogue", json.dumps(
+            {"axi-stamp": axi_stamp,
+             "channels-stamp": channels_stamp,
+             "channels": sorted(channels),
+             }))
+
+
+def set_mimetype_table(db):
+    """ record the (appname, pkgname, popcon) of the most popular
+        applications of every mimetype as the "mimetype-table" metadata
+        of db, see StoreDatabase.get_most_popular_applications_for_mimetypes()
+    """
+    table = {}
+    for item in db.allterms("AM"):
+        apps = []
+        for posting in db.postlist(item.term):
+            doc = db.get_document(posting.docid)
+            popcon_raw = doc.get_value(XapianValues.POPCON)
+            if popcon_raw:
+                popcon = xapian.sortable_unserialise(popcon_raw)
+            else:
+                popcon = 0
+            apps.append((popcon, doc.get_value(XapianValues.APPNAME),
+                         doc.get_value(XapianValues.PKGNAME)))
+        # most popular first, the docid order breaks ties
+        apps.sort(key=lambda app: app[0], reverse=True)
+        table[item.term[2:]] = [[appname, pkgname, app_popcon]
+                                for (app_popcon, appname, pkgname)
+                                in apps[:MIMETYPE_TABLE_SIZE]]
+    LOG.debug("recording the applications of %i mimetypes" % len(table))
+    db.set_metadata("mimetype-table", json.dumps(table))
+
+
+def _publish_database(pathname, generation_path):
+    """ make generation_path the current generation of the database at
+        pathname and collect the old generations
+    """
+    # the symlink rename is atomic, readers either see the old or the
+    # new generation but never a missing database
+    try:
+        publish_generation(pathname, generation_path)
+    except (IOError, OSError) as e:
+        LOG.warn("Cannot publish refreshed database at '%s': %s" % (
+            pathname, e))
+        return False
+    for old_path in collect_generations(pathname):
+        LOG.debug("removed old database generation '%s'" % old_path)
+    return True
+
+
+def _needs_rebuild(db):
+    """ return True if db can not be updated incrementally """
+    return (db.get_metadata("db-schema-version") != DB_SCHEMA_VERSION or
+            not db.get_metadata("source-stamps") or
+            db.get_metadata("app-install-mo-time") !=
+            get_app_install_mo_time() or
+            db.get_metadata("apt-lists-stamp") != get_apt_lists_stamp() or
+            db.get_metadata("sort-key-locale") != get_sort_key_locale())
+
+
+def update_database(pathname, debian_sources=True, appstream_sources=False,
+                    progress=None):
+    """ incrementally update the database at pathname, see
+        update_incremental()
+
+        The current generation is copied into a new generation that gets
+        updated and published, like a rebuild does, so readers of the
+        current generation are not affected. If the database can not be
+        updated (e.g. because it does not exist yet, has a different
+        schema, the translations changed or apt got new package lists
+        whose data is part of every document) it is rebuilt from scratch
+        with rebuild_database()
+    """
+    base_path = os.path.dirname(os.path.abspath(pathname))
+    if not os.access(base_path, os.W_OK):
+        LOG.warn("Cannot write to '%s'." % base_path)
+        LOG.warn("Please check you have the relevant permissions.")
+        return False
+    # the reader lock keeps the current generation from being collected
+    # while it gets copied
+    (current_path, lock) = lock_generation(pathname)
+    try:
+        try:
+            current_db = xapian.Database(current_path or pathname)
+        except xapian.DatabaseError as e:
+            LOG.info("can not update '%s' (%s)" % (pathname, e))
+            current_db = None
+        if current_db is None or _needs_rebuild(current_db):
+            LOG.info("database '%s' needs a full rebuild" % pathname)
+            update_path = None
+        else:
+            current_db.close()
+            update_path = get_new_generation_path(pathname)
+            shutil.copytree(current_path or pathname, update_path,
+                            ignore=shutil.ignore_patterns(READER_LOCK))
+    finally:
+        if lock:
+            lock.close()
+    if update_path is None:
+        return rebuild_database(pathname, debian_sources, appstream_sources,
+                                progress=progress)
+    db = BatchedWritableDatabase(update_path, xapian.DB_OPEN)
+    cache = get_pkg_info()
+    cache.open()
+    cache = PackageMetadataSnapshot(cache)
+    sources = get_index_sources(debian_sources, appstream_sources,
+                                xmldir=_get_appstream_xmldir())
+    nr_changed = update_incremental(
+        db, cache, sources, progress,
+        kinds=get_index_source_kinds(debian_sources, appstream_sources))
+    LOG.info("reindexed %i changed sources" % nr_changed)
+    set_channel_catalogue(db, cache)
+    set_mimetype_table(db)
+    # the most popular document may have been changed or removed, so the
+    # popcon_max of the reindexed sources is not enough
+    db.set_metadata("popcon_max_desktop",
+                    xapian.sortable_serialise(float(get_popcon_max(db))))
+    db.flush()
+    db.log_commit_timings()
+    db.close()
+    return _publish_database(pathname, update_path)
+
+
+def rebuild_database(pathname, debian_sources=True, appstream_sources=False,
+                     jobs=1, progress=None, cache=None, datadir=None,
+                     listsdir=None, xmldir=None):
+    """ rebuild the database at pathname
+
+        If jobs is not 1 the sources are indexed in parallel by that
+        many worker processes (0 means one per cpu), see update_parallel().
+        The progress is reported to progress.update(), by default the GLib
+        main loop is kept running, see MainLoopProgress. The PackageInfo
+        cache and the directories of the sources (see get_index_sources())
+        default to the ones of the system.
+    """
+    if cache is None:
+        #cache = apt.Cache(memonly=True)
+        cache = get_pkg_info()
+        cache.open()
+    # read the package data the indexer needs only once
+    cache = PackageMetadataSnapshot(cache)
 
     # check permission
-    if not os.access(pathname, os.W_OK):
-        LOG.warn("Cannot write to '%s'." % pathname)
+    base_path = os.path.dirname(os.path.abspath(pathname))
+    if not os.access(base_path, os.W_OK):
+        LOG.warn("Cannot write to '%s'." % base_path)
         LOG.warn("Please check you have the relevant permissions.")
         return False
 
-    #check if old unrequired version of db still exists on filesystem
-    if os.path.exists(old_path):
-        LOG.warn("Existing xapian old db was not previously cleaned: '%s'." %
-            old_path)
-        if os.access(old_path, os.W_OK):
-            #remove old unrequired db before beginning
-            shutil.rmtree(old_path)
-        else:
-            LOG.warn("Cannot write to '%s'." % old_path)
-            LOG.warn("Please check you have the relevant permissions.")
-            return False
+    # every rebuild goes into a new generation directory that replaces
+    # the database at pathname once it is complete
+    rebuild_path = get_new_generation_path(pathname)
+    try:
+        os.makedirs(rebuild_path)
+    except:
+        LOG.warn("Problem creating rebuild path '%s'." % rebuild_path)
+        LOG.warn("Please check you have the relevant permissions.")
+        return False
 
     # write it
-    db = xapian.WritableDatabase(rebuild_path, xapian.DB_CREATE_OR_OVERWRITE)
-
-    if debian_sources:
-        update(db, cache)
-    if appstream_sources:
-        if os.path.exists('./data/app-stream/appdata.xml'):
-            update_from_appstream_xml(db, cache,
-                './data/app-stream/appdata.xml')
-        else:
-            update_from_appstream_xml(db, cache)
+    db = BatchedWritableDatabase(rebuild_path, xapian.DB_CREATE_OR_OVERWRITE)
+
+    if xmldir is None:
+        xmldir = _get_appstream_xmldir()
+    sources = get_index_sources(debian_sources, appstream_sources,
+                                datadir=datadir, listsdir=listsdir,
+                                xmldir=xmldir)
+    # stamp the sources before they are read so that changes made while
+    # indexing get picked up by the next incremental update
+    stamps = make_source_stamps(sources)
+    apt_lists_stamp = get_apt_lists_stamp(listsdir)
+    index_sources(db, cache, sources, rebuild_path, jobs, progress)
 
     # write the database version into the filep
     db.set_metadata("db-schema-version", DB_SCHEMA_VERSION)
     # update the mo file stamp for the langpack checks
-    mofile = gettext.find("app-install-data")
-    if mofile:
-        mo_time = os.path.getctime(mofile)
-        db.set_metadata("app-install-mo-time", str(mo_time))
+    mo_time = get_app_install_mo_time()
+    if mo_time:
+        db.set_metadata("app-install-mo-time", mo_time)
+    db.set_metadata("source-stamps", json.dumps(stamps))
+    db.set_metadata("apt-lists-stamp", apt_lists_stamp)
+    # the locale of the APPNAME_SORT_KEY values
+    db.set_metadata("sort-key-locale", get_sort_key_locale())
+    set_channel_catalogue(db, cache)
+    set_mimetype_table(db)
     db.flush()
-
-    # use shutil.move() instead of os.rename() as this will automatically
-    # figure out if it can use os.rename or needs to do the move "manually"
-    try:
-        shutil.move(pathname, old_path)
-        shutil.move(rebuild_path, pathname)
-        shutil.rmtree(old_path)
-        return True
-    except:
-        LOG.warn("Cannot copy refreshed database to correct location: '%s'." %
-            pathname)
-        return False
+    db.log_commit_timings()
+    db.close()
+    return _publish_database(pathname, rebuild_path)
@@ -16,8 +16,22 @@
 # this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import errno
+import fcntl
+import logging
+import os
+import re
+import shutil
 import xapian
 
+LOG = logging.getLogger(__name__)
+
+# a database at pathname is a symlink to its current generation directory
+# pathname.gen-N, readers keep a shared lock on the READER_LOCK file in
+# the generation they use so that it is not garbage collected under them
+GENERATION_SUFFIX = ".gen-"
+READER_LOCK = "readers.lock"
+
 
 def get_query_for_pkgnames(pkgnames):
     """ return a xapian query that matches exactly the list of pkgnames """
@@ -53,3 +67,128 @@ def get_installed_package_list():
         if pkg.is_installed:
             installed_pkgs.add(pkg.name)
     return installed_pkgs
+
+
+def _get_generations(pathname):
+    """ return a dict of generation number to path of the generation
+        directories of the database at pathname
+    """
+    dirname, basename = os.path.split(os.path.abspath(pathname))
+    gen_re = re.compile("^%s%s([0-9]+)$" % (
+        re.escape(basename), re.escape(GENERATION_SUFFIX)))
+    generations = {}
+    for name in os.listdir(dirname):
+        match = gen_re.match(name)
+        if match:
+            generations[int(match.group(1))] = os.path.join(dirname, name)
+    return generations
+
+
+def get_new_generation_path(pathname):
+    """ return the path of a new (not yet existing) generation directory
+        for the database at pathname
+    """
+    generations = _get_generations(pathname)
+    nr = max(generations.keys() or [0]) + 1
+    return "%s%s%i" % (os.path.abspath(pathname), GENERATION_SUFFIX, nr)
+
+
+def get_current_generation(pathname):
+    """ return the generation directory the database at pathname points
+        to or None if it is a plain (not generation managed) database
+    """
+    try:
+        target = os.readlink(pathname)
+    except OSError:
+        return None
+    return os.path.join(os.path.dirname(os.path.abspath(pathname)), target)
+
+
+def publish_generation(pathname, generation_path):
+    """ atomically make generation_path the current generation of the
+        database at pathname
+    """
+    # readers lock this file, it must exist before anyone can see the
+    # generation
+    open(os.path.join(generation_path, READER_LOCK), "a").close()
+    tmp_link = pathname + ".new"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.basename(generation_path), tmp_link)
+    if os.path.isdir(pathname) and not os.path.islink(pathname):
+        # a database of the old layout is a plain directory that can not
+        # be replaced atomically, move it out of the way (only once)
+        old_path = pathname + "_old"
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        shutil.move(pathname, old_path)
+        os.rename(tmp_link, pathname)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(tmp_link, pathname)
+
+
+def lock_generation(pathname):
+    """ take a shared reader lock on the current generation of the
+        database at pathname
+
+        Returns a (generation_path, lock) tuple, the generation is safe
+        from collect_generations() until lock is closed. For a plain
+        database (None, None) is returned.
+    """
+    while True:
+        generation_path = get_current_generation(pathname)
+        if generation_path is None:
+            return (None, None)
+        lock_path = os.path.join(generation_path, READER_LOCK)
+        try:
+            lock = open(lock_path)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                # collected after we read the symlink, try the new one
+                continue
+            raise
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        # the generation may have been collected while we waited
+        if os.path.exists(lock_path):
+            return (generation_path, lock)
+        lock.close()
+
+
+def collect_generations(pathname):
+    """ remove the generations of the database at pathname that are
+        neither current nor locked by a reader, returns the removed paths
+    """
+    current = get_current_generation(pathname)
+    generations = _get_generations(pathname)
+    current_nr = max([nr for (nr, path) in generations.items()
+                      if path == current] or [0])
+    removed = []
+    for (nr, generation_path) in generations.items():
+        if generation_path == current:
+            continue
+        lock_path = os.path.join(generation_path, READER_LOCK)
+        try:
+            lock = open(lock_path)
+        except IOError:
+            # never published, either a leftover of a failed build or
+            # (if it is newer than the current one) a build in progress
+            if nr > current_nr:
+                continue
+            lock = None
+        try:
+            if lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    LOG.debug("generation '%s' still in use" %
+                              generation_path)
+                    continue
+                # remove the lock first so that new readers notice
+                os.remove(lock_path)
+            shutil.rmtree(generation_path)
+            removed.append(generation_path)
+        finally:
+            if lock:
+                lock.close()
+    return removed
@@ -60,7 +60,7 @@ SOFTWARE_CENTER_TOS_LINK_NO_HEADER = "https://apps.ubuntu.com/cat/tos/plain/ "
 
 # version of the database, every time something gets added (like
 # terms for mime-type) increase this (but keep as a string!)
-DB_SCHEMA_VERSION = "6"
+DB_SCHEMA_VERSION = "9"
 
 # the default limit for a search
 DEFAULT_SEARCH_LIMIT = 10000
@@ -164,6 +164,7 @@ class XapianValues:
     SUPPORT_SITE_URL = 197
     VERSION_INFO = 198
     SC_SUPPORTED_DISTROS = 199
+    APPNAME_SORT_KEY = 200           # locale.strxfrm() of the APPNAME
 
 
 # fake channels
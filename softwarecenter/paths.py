@@ -69,6 +69,10 @@ APT_XAPIAN_INDEX_BASE_PATH = "/var/lib/apt-xapian-index"
 APT_XAPIAN_INDEX_DB_PATH = APT_XAPIAN_INDEX_BASE_PATH + "/index"
 APT_XAPIAN_INDEX_UPDATE_STAMP_PATH = (APT_XAPIAN_INDEX_BASE_PATH +
                                       "/update-timestamp")
+# touched by the origin plugin of apt-xapian-index whenever it reindexes
+# the channels, a channel catalogue that is older is outdated
+APT_XAPIAN_INDEX_CHANNELS_STAMP_PATH = (APT_XAPIAN_INDEX_BASE_PATH +
+                                        "/software-center-channels-stamp")
 
 
 # ratings&review
@@ -71,6 +71,7 @@ from softwarecenter.ui.gtk3.utils import (get_sc_icon_theme,
                                           init_sc_css_provider)
 from softwarecenter.version import VERSION
 from softwarecenter.db.database import StoreDatabase
+from softwarecenter.db.pool import format_pool_stats
 try:
     from aptd_gtk3 import InstallBackendUI
     InstallBackendUI  # pyflakes
@@ -150,6 +151,15 @@ class SoftwarecenterDbusController(dbus.service.Object):
     def triggerCacheReload(self):
         self.parent.cache.emit("cache-ready")
 
+    @dbus.service.method('com.ubuntu.SoftwarecenterIFace', out_signature='s')
+    def getQueryProfile(self):
+        """ return the latency histograms of the queries by query class
+            and the statistics of the xapian reader handles
+        """
+        db = self.parent.db
+        return "\n".join([db.profiler.format_histograms(),
+                          format_pool_stats(db.get_pool_stats())])
+
 
 class SoftwareCenterAppGtk3(SimpleGtkbuilderApp):
 
@@ -1149,7 +1159,8 @@ class SoftwareCenterAppGtk3(SimpleGtkbuilderApp):
             pass
         else:
             # we need to reopen when the database finished updating
-            self.db.reopen()
+            # (and published a new generation)
+            self.db.reopen_if_changed()
 
     def setup_database_rebuilding_listener(self):
         """
@@ -40,6 +40,7 @@ from softwarecenter.backend.reviews import get_review_loader
 from softwarecenter.paths import SOFTWARE_CENTER_ICON_CACHE_DIR
 
 import softwarecenter.paths
+from softwarecenter.db.enquire import PaginatedMatches
 from softwarecenter.db.categories import (
     category_subcat, category_cat, CategoriesParser)
 
@@ -361,7 +362,11 @@ class AppGenericStore(AppPropertiesHelper):
             if self.current_matches is None:
                 return False
             db = self.db.xapiandb
-            for m in self.current_matches:
+            matches = self.current_matches
+            # the other pages of paginated matches are loaded on demand
+            if isinstance(matches, PaginatedMatches):
+                matches = matches.get_loaded_matches()
+            for m in matches:
                 doc = db.get_document(m.docid)
 
                 # calling get_icon is enough to cache the icon
@@ -425,8 +430,12 @@ class AppListStore(Gtk.ListStore, AppGenericStore):
 
         extent = min(self.LOAD_INITIAL, n_matches)
 
+        # the matches may come from the xapian handle of a query worker
+        # that is back in the pool, read the documents with ours
+        db = self.db.xapiandb
         with ExecutionTime("store.append_initial"):
-            for doc in [m.document for m in matches][:extent]:
+            for doc in [db.get_document(m.docid)
+                        for m in matches[:extent]]:
                 doc.available = doc.installed = doc.purchasable = None
                 self.append((doc,))
 
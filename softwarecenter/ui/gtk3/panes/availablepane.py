@@ -91,6 +91,8 @@ class AvailablePane(SoftwarePane):
                  navhistory_forward_action):
         # parent
         SoftwarePane.__init__(self, cache, db, distro, icons, datadir)
+        # the app list loads the rows it shows on demand
+        self.enquirer.paginated = True
         self.searchentry.set_sensitive(False)
         # navigation history actions
         self.navhistory_back_action = navhistory_back_action
@@ -299,7 +301,9 @@ class AvailablePane(SoftwarePane):
             query = self.state.category.query
         # mix channel/category with the search terms and return query
         return self.db.get_query_list_from_search_entry(
-                            self.state.search_term, query)
+                            self.state.search_term, query,
+                            session=self.search_session,
+                            query_class=self.get_query_class())
 
     def _in_no_display_category(self):
         """return True if we are in a category with NoDisplay set in the XML"""
@@ -113,6 +113,10 @@ class InstalledPane(SoftwarePane, CategoriesParser):
         self._halt_build = False
 
         self.nonapps_visible = NonAppVisibility.NEVER_VISIBLE
+        self.enquirer.query_class = self.get_query_class()
+        # called with the enquirer once the pending query is complete,
+        # see _set_query_then()
+        self._query_complete_callback = None
 
         self.visible_docids = None
         self.visible_cats = {}
@@ -374,6 +378,8 @@ class InstalledPane(SoftwarePane, CategoriesParser):
                 rebuild_categorised_view()
 
         def rebuild_categorised_view():
+            # the blocking queries supersede a pending one
+            self._query_complete_callback = None
             self.cat_docid_map = {}
             enq = self.enquirer
 
@@ -385,36 +391,56 @@ class InstalledPane(SoftwarePane, CategoriesParser):
             xfilter = AppFilter(self.db, self.cache)
             xfilter.set_installed_only(True)
 
-            for cat in self._all_cats:
-                # for each category do category query and append as a new
-                # node to tree_view
-                if not self._use_category(cat):
-                    continue
-                query = self.get_query_for_cat(cat)
-                LOG.debug("xfilter.installed_only: %s" %
-                    xfilter.installed_only)
-                enq.set_query(query,
-                              sortmode=SortMethods.BY_ALPHABET,
-                              nonapps_visible=self.nonapps_visible,
-                              filter=xfilter,
-                              nonblocking_load=False,
-                              persistent_duplicate_filter=(i > 0))
-
-                L = len(enq.matches)
-                if L:
-                    i += L
-                    docs = enq.get_documents()
+            # count the installed documents of all the categories in a
+            # single match to skip the empty ones
+            if self.state.channel and self.state.channel.query:
+                channel_query = self.state.channel.query
+            else:
+                channel_query = xapian.Query("")
+            installed_query = xfilter.filter_query(channel_query)
+            if installed_query is not None:
+                counts = self.db.get_category_counts(self._all_cats,
+                                                     installed_query)
+            else:
+                counts = None
+            cats = [cat for cat in self._all_cats
+                    if self._use_category(cat) and
+                    (counts is None or counts[cat])]
+
+            # a single query for all the installed apps, each of them goes
+            # into the first of its categories instead of running a query
+            # for every category
+            enq.set_query(channel_query,
+                          sortmode=SortMethods.BY_ALPHABET,
+                          nonapps_visible=self.nonapps_visible,
+                          filter=xfilter,
+                          nonblocking_load=False)
+            cat_docs = dict((cat, []) for cat in cats)
+            for doc in enq.get_documents():
+                doc_cats = self.db.get_categories_for_docid(
+                    doc.get_docid(), cats)
+                if doc_cats:
+                    cat_docs[doc_cats[0]].append(doc)
+            for cat in cats:
+                docs = cat_docs[cat]
+                if docs:
+                    i += len(docs)
                     self.cat_docid_map[cat.untranslated_name] = \
                                         set([doc.get_docid() for doc in docs])
                     model.set_category_documents(cat, docs)
+            categorised_docids = set()
+            for docids in self.cat_docid_map.values():
+                categorised_docids.update(docids)
 
             while Gtk.events_pending():
                 Gtk.main_iteration()
 
             # check for uncategorised pkgs
             if self.state.channel:
-                self._run_channel_enquirer(persistent_duplicate_filter=(i > 0))
-                L = len(enq.matches)
+                self._run_channel_enquirer(persistent_duplicate_filter=False)
+                docs = [doc for doc in enq.get_documents()
+                        if doc.get_docid() not in categorised_docids]
+                L = len(docs)
                 if L:
                     # some foo for channels
                     # if no categorised results but in channel, then use
@@ -422,7 +448,6 @@ class InstalledPane(SoftwarePane, CategoriesParser):
                     channel_name = None
                     if not i and self.state.channel:
                         channel_name = self.state.channel.display_name
-                    docs = enq.get_documents()
                     tag = channel_name or 'Uncategorized'
                     self.cat_docid_map[tag] = set(
                         [doc.get_docid() for doc in docs])
@@ -489,36 +514,34 @@ class InstalledPane(SoftwarePane, CategoriesParser):
             self.searchentry.hide()
 
             self.cat_docid_map = {}
-            enq = self.enquirer
             query = xapian.Query("")
             if self.state.channel and self.state.channel.query:
                 query = xapian.Query(xapian.Query.OP_AND,
                                      query,
                                      self.state.channel.query)
 
-            i = 0
-
-            # First search: missing apps only
+            # First search: missing apps only, we don't block the
+            # searches for better oneconf responsiveness
             xfilter = AppFilter(self.db, self.cache)
             xfilter.set_restricted_list(self.oneconf_additional_pkg)
             xfilter.set_not_installed_only(True)
 
-            enq.set_query(query,
-                          sortmode=SortMethods.BY_ALPHABET,
-                          nonapps_visible=self.nonapps_visible,
-                          filter=xfilter,
-                          nonblocking_load=True,  # we don't block this one for
-                                                # better oneconf responsiveness
-                          persistent_duplicate_filter=(i > 0))
+            self._set_query_then(
+                lambda enq: on_missing_apps_complete(enq, query, xfilter),
+                query,
+                sortmode=SortMethods.BY_ALPHABET,
+                nonapps_visible=self.nonapps_visible,
+                filter=xfilter,
+                nonblocking_load=True)
 
-            L = len(enq.matches)
+        def on_missing_apps_complete(enq, query, xfilter):
+            i = L = len(enq.matches)
 
             if L:
                 cat_title = utf8(ngettext(
                     u'%(amount)s item on “%(machine)s” not on this computer',
                     u'%(amount)s items on “%(machine)s” not on this computer',
                     L)) % {'amount': L, 'machine': utf8(self.current_hostname)}
-                i += L
                 docs = enq.get_documents()
                 self.cat_docid_map["missingpkg"] = set(
                     [doc.get_docid() for doc in docs])
@@ -529,13 +552,16 @@ class InstalledPane(SoftwarePane, CategoriesParser):
             xfilter.set_restricted_list(self.oneconf_missing_pkg)
             xfilter.set_not_installed_only(False)
             xfilter.set_installed_only(True)
-            enq.set_query(query,
-                          sortmode=SortMethods.BY_ALPHABET,
-                          nonapps_visible=self.nonapps_visible,
-                          filter=xfilter,
-                          nonblocking_load=False,
-                          persistent_duplicate_filter=(i > 0))
+            self._set_query_then(
+                lambda enq: on_additional_apps_complete(enq, i),
+                query,
+                sortmode=SortMethods.BY_ALPHABET,
+                nonapps_visible=self.nonapps_visible,
+                filter=xfilter,
+                nonblocking_load=True,
+                persistent_duplicate_filter=(i > 0))
 
+        def on_additional_apps_complete(enq, i):
             L = len(enq.matches)
             if L:
                 cat_title = utf8(ngettext(
@@ -571,10 +597,28 @@ class InstalledPane(SoftwarePane, CategoriesParser):
                 window.set_cursor(None)
 
             self.emit("app-list-changed", i)
-            return
 
         GObject.idle_add(profiled_rebuild_oneconfview)
 
+    def _set_query_then(self, callback, *args, **kwargs):
+        """ set the query of the enquirer and call callback(enquirer)
+            once its matches are set, the views are built from the
+            matches of nonblocking queries that way
+        """
+        # a query that is set now supersedes the pending one
+        self._query_complete_callback = callback
+        self.enquirer.set_query(*args, **kwargs)
+        if not self.enquirer.nonblocking_load:
+            self._query_complete_callback = None
+            callback(self.enquirer)
+
+    def on_query_complete(self, enquirer):
+        SoftwarePane.on_query_complete(self, enquirer)
+        callback = self._query_complete_callback
+        self._query_complete_callback = None
+        if callback:
+            callback(enquirer)
+
     def _check_expand(self):
         it = self.treefilter.get_iter_first()
         while it:
@@ -590,12 +634,14 @@ class InstalledPane(SoftwarePane, CategoriesParser):
         self.state.search_term = terms
         xfilter = AppFilter(self.db, self.cache)
         xfilter.set_installed_only(True)
-        self.enquirer.set_query(self.get_query(),
-                                nonapps_visible=self.nonapps_visible,
-                                filter=xfilter,
-                                nonblocking_load=True)
-
-        self.visible_docids = self.enquirer.get_docids()
+        self._set_query_then(self._on_search_complete,
+                             self.get_query(),
+                             nonapps_visible=self.nonapps_visible,
+                             filter=xfilter,
+                             nonblocking_load=True)
+
+    def _on_search_complete(self, enquirer):
+        self.visible_docids = enquirer.get_docids()
         self.visible_cats = self._get_vis_cats(self.visible_docids)
         self.treefilter.refilter()
         self.app_view.tree_view.expand_all()
@@ -604,6 +650,8 @@ class InstalledPane(SoftwarePane, CategoriesParser):
         xfilter = AppFilter(self.db, self.cache)
         xfilter.set_installed_only(True)
         if self.state.channel:
+            # the blocking query supersedes a pending one
+            self._query_complete_callback = None
             self.enquirer.set_query(
                 self.state.channel.query,
                 sortmode=SortMethods.BY_ALPHABET,
@@ -627,10 +675,17 @@ class InstalledPane(SoftwarePane, CategoriesParser):
         elif self.state.search_term != terms:
             self._do_search(terms)
 
+    def get_query_class(self):
+        # the categories, channels and searches of the installed software
+        # are all filtered by the installed state
+        return "installed"
+
     def get_query(self):
         # search terms
         return self.db.get_query_list_from_search_entry(
-                                        self.state.search_term)
+                                        self.state.search_term,
+                                        session=self.search_session,
+                                        query_class=self.get_query_class())
 
     def get_query_for_cat(self, cat):
         LOG.debug("self.state.channel: %s" % self.state.channel)
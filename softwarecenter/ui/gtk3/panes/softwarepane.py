@@ -26,7 +26,7 @@ import os
 import xapian
 
 from softwarecenter.backend import get_install_backend
-from softwarecenter.db.database import Application
+from softwarecenter.db.database import Application, SearchSession
 from softwarecenter.db.enquire import AppEnquire
 from softwarecenter.enums import (SortMethods,
                                   DEFAULT_SEARCH_LIMIT,
@@ -157,6 +157,8 @@ class SoftwarePane(Gtk.VBox, BasePane):
 
         self.cache = cache
         self.db = db
+        # reuses the expansion of the search term while typing
+        self.search_session = SearchSession(db)
         self.distro = distro
         self.icons = icons
         self.datadir = datadir
@@ -297,6 +299,16 @@ class SoftwarePane(Gtk.VBox, BasePane):
         return (self.state.search_term and
                 len(self.state.search_term) >= 2)
 
+    def get_query_class(self):
+        """ return the class of the current query for the query profiler
+            of the db
+        """
+        if self._is_in_search_mode():
+            return "search"
+        if self.state.channel:
+            return "channel"
+        return "category"
+
     def show_appview_spinner(self):
         """ display the spinner in the appview panel """
         LOG.debug("show_appview_spinner")
@@ -389,7 +401,9 @@ class SoftwarePane(Gtk.VBox, BasePane):
         # search terms
         if self.apps_search_term:
             query = self.db.get_query_list_from_search_entry(
-                self.apps_search_term, channel_query)
+                self.apps_search_term, channel_query,
+                session=self.search_session,
+                query_class=self.get_query_class())
 
             return query
         # overview list
@@ -419,6 +433,7 @@ class SoftwarePane(Gtk.VBox, BasePane):
         """ do a blocking query that only returns the amount of
             matches from this query
         """
+        self.enquirer.query_class = self.get_query_class()
         with ExecutionTime("enquirer.set_query() quick query"):
             self.enquirer.set_query(
                                 query,
@@ -435,6 +450,7 @@ class SoftwarePane(Gtk.VBox, BasePane):
         self.app_view.configure_sort_method(self._is_in_search_mode())
 
         # a nonblocking query calls on_query_complete once finished
+        self.enquirer.query_class = self.get_query_class()
         with ExecutionTime("enquirer.set_query()"):
             self.enquirer.set_query(
                                 query,
@@ -305,9 +305,11 @@ def on_entry_changed(widget, data):
 
         with ExecutionTime("total time"):
             with ExecutionTime("enquire.set_query()"):
-                enquirer.set_query(get_query_from_search_entry(new_text),
+                enquirer.set_query(
+                    get_query_from_search_entry(new_text),
                     limit=100 * 1000,
-                    nonapps_visible=NonAppVisibility.ALWAYS_VISIBLE)
+                    nonapps_visible=NonAppVisibility.ALWAYS_VISIBLE,
+                    nonblocking_load=False)
 
             store = view.tree_view.get_model()
             with ExecutionTime("store.clear()"):
@@ -470,15 +470,14 @@ class LobbyViewGtk(CategoriesViewGtk):
                                     True, True, 0)
 
     def _update_appcount(self):
-        enq = AppEnquire(self.cache, self.db)
-
         distro = get_distro()
         if get_global_filter().supported_only:
             query = distro.get_supported_query()
         else:
-            query = xapian.Query('')
+            query = None
 
-        length = enq.get_estimated_matches_count(query)
+        # counted with the departments in a single match
+        length = self.db.get_category_counts(self.categories, query)[None]
         text = gettext.ngettext("%(amount)s item", "%(amount)s items", length
                                 ) % {'amount': length}
         self.appcount.set_text(text)
@@ -605,25 +604,26 @@ class SubCategoryViewGtk(CategoriesViewGtk):
 
         # sort Category.name's alphabetically
         sorted_cats = categories_sorted_by_name(self.categories)
-        enquire = xapian.Enquire(self.db.xapiandb)
-        app_filter = AppFilter(self.db, self.cache)
+        counts = self.db.get_category_counts(self.categories)
         for cat in sorted_cats:
             # add the subcategory if and only if it is non-empty
-            enquire.set_query(cat.query)
-
-            if len(enquire.get_mset(0, 1)):
+            if counts[cat]:
                 tile = CategoryTile(cat.name, cat.iconname)
                 tile.connect('clicked', self.on_category_clicked, cat)
                 self.departments.add_child(tile)
 
         # partialy work around a (quite rare) corner case
         if num_items == 0:
-            enquire.set_query(xapian.Query(xapian.Query.OP_AND,
-                                category.query,
-                                xapian.Query("ATapplication")))
+            query = xapian.Query(xapian.Query.OP_AND,
+                                 category.query,
+                                 xapian.Query("ATapplication"))
             # assuming that we only want apps is not always correct ^^^
-            tmp_matches = enquire.get_mset(0, len(self.db), None, app_filter)
-            num_items = tmp_matches.get_matches_estimated()
+            app_filter = AppFilter(self.db, self.cache)
+            filtered_query = app_filter.filter_query(query)
+            if filtered_query is None:
+                num_items = self.db.get_matches_count(query, app_filter)
+            else:
+                num_items = self.db.get_matches_count(filtered_query)
 
         # append an additional button to show all of the items in the category
         all_cat = Category("All", _("All"), "category-show-all",
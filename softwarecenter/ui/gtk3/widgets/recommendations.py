@@ -100,7 +100,8 @@ class RecommendationsPanelCategory(RecommendationsPanel):
         self.spinner_notebook.show_spinner(_(u"Receiving recommendations…"))
         # get the recommendations from the recommender agent
         self.recommended_for_you_cat = RecommendedForYouCategory(
-                                            subcategory=self.subcategory)
+                                            subcategory=self.subcategory,
+                                            db=self.catview.db)
         self.recommended_for_you_cat.connect(
                                     'needs-refresh',
                                     self._on_recommended_for_you_agent_refresh)
@@ -171,7 +171,8 @@ class SearchAidLogic(object):
         enq = self.enquirer
         query = self.db.get_query_list_from_search_entry(
                                     term,
-                                    category.query)
+                                    category.query,
+                                    query_class=self.pane.get_query_class())
 
         enq.set_query(query,
                       limit=state.limit,
@@ -27,7 +27,7 @@ class TestAppstore(unittest.TestCase):
     def test_app_store(self):
         # get a enquire object
         enquirer = AppEnquire(self.cache, self.db)
-        enquirer.set_query(xapian.Query(""))
+        enquirer.set_query(xapian.Query(""), nonblocking_load=False)
 
         # get a AppListStore and run functions on it
         model = AppListStore(self.db, self.cache, self.icons)
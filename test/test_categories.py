@@ -48,11 +48,96 @@ class TestCategories(unittest.TestCase):
         recommendations_in_cat = recommends_cat.get_documents(self.db)
         print recommendations_in_cat
         self.assertNotEqual(recommendations_in_cat, [])
+        # with the db the recommendations are looked up in the members
+        # of the category
+        recommends_cat = RecommendedForYouCategory(cats[2], db=self.db)
+        recommends_cat._recommend_me_result(
+                                None,
+                                make_recommender_agent_recommend_me_dict())
+        self.assertEqual(
+            [doc.get_docid()
+             for doc in recommends_cat.get_documents(self.db)],
+            [doc.get_docid() for doc in recommendations_in_cat])
 
     def test_get_query(self):
         query = get_query_for_category(self.db, "Education")
         self.assertNotEqual(query, None)
 
+    def test_get_category_counts(self):
+        parser = CategoriesParser(self.db)
+        cats = parser.parse_applications_menu("./data")
+        counts = self.db.get_category_counts(cats)
+        all_cats = list(cats)
+        for cat in cats:
+            all_cats.extend(cat.subcategories)
+        self.assertTrue(set(all_cats).issubset(counts))
+        self.assertEqual(counts[None], self.db.xapiandb.get_doccount())
+        for cat in all_cats:
+            enquire = xapian.Enquire(self.db.xapiandb)
+            enquire.set_query(cat.query)
+            self.assertEqual(
+                counts[cat],
+                len(enquire.get_mset(0, self.db.xapiandb.get_doccount())))
+        # the counts can be restricted to a query
+        query = xapian.Query("ATapplication")
+        counts = self.db.get_category_counts(cats, query)
+        self.assertEqual(counts[None], self.db.get_matches_count(query))
+        for cat in cats:
+            enquire = xapian.Enquire(self.db.xapiandb)
+            enquire.set_query(xapian.Query(xapian.Query.OP_AND,
+                                           cat.query, query))
+            self.assertEqual(
+                counts[cat],
+                len(enquire.get_mset(0, self.db.xapiandb.get_doccount())))
+        # the counts are kept until the database gets reopened
+        with patch.object(self.db, "_count_categories") as count:
+            self.db.get_category_counts(cats)
+            self.assertFalse(count.called)
+        self.db.reopen()
+        with patch.object(self.db, "_count_categories",
+                          wraps=self.db._count_categories) as count:
+            self.db.get_category_counts(cats)
+            # all the categories of the menu fit into a single match
+            self.assertEqual(count.call_count, 1)
+
+    def test_pkg_in_category(self):
+        parser = CategoriesParser(self.db)
+        cats = parser.parse_applications_menu("./data")
+        for pkgname in ["software-center", "apt", "gimp", "no-such-pkg"]:
+            in_cats = self.db.get_categories_for_pkgname(pkgname, cats)
+            for cat in cats:
+                query = xapian.Query(xapian.Query.OP_AND, cat.query,
+                    xapian.Query(xapian.Query.OP_OR,
+                                 xapian.Query("AP" + pkgname),
+                                 xapian.Query("XP" + pkgname)))
+                enquire = xapian.Enquire(self.db.xapiandb)
+                enquire.set_query(query)
+                expected = bool(enquire.get_mset(0, len(self.db)))
+                self.assertEqual(
+                    self.db.pkg_in_category(pkgname, cat.query), expected)
+                self.assertEqual(cat in in_cats, expected)
+        # the same for single documents
+        for docid in [p.docid for p in self.db.xapiandb.postlist("")]:
+            in_cats = self.db.get_categories_for_docid(docid, cats)
+            for cat in cats:
+                enquire = xapian.Enquire(self.db.xapiandb)
+                enquire.set_query(cat.query)
+                expected = docid in [m.docid for m in enquire.get_mset(
+                            0, len(self.db))]
+                self.assertEqual(cat in in_cats, expected)
+        # single terms are just their posting lists
+        for query in [xapian.Query(""), xapian.Query("ATapplication")]:
+            enquire = xapian.Enquire(self.db.xapiandb)
+            enquire.set_query(query)
+            self.assertEqual(
+                self.db._get_category_members(query),
+                set([m.docid for m in enquire.get_mset(0, len(self.db))]))
+        # the members of the categories are kept until the database
+        # gets reopened
+        self.assertNotEqual(self.db._category_members, {})
+        self.db.reopen()
+        self.assertEqual(self.db._category_members, {})
+
 class TestCatParsing(unittest.TestCase):
     """ tests the "where is it in the menu" code """
 
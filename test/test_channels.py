@@ -1,10 +1,13 @@
 #!/usr/bin/python
 
 import unittest
+import xapian
+
+from mock import patch
 
 from testutils import setup_test_env
 setup_test_env()
-from softwarecenter.testutils import get_test_db
+from softwarecenter.testutils import get_test_db, get_test_pkg_info
 
 class TestChannels(unittest.TestCase):
     """ tests the channels backend stuff """
@@ -27,7 +30,69 @@ class TestChannels(unittest.TestCase):
         self.assertNotEqual(channels, [])
         channels_installed = m.channels_installed_only
         self.assertNotEqual(channels_installed, [])
-        
+
+    def test_channel_catalogue(self):
+        from softwarecenter.backend.channel import ChannelsManager
+        from softwarecenter.db.database import StoreDatabase
+        from softwarecenter.db.update import (set_channel_catalogue,
+                                              update_from_app_install_data)
+        cache = get_test_pkg_info()
+        xdb = xapian.WritableDatabase("./data/test.db",
+                                      xapian.DB_CREATE_OR_OVERWRITE)
+        update_from_app_install_data(xdb, cache, datadir="./data/desktop")
+        set_channel_catalogue(xdb, cache)
+        xdb.flush()
+        db = StoreDatabase("./data/test.db", cache)
+        db.open(use_axi=True, use_agent=False)
+        catalogue = db.get_channel_catalogue()
+        self.assertEqual(catalogue, sorted(cache.get_all_channels()))
+        # the channels come from the catalogue and not from the terms
+        m = ChannelsManager(db)
+        labels = set([label for (label, origin, component, nr_pkgs,
+                                 nr_installed) in catalogue])
+        for channel in m._get_channels_from_db(installed_only=False):
+            self.assertTrue(channel.name in labels)
+        # a catalogue of a different apt-xapian-index is not used
+        with patch("softwarecenter.db.database.get_axi_stamp") as stamp:
+            stamp.return_value = -1
+            self.assertEqual(db.get_channel_catalogue(), None)
+        # and neither is one from before the origin plugin reindexed
+        with patch("softwarecenter.db.database.get_channels_stamp") as stamp:
+            stamp.return_value = -1
+            self.assertEqual(db.get_channel_catalogue(), None)
+
+    def test_channel_catalogue_origins(self):
+        from softwarecenter.backend.channel import ChannelsManager
+        db = get_test_db()
+        m = ChannelsManager(db)
+        catalogue = [("Ubuntu", "Ubuntu", "main", 100, 10),
+                     ("Ubuntu", "Ubuntu-mirror", "main", 300, 0),
+                     ("PPA for foo", "LP-PPA-foo", "main", 5, 0),
+                     ("notdownloadable", "", "", 3, 3),
+                     ]
+        with patch.object(db, "get_channel_catalogue") as get_catalogue:
+            get_catalogue.return_value = catalogue
+            # the origin with the most packages names the channel
+            self.assertEqual(m._get_channel_names_and_origins(),
+                             [("PPA for foo", "LP-PPA-foo"),
+                              ("Ubuntu", "Ubuntu-mirror"),
+                              ("notdownloadable", "")])
+            # the channels without installed packages are left out
+            self.assertEqual(
+                m._get_channel_names_and_origins(installed_only=True),
+                [("Ubuntu", "Ubuntu-mirror"),
+                 ("notdownloadable", "")])
+
+    def test_origin_plugin_channels_stamp(self):
+        import imp
+        from softwarecenter.paths import APT_XAPIAN_INDEX_CHANNELS_STAMP_PATH
+        # the plugin does not import softwarecenter, its copy of the path
+        # must match
+        plugin = imp.load_source("origin",
+                                 "../apt-xapian-index-plugin/origin.py")
+        self.assertEqual(plugin.APT_XAPIAN_INDEX_CHANNELS_STAMP_PATH,
+                         APT_XAPIAN_INDEX_CHANNELS_STAMP_PATH)
+
 
 if __name__ == "__main__":
     import logging
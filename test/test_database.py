@@ -3,6 +3,7 @@
 import apt
 import os
 import re
+import shutil
 import tempfile
 import time
 import unittest
@@ -83,6 +84,94 @@ class TestDatabase(unittest.TestCase):
             i+=1
         self.assertEqual(i, 1)
 
+    def test_appname_sort_key(self):
+        from softwarecenter.db.database import (
+            get_sort_key_locale, make_sort_key)
+        db = xapian.WritableDatabase("./data/test.db",
+                                     xapian.DB_CREATE_OR_OVERWRITE)
+        res = update_from_app_install_data(db, self.cache,
+                                           datadir="./data/desktop")
+        self.assertTrue(res)
+        for m in db.postlist(""):
+            doc = db.get_document(m.docid)
+            self.assertEqual(doc.get_value(XapianValues.APPNAME_SORT_KEY),
+                             make_sort_key(doc.get_data()))
+        db.set_metadata("sort-key-locale", get_sort_key_locale())
+        db.flush()
+        store = StoreDatabase("./data/test.db", self.cache)
+        store.open(use_axi=False, use_agent=False)
+        self.assertTrue(store.has_sort_keys())
+
+    def test_matches_count(self):
+        db = xapian.WritableDatabase("./data/test.db",
+                                     xapian.DB_CREATE_OR_OVERWRITE)
+        res = update_from_app_install_data(db, self.cache,
+                                           datadir="./data/desktop")
+        self.assertTrue(res)
+        db.flush()
+        store = StoreDatabase("./data/test.db", self.cache)
+        store.open(use_axi=False, use_agent=False)
+        self.assertEqual(store.get_matches_count(xapian.Query("")),
+                         len(store))
+        query = xapian.Query("ATapplication")
+        nr_apps = len(store.get_matches_from_query(query))
+        self.assertEqual(store.get_matches_count(query), nr_apps)
+        query = xapian.Query(xapian.Query.OP_AND_NOT,
+                             xapian.Query(""), xapian.Query("ATapplication"))
+        nr_pkgs = len(store.get_matches_from_query(query))
+        self.assertEqual(store.get_matches_count(query), nr_pkgs)
+        self.assertEqual(store.get_matches_count(query, exact=False,
+                                                 check_at_least=len(store)),
+                         nr_pkgs)
+
+    def test_locale_key_table(self):
+        from softwarecenter.db.update import get_locale_key_table
+        self.addCleanup(self._restore_language, os.environ.get("LANGUAGE"))
+        os.environ["LANGUAGE"] = "de"
+        table = get_locale_key_table()
+        self.assertEqual(table.get_keys("Name", "%s[%s]"),
+                         ("Name[de_DE]", "Name[de]", "Name"))
+        self.assertEqual(table.get_keys("Name", "%s-%s", lower=True),
+                         ("name-de_de", "name-de", "name"))
+        # the table is computed once per locale environment
+        self.assertTrue(get_locale_key_table() is table)
+        os.environ["LANGUAGE"] = "fr"
+        self.assertFalse(get_locale_key_table() is table)
+
+    def _restore_language(self, language):
+        if language is None:
+            os.environ.pop("LANGUAGE", None)
+        else:
+            os.environ["LANGUAGE"] = language
+
+    def test_desktop_config_parser_missing_key(self):
+        from ConfigParser import NoOptionError
+        from softwarecenter.db.update import DesktopConfigParser
+        desktopf = tempfile.NamedTemporaryFile(suffix=".desktop")
+        desktopf.write("[Desktop Entry]\nName[de]=Nur Deutsch\n")
+        desktopf.flush()
+        parser = DesktopConfigParser()
+        parser.read(desktopf.name)
+        # a translation alone does not make up for the missing field
+        self.assertRaises(NoOptionError, parser.get_desktop, "Name")
+        self.assertRaises(NoOptionError, parser.get_desktop, "Comment")
+
+    def test_update_headless(self):
+        from softwarecenter.db.update import RateLimitedProgress
+        reports = []
+        progress = RateLimitedProgress(
+            callback=lambda nr_items, item: reports.append(nr_items),
+            interval=3600)
+        db = xapian.WritableDatabase("./data/test.db",
+                                     xapian.DB_CREATE_OR_OVERWRITE)
+        res = update_from_app_install_data(db, self.cache, "./data/desktop",
+                                           progress=progress)
+        self.assertTrue(res)
+        self.assertEqual(db.get_doccount(), 5)
+        self.assertEqual(progress.nr_items, 5)
+        # only the first item is reported within the interval
+        self.assertEqual(reports, [1])
+
     def test_update_from_appstream_xml(self):
         db = xapian.WritableDatabase("./data/test.db",
                                      xapian.DB_CREATE_OR_OVERWRITE)
@@ -97,6 +186,24 @@ class TestDatabase(unittest.TestCase):
             for value in doc.values():
                 print value, value.num, value.value
 
+    def test_iterparse_appstream_applications(self):
+        from softwarecenter.db.update import iterparse_appstream_applications
+        ids = [appinfo.find("id").text for appinfo in
+               iterparse_appstream_applications("./data/app-info/appdata.xml")]
+        self.assertEqual(ids, ["firefox.desktop"])
+
+    def test_update_from_empty_appstream_file(self):
+        from softwarecenter.db.update import update_from_single_appstream_file
+        db = xapian.WritableDatabase("./data/test.db",
+                                     xapian.DB_CREATE_OR_OVERWRITE)
+        for data in ["", '<?xml version="1.0"?>\n']:
+            (fd, path) = tempfile.mkstemp(suffix=".xml")
+            os.write(fd, data)
+            os.close(fd)
+            update_from_single_appstream_file(db, self.cache, path)
+            os.remove(path)
+        self.assertEqual(db.get_doccount(), 0)
+
     def test_update_from_var_lib_apt_lists(self):
         # ensure we index with german locales to test i18n
         os.environ["LANGUAGE"] = "de"
@@ -122,6 +229,147 @@ class TestDatabase(unittest.TestCase):
                     break
         self.assertTrue(found_gettext_translation)
 
+    def test_update_parallel(self):
+        from softwarecenter.db.update import (
+            get_index_sources, update_parallel)
+        db = xapian.WritableDatabase("./data/test.db",
+                                     xapian.DB_CREATE_OR_OVERWRITE)
+        sources = get_index_sources(datadir="./data/desktop",
+                                    listsdir="./data/app-info/")
+        self.assertEqual(len(sources), 6)
+        update_parallel(db, self.cache, sources, "./data/test.db", jobs=2)
+        # the documents of both shards got merged
+        self.assertEqual(db.get_doccount(), 6)
+        self.assertFalse(os.path.exists("./data/test.db_shard0"))
+        self.assertFalse(os.path.exists("./data/test.db_shard1"))
+
+    def test_index_sources_serial_and_parallel(self):
+        from softwarecenter.db.update import (
+            get_index_sources, index_sources)
+        sources = get_index_sources(appstream_sources=True,
+                                    datadir="./data/desktop",
+                                    listsdir="./data/app-info/",
+                                    xmldir="./data/app-info/")
+        serial_db = xapian.WritableDatabase("./data/test.db",
+                                            xapian.DB_CREATE_OR_OVERWRITE)
+        index_sources(serial_db, self.cache, sources, "./data/test.db",
+                      jobs=1)
+        parallel_path = tempfile.mkdtemp()
+        parallel_db = xapian.WritableDatabase(parallel_path,
+                                              xapian.DB_CREATE_OR_OVERWRITE)
+        index_sources(parallel_db, self.cache, sources, parallel_path,
+                      jobs=2)
+        # both ways produce the same documents and metadata
+        self.assertEqual(serial_db.get_doccount(),
+                         parallel_db.get_doccount())
+        for key in serial_db.metadata_keys():
+            self.assertEqual(serial_db.get_metadata(key),
+                             parallel_db.get_metadata(key))
+        self.assertTrue(xapian.sortable_unserialise(
+                serial_db.get_metadata("popcon_max_desktop")) > 0)
+        shutil.rmtree(parallel_path)
+
+    def test_update_incremental(self):
+        from softwarecenter.db.update import (
+            get_index_sources, update_incremental)
+        datadir = tempfile.mkdtemp()
+        for desktopf in ("pay-app.desktop", "zynjacku.desktop"):
+            shutil.copy(os.path.join("./data/desktop", desktopf), datadir)
+        db = xapian.WritableDatabase("./data/test.db",
+                                     xapian.DB_CREATE_OR_OVERWRITE)
+        sources = get_index_sources(datadir=datadir, listsdir=datadir)
+        # the first run indexes everything
+        self.assertEqual(update_incremental(db, self.cache, sources), 2)
+        self.assertEqual(db.get_doccount(), 2)
+        # nothing changed
+        self.assertEqual(update_incremental(db, self.cache, sources), 0)
+        self.assertEqual(db.get_doccount(), 2)
+        # a changed source replaces its document
+        desktopf = os.path.join(datadir, "zynjacku.desktop")
+        with open(desktopf, "a") as f:
+            f.write("Keywords=incrementaltest;\n")
+        self.assertEqual(update_incremental(db, self.cache, sources), 1)
+        self.assertEqual(db.get_doccount(), 2)
+        self.assertEqual(len(list(db.postlist("incrementaltest"))), 1)
+        # sources of kinds that were not scanned are kept
+        self.assertEqual(update_incremental(db, self.cache, [],
+                                            kinds=set(["appstream"])), 0)
+        self.assertEqual(db.get_doccount(), 2)
+        # a removed source deletes its document
+        os.remove(desktopf)
+        sources = get_index_sources(datadir=datadir, listsdir=datadir)
+        self.assertEqual(update_incremental(db, self.cache, sources), 1)
+        self.assertEqual(db.get_doccount(), 1)
+        shutil.rmtree(datadir)
+
+    def test_rebuild_database_sources(self):
+        from softwarecenter.db.update import (
+            RateLimitedProgress, rebuild_database)
+        tmpdir = tempfile.mkdtemp()
+        pathname = os.path.join(tmpdir, "xapian")
+        progress = RateLimitedProgress(callback=lambda nr_items, item: None)
+        self.assertTrue(rebuild_database(
+                pathname, progress=progress, cache=self.cache,
+                datadir="./data/desktop", listsdir=tmpdir))
+        db = xapian.Database(pathname)
+        self.assertEqual(db.get_doccount(), 5)
+        self.assertTrue(db.get_metadata("mimetype-table"))
+        self.assertTrue(db.get_metadata("apt-lists-stamp"))
+        shutil.rmtree(tmpdir)
+
+    def test_update_popcon_max_and_apt_lists_stamp(self):
+        from softwarecenter.db.update import (
+            get_apt_lists_stamp, get_index_sources, get_popcon_max,
+            update_incremental)
+        datadir = tempfile.mkdtemp()
+        for desktopf in ("pay-app.desktop", "zynjacku.desktop"):
+            shutil.copy(os.path.join("./data/desktop", desktopf), datadir)
+        db = xapian.WritableDatabase("./data/test.db",
+                                     xapian.DB_CREATE_OR_OVERWRITE)
+        self.assertEqual(get_popcon_max(db), 0)
+        sources = get_index_sources(datadir=datadir, listsdir=datadir)
+        update_incremental(db, self.cache, sources)
+        popcon_max = get_popcon_max(db)
+        self.assertTrue(popcon_max > 0)
+        # removing the most popular document lowers popcon_max again
+        for desktopf in os.listdir(datadir):
+            os.remove(os.path.join(datadir, desktopf))
+        update_incremental(db, self.cache, [])
+        self.assertEqual(get_popcon_max(db), 0)
+        # new package lists change the stamp
+        stamp = get_apt_lists_stamp(datadir)
+        self.assertTrue(stamp)
+        time.sleep(1)
+        open(os.path.join(datadir, "new_Packages"), "w").close()
+        self.assertNotEqual(get_apt_lists_stamp(datadir), stamp)
+        shutil.rmtree(datadir)
+        self.assertEqual(get_apt_lists_stamp(datadir), "")
+
+    def test_batched_writable_database(self):
+        from softwarecenter.db.update import BatchedWritableDatabase
+        db = BatchedWritableDatabase("./data/test.db",
+                                     xapian.DB_CREATE_OR_OVERWRITE,
+                                     max_docs=2, max_memory=0)
+        res = update_from_app_install_data(db, self.cache,
+                                           datadir="./data/desktop")
+        self.assertTrue(res)
+        db.flush()
+        self.assertEqual(db.get_doccount(), 5)
+        # two full batches and the rest committed by the flush
+        self.assertEqual([nr_docs for (nr_docs, seconds)
+                          in db.commit_timings], [2, 2, 1])
+        self.assertEqual(xapian.Database("./data/test.db").get_doccount(), 5)
+
+    def test_package_metadata_snapshot(self):
+        from softwarecenter.db.update import PackageMetadataSnapshot
+        snapshot = PackageMetadataSnapshot(self.cache)
+        record = snapshot.get("apt")
+        self.assertEqual(record.summary, self.cache["apt"].candidate.summary)
+        self.assertEqual(record.section, self.cache["apt"].section)
+        # the record is only read once
+        self.assertTrue(snapshot.get("apt") is record)
+        self.assertEqual(snapshot.get("no-such-package-xxx"), None)
+
     def test_update_from_json_string(self):
         from softwarecenter.db.update import update_from_json_string
         db = xapian.WritableDatabase("./data/test.db",
@@ -160,6 +408,57 @@ class TestDatabase(unittest.TestCase):
                 self.assertTrue(url.startswith("http") or
                                 url.startswith("mailto:"))
 
+    def test_update_from_sca_entries(self):
+        from softwarecenter.db.update import (
+            get_sca_fingerprint, sca_entries_changed, update_from_sca_entries)
+        distro = get_distro()
+        def make_entries(*names):
+            entries = []
+            for name in names:
+                app = make_software_center_agent_app_dict()
+                app["name"] = name
+                app["package_name"] = name.lower()
+                app["series"] = {
+                    distro.get_codename(): [distro.get_architecture()]}
+                entries.append(PistonResponseObject.from_dict(app))
+            return entries
+        db = xapian.WritableDatabase("./data/test.db",
+                                     xapian.DB_CREATE_OR_OVERWRITE)
+        entries = make_entries("Photobomb", "Tinybomb")
+        self.assertEqual(
+            update_from_sca_entries(db, self.cache, entries), 2)
+        self.assertEqual(db.get_doccount(), 2)
+        # nested objects of the entries do not change the fingerprint
+        self.assertEqual(
+            get_sca_fingerprint(PistonResponseObject.from_dict(
+                    {"name": "Photobomb",
+                     "screenshot": PistonResponseObject.from_dict(
+                            {"url": "http://example.com/shot.png"})})),
+            get_sca_fingerprint(PistonResponseObject.from_dict(
+                    {"name": "Photobomb",
+                     "screenshot": PistonResponseObject.from_dict(
+                            {"url": "http://example.com/shot.png"})})))
+        # nothing changed, nothing gets indexed
+        self.assertFalse(sca_entries_changed(
+            db, make_entries("Photobomb", "Tinybomb")))
+        self.assertEqual(update_from_sca_entries(
+            db, self.cache, make_entries("Photobomb", "Tinybomb")), 0)
+        # a changed entry is reindexed, a removed one deleted
+        entries = make_entries("Photobomb", "Megabomb")
+        entries[0].license = "GPL"
+        self.assertTrue(sca_entries_changed(db, entries))
+        self.assertEqual(
+            update_from_sca_entries(db, self.cache, entries), 3)
+        self.assertEqual(db.get_doccount(), 2)
+        self.assertEqual(len(list(db.postlist("APtinybomb"))), 0)
+        self.assertEqual(len(list(db.postlist("APmegabomb"))), 1)
+        # entries are not removed without good data from the agent
+        self.assertTrue(sca_entries_changed(db, []))
+        self.assertFalse(sca_entries_changed(db, [], remove_missing=False))
+        self.assertEqual(update_from_sca_entries(
+            db, self.cache, [], remove_missing=False), 0)
+        self.assertEqual(db.get_doccount(), 2)
+
     def test_license_string_data_from_software_center_agent(self):
         #os.environ["SOFTWARE_CENTER_DEBUG_HTTP"] = "1"
         #os.environ["SOFTWARE_CENTER_AGENT_HOST"] = "http://sc.staging.ubuntu.com/"
@@ -428,7 +727,120 @@ app-popcon	4	# app-install .desktop popcon rank
                            nonblocking_load=False)
         self.assertTrue(len(enquirer.get_docids()) > 0)
         # FIXME: test more of the interface
-        
+
+    def test_search_session(self):
+        from softwarecenter.db.database import SearchSession
+        db = get_test_db()
+        session = SearchSession(db)
+        def _docids(query_list):
+            docids = set()
+            for query in query_list:
+                docids.update([m.docid for m in db.get_matches_from_query(
+                            query)])
+            return docids
+        for search_term in ["so", "sof", "soft", "software", "software c",
+                            "software ce", "pkg:software-center"]:
+            self.assertEqual(
+                _docids(db.get_query_list_from_search_entry(
+                        search_term, session=session)),
+                _docids(db.get_query_list_from_search_entry(search_term)))
+        # extending the word narrows the cached terms
+        session.get_partial_terms("sof")
+        self.assertTrue(session.get_partial_terms("soft"))
+        self.assertTrue(all([term.startswith("soft")
+                             for term in session.get_partial_terms("soft")]))
+        session.reset()
+        self.assertEqual(session._partial_word, None)
+
+    def test_docid_lookup_index(self):
+        db = get_test_db()
+        index = db._docid_index
+        for item in db.xapiandb.allterms("AA"):
+            appname = item.term[2:]
+            for m in db.xapiandb.postlist(item.term):
+                doc = db.xapiandb.get_document(m.docid)
+                pkgname = doc.get_value(XapianValues.PKGNAME)
+                self.assertTrue(
+                    m.docid in index.get_app_docids(appname, pkgname))
+                self.assertEqual(
+                    db.get_xapian_document(appname, pkgname).get_docid(),
+                    index.get_app_docids(appname, pkgname)[0])
+        docids = [m.docid for m in db.xapiandb.postlist("APsoftware-center")]
+        self.assertEqual(db.get_apps_for_pkgname("software-center"),
+                         set(docids))
+        self.assertEqual(index.get_docids("AP", u"software-center"),
+                         tuple(docids))
+        self.assertEqual(index.get_docids("AP", "no-such-pkg"), ())
+        # the index is rebuilt after a reopen
+        db.reopen()
+        self.assertFalse(db._docid_index is index)
+
+    def test_connection_pool(self):
+        import threading
+        from softwarecenter.db.pool import (
+            XapianConnectionPool, format_pool_stats)
+        pool = XapianConnectionPool(object, size=2)
+        conn = pool.get()
+        # the same thread keeps its handle
+        self.assertTrue(pool.get() is conn)
+        # a thread that is gone gives its handle back to the pool
+        handles = []
+        for i in range(3):
+            t = threading.Thread(
+                target=lambda: handles.append(pool.get().xapiandb))
+            t.start()
+            t.join()
+            while threading.active_count() > 1:
+                time.sleep(0.01)
+            del t
+        self.assertEqual(len(set(handles)), 1)
+        stats = pool.get_stats()
+        self.assertEqual(stats["opens"], 2)
+        self.assertEqual(stats["hits"], 2)
+        # a reset reopens the handles lazily
+        pool.reset()
+        self.assertFalse(pool.get() is conn)
+        self.assertEqual(pool.get_stats()["opens"], 3)
+        # a thread keeps a single weakref no matter how often it resets
+        pool.reset()
+        pool.get()
+        self.assertEqual(len(pool._thread_conns), 1)
+        # a released handle goes back to the pool right away
+        pool = XapianConnectionPool(object, size=1)
+        conn = pool.get()
+        pool.release()
+        self.assertEqual(pool.get_stats()["free"], 1)
+        self.assertTrue(pool.get() is conn)
+        # once the pool is checked out a thread waits for a handle
+        handles = []
+        t = threading.Thread(
+            target=lambda: handles.append(pool.get().xapiandb))
+        t.start()
+        time.sleep(0.1)
+        self.assertEqual(handles, [])
+        pool.release()
+        t.join()
+        self.assertEqual(handles, [conn.xapiandb])
+        stats = pool.get_stats()
+        self.assertEqual(stats["waits"], 1)
+        self.assertEqual(stats["opens"], 1)
+        # handles beyond the size of the pool are only opened after the
+        # timeout and dropped once their threads are gone
+        pool = XapianConnectionPool(object, size=1, timeout=0.1)
+        pool.get()
+        t = threading.Thread(target=pool.get)
+        t.start()
+        t.join()
+        while threading.active_count() > 1:
+            time.sleep(0.01)
+        del t
+        stats = pool.get_stats()
+        self.assertEqual(stats["overflows"], 1)
+        self.assertEqual(stats["dropped"], 1)
+        self.assertEqual(stats["handles"], 1)
+        self.assertEqual(stats["free"], 0)
+        self.assertTrue("1 dropped" in format_pool_stats(stats))
+
 class UtilsTestCase(unittest.TestCase):
 
     def test_utils_get_installed_package_list(self):
@@ -447,6 +859,66 @@ class UtilsTestCase(unittest.TestCase):
         self.assertTrue(len(installed_apps) > 0)
         self.assertTrue(len(installed_pkgs) > len(installed_apps))
 
+    def test_utils_database_generations(self):
+        from softwarecenter.db.utils import (
+            collect_generations, get_current_generation,
+            get_new_generation_path, lock_generation, publish_generation)
+        tmpdir = tempfile.mkdtemp()
+        pathname = os.path.join(tmpdir, "xapian")
+        # a database of the old layout gets replaced too
+        os.makedirs(pathname)
+        self.assertEqual(get_current_generation(pathname), None)
+        gen1 = get_new_generation_path(pathname)
+        self.assertEqual(gen1, pathname + ".gen-1")
+        os.makedirs(gen1)
+        publish_generation(pathname, gen1)
+        self.assertTrue(os.path.islink(pathname))
+        self.assertEqual(get_current_generation(pathname), gen1)
+        # a reader keeps the old generation alive
+        (path, lock) = lock_generation(pathname)
+        self.assertEqual(path, gen1)
+        gen2 = get_new_generation_path(pathname)
+        self.assertEqual(gen2, pathname + ".gen-2")
+        os.makedirs(gen2)
+        publish_generation(pathname, gen2)
+        self.assertEqual(collect_generations(pathname), [])
+        self.assertTrue(os.path.exists(gen1))
+        lock.close()
+        self.assertEqual(collect_generations(pathname), [gen1])
+        self.assertFalse(os.path.exists(gen1))
+        self.assertEqual(get_current_generation(pathname), gen2)
+        shutil.rmtree(tmpdir)
+
+    def test_reopen_if_changed(self):
+        from softwarecenter.db.utils import (
+            get_new_generation_path, publish_generation)
+        tmpdir = tempfile.mkdtemp()
+        pathname = os.path.join(tmpdir, "xapian")
+
+        def publish():
+            generation_path = get_new_generation_path(pathname)
+            xapian.WritableDatabase(generation_path,
+                                    xapian.DB_CREATE_OR_OVERWRITE).flush()
+            publish_generation(pathname, generation_path)
+            return generation_path
+        publish()
+        db = StoreDatabase(pathname, get_test_pkg_info())
+        db.open(use_axi=False, use_agent=False)
+        reopened = []
+        db.connect("reopen", lambda db: reopened.append(True))
+        # nothing changed, so there is no need to reopen
+        self.assertFalse(db.has_new_generation())
+        self.assertFalse(db.reopen_if_changed())
+        self.assertEqual(reopened, [])
+        # a new generation is picked up
+        generation_path = publish()
+        self.assertTrue(db.has_new_generation())
+        self.assertTrue(db.reopen_if_changed())
+        self.assertEqual(reopened, [True])
+        self.assertEqual(db._generation_path, generation_path)
+        db._generation_lock.close()
+        shutil.rmtree(tmpdir)
+
 
 def make_purchased_app_details(db=None, supported_series=None):
     """Return an AppDetail instance with the required attributes."""
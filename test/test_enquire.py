@@ -1,15 +1,23 @@
 #!/usr/bin/python
 
-from gi.repository import Gtk
+from gi.repository import GObject, Gtk
 
+import threading
 import time
 import unittest
 import xapian
 
+from mock import patch
+
 from testutils import setup_test_env
 setup_test_env()
 from softwarecenter.db.appfilter import AppFilter
+from softwarecenter.db.application import Application
+from softwarecenter.db.database import StoreDatabase
 from softwarecenter.db.enquire import AppEnquire
+from softwarecenter.db.update import update_from_app_install_data
+from softwarecenter.enums import (NonAppVisibility, SortMethods,
+                                  XapianValues)
 from softwarecenter.testutils import get_test_db, get_test_pkg_info
 
 class TestEnquire(unittest.TestCase):
@@ -36,6 +44,243 @@ class TestEnquire(unittest.TestCase):
         # give the threads a bit of time
         time.sleep(5)
 
+    def test_app_filter_query(self):
+        db = get_test_db()
+        cache = get_test_pkg_info()
+        query = xapian.Query("")
+        for attr, value in [("available_only", True),
+                            ("installed_only", True),
+                            ("not_installed_only", True),
+                            ("restricted_list", ["software-center"])]:
+            xfilter = AppFilter(db, cache)
+            setattr(xfilter, attr, value)
+            # the compiled query matches the same docs as the decider
+            enquire = xapian.Enquire(db.xapiandb)
+            enquire.set_query(query)
+            expected = set([m.docid for m in enquire.get_mset(
+                        0, len(db), None, xfilter)])
+            enquire.set_query(xfilter.filter_query(query))
+            docids = set([m.docid for m in enquire.get_mset(0, len(db))])
+            self.assertEqual(docids, expected)
+
+    def test_app_enquire_paginated(self):
+        from softwarecenter.db.enquire import PaginatedMatches
+        db = get_test_db()
+        cache = get_test_pkg_info()
+        query = xapian.Query("")
+        enquirer = AppEnquire(cache, db)
+        enquirer.set_query(query, limit=0, nonblocking_load=False)
+        docids = [m.docid for m in enquirer.matches]
+        enquirer = AppEnquire(cache, db)
+        enquirer.paginated = True
+        enquirer.set_query(query, limit=0, nonblocking_load=False)
+        matches = enquirer.matches
+        self.assertTrue(isinstance(matches, PaginatedMatches))
+        self.assertEqual(len(matches), len(docids))
+        matches.page_size = 10
+        # only the pages that are used get fetched
+        self.assertEqual(matches[15].docid, docids[15])
+        self.assertEqual(len(matches.get_loaded_matches()), 10)
+        self.assertEqual([m.docid for m in matches], docids)
+        # it can be used like the list of matches
+        self.assertEqual([m.docid for m in matches[5:8]], docids[5:8])
+        self.assertEqual(matches.index(matches[15]), 15)
+        self.assertTrue(matches[-1] in matches)
+        # the duplicate filter gets all the docids of the paginated matches
+        enquirer.paginated = False
+        enquirer.set_query([xapian.Query("ATapplication")], limit=0,
+                           nonblocking_load=False,
+                           persistent_duplicate_filter=True)
+        self.assertEqual(len(enquirer.matches), 0)
+        # and a query that is not paginated gets a plain list again
+        enquirer.set_query(query, limit=10, nonblocking_load=False)
+        self.assertEqual([m.docid for m in enquirer.matches], docids[:10])
+
+    def test_app_enquire_result_cache(self):
+        db = get_test_db()
+        cache = get_test_pkg_info()
+        enquirer = AppEnquire(cache, db)
+        query = xapian.Query("ATapplication")
+        enquirer.set_query(query, limit=0, nonblocking_load=False)
+        docids = [m.docid for m in enquirer.matches]
+        # the same query again is answered from the cache
+        with patch.object(enquirer, "_blocking_perform_search") as search:
+            enquirer.set_query(query, limit=0, nonblocking_load=False)
+            self.assertFalse(search.called)
+        self.assertEqual([m.docid for m in enquirer.matches], docids)
+        # a different limit is a different query
+        with patch.object(enquirer, "_blocking_perform_search") as search:
+            enquirer.set_query(query, limit=10, nonblocking_load=False)
+            self.assertTrue(search.called)
+        # reopening the database drops the cached results
+        db.reopen()
+        with patch.object(enquirer, "_blocking_perform_search") as search:
+            enquirer.set_query(query, limit=0, nonblocking_load=False)
+            self.assertTrue(search.called)
+
+    def test_app_enquire_nonblocking(self):
+        db = get_test_db()
+        cache = get_test_pkg_info()
+        enquirer = AppEnquire(cache, db)
+        loop = GObject.MainLoop()
+        completed = []
+        def _on_query_complete(enquirer):
+            completed.append(len(enquirer.matches))
+            loop.quit()
+        enquirer.connect("query-complete", _on_query_complete)
+        # the matches are set from the main loop once the search is done
+        enquirer.set_query(xapian.Query("ATapplication"), limit=0)
+        self.assertEqual(len(enquirer.matches), 0)
+        loop.run()
+        self.assertEqual(len(completed), 1)
+        self.assertTrue(completed[0] > 0)
+        # a superseded search does not touch the matches of the newer one
+        enquirer.set_query(xapian.Query("ATapplication"), limit=10)
+        job = enquirer._search_job
+        job_callback = job.callback
+        def _on_job_done(job):
+            job_callback(job)
+            loop.quit()
+        job.callback = _on_job_done
+        enquirer.set_query(xapian.Query("APsoftware-center"), limit=0,
+                           nonblocking_load=False)
+        docids = enquirer.get_docids()
+        loop.run()
+        self.assertTrue(job.cancelled)
+        self.assertEqual(len(completed), 1)
+        self.assertEqual(enquirer.get_docids(), docids)
+
+    def test_app_enquire_profiling(self):
+        from softwarecenter.db.profiling import LATENCY_BUCKETS
+        db = get_test_db()
+        cache = get_test_pkg_info()
+        db.profiler.reset()
+        enquirer = AppEnquire(cache, db)
+        enquirer.query_class = "category"
+        xfilter = AppFilter(db, cache)
+        xfilter.set_installed_only(True)
+        enquirer.set_query(xapian.Query("ATapplication"), limit=0,
+                           filter=xfilter, nonblocking_load=False)
+        db.get_query_list_from_search_entry("software")
+        histograms = db.profiler.get_histograms()
+        self.assertEqual(histograms["category"]["queries"], 1)
+        for stage in ["count", "mset"]:
+            data = histograms["category"]["stages"][stage]
+            self.assertEqual(data["samples"], 1)
+            self.assertEqual(sum(data["histogram"]), 1)
+            self.assertEqual(len(data["histogram"]),
+                             len(LATENCY_BUCKETS) + 1)
+        # the parsing of the search entry is no query on its own
+        self.assertEqual(histograms["search"]["queries"], 0)
+        self.assertEqual(
+            histograms["search"]["stages"]["parse"]["samples"], 1)
+        self.assertTrue("category: 1 queries" in
+                        db.profiler.format_histograms())
+        # the parsing is profiled under the query class of the caller
+        db.get_query_list_from_search_entry("software",
+                                            query_class="installed")
+        histograms = db.profiler.get_histograms()
+        self.assertEqual(
+            histograms["installed"]["stages"]["parse"]["samples"], 1)
+        self.assertEqual(
+            histograms["search"]["stages"]["parse"]["samples"], 1)
+
+    def test_app_enquire_top_rated(self):
+        import softwarecenter.backend.reviews
+        from softwarecenter.backend.reviews import ReviewLoader, ReviewStats
+        cache = get_test_pkg_info()
+        xdb = xapian.WritableDatabase("./data/test.db",
+                                      xapian.DB_CREATE_OR_OVERWRITE)
+        update_from_app_install_data(xdb, cache, datadir="./data/desktop")
+        xdb.flush()
+        db = StoreDatabase("./data/test.db", cache)
+        db.open(use_axi=False, use_agent=False)
+        loader = ReviewLoader(cache, db)
+        loader.REVIEW_STATS_CACHE = {}
+        for (pkgname, rating) in [("pay-app", 2.5), ("zynjacku-fake", 4.5),
+                                  ("software-center", 3.5)]:
+            app = Application("", pkgname)
+            stats = ReviewStats(app)
+            stats.dampened_rating = rating
+            loader.update_review_stats(app, stats)
+        softwarecenter.backend.reviews.review_loader = loader
+        enquirer = AppEnquire(cache, db)
+        enquirer.set_query(xapian.Query("ATapplication"),
+                           sortmode=SortMethods.BY_TOP_RATED,
+                           limit=0,
+                           nonblocking_load=False)
+        pkgnames = [db.get_pkgname(doc) for doc in enquirer.get_documents()]
+        self.assertEqual(pkgnames[:3],
+                         ["zynjacku-fake", "software-center", "pay-app"])
+        # the unrated ones follow by name
+        sort_keys = [doc.get_value(XapianValues.APPNAME_SORT_KEY)
+                     for doc in enquirer.get_documents()[3:]]
+        self.assertEqual(sort_keys, sorted(sort_keys))
+        softwarecenter.backend.reviews.review_loader = None
+
+    def test_app_enquire_top_rated_axi(self):
+        import softwarecenter.backend.reviews
+        from softwarecenter.backend.reviews import ReviewLoader, ReviewStats
+        cache = get_test_pkg_info()
+        xdb = xapian.WritableDatabase("./data/test.db",
+                                      xapian.DB_CREATE_OR_OVERWRITE)
+        update_from_app_install_data(xdb, cache, datadir="./data/desktop")
+        xdb.flush()
+        db = StoreDatabase("./data/test.db", cache)
+        db.open(use_axi=False, use_agent=False)
+        # the documents of apt-xapian-index only have the pkgname as
+        # data and as XP term
+        axi = xapian.inmemory_open()
+        for pkgname in ["axi-unrated", "axi-rated"]:
+            axi_doc = xapian.Document()
+            axi_doc.set_data(pkgname)
+            axi_doc.add_term("XP" + pkgname)
+            axi_doc.add_term("XPaxi-only")
+            axi.add_document(axi_doc)
+        db.add_database(axi)
+        loader = ReviewLoader(cache, db)
+        loader.REVIEW_STATS_CACHE = {}
+        app = Application("", "axi-rated")
+        stats = ReviewStats(app)
+        stats.dampened_rating = 3.0
+        loader.update_review_stats(app, stats)
+        softwarecenter.backend.reviews.review_loader = loader
+        enquirer = AppEnquire(cache, db)
+        enquirer.set_query(xapian.Query("XPaxi-only"),
+                           sortmode=SortMethods.BY_TOP_RATED,
+                           nonapps_visible=NonAppVisibility.ALWAYS_VISIBLE,
+                           limit=0,
+                           nonblocking_load=False)
+        pkgnames = [db.get_pkgname(doc) for doc in enquirer.get_documents()]
+        self.assertEqual(pkgnames, ["axi-rated", "axi-unrated"])
+        softwarecenter.backend.reviews.review_loader = None
+
+    def test_query_executor(self):
+        from softwarecenter.db.executor import QueryExecutor
+        executor = QueryExecutor(nr_workers=1)
+        loop = GObject.MainLoop()
+        done = []
+        def _on_done(job):
+            done.append(job)
+            if len(done) == 2:
+                loop.quit()
+        started = threading.Event()
+        unblock = threading.Event()
+        def _blocking(job):
+            started.set()
+            unblock.wait()
+            return threading.current_thread().name
+        first = executor.submit(_blocking, _on_done)
+        started.wait()
+        # the only worker is busy, so the second job did not start yet
+        second = executor.submit(lambda job: "not run", _on_done)
+        second.cancel()
+        unblock.set()
+        loop.run()
+        self.assertEqual(done, [first, second])
+        self.assertEqual(first.result, "QueryExecutor-0")
+        self.assertEqual(second.result, None)
+
     def _p(self):
         while Gtk.events_pending():
             Gtk.main_iteration()
@@ -2,12 +2,16 @@
 
 import os
 import unittest
+import xapian
+
+from mock import patch
 
 from testutils import setup_test_env
 setup_test_env()
 from softwarecenter.db.database import StoreDatabase
 from softwarecenter.db.pkginfo import get_pkg_info
-from softwarecenter.db.update import rebuild_database
+from softwarecenter.db.update import rebuild_database, set_mimetype_table
+from softwarecenter.enums import XapianValues
 
 class TestMime(unittest.TestCase):
     """ tests the mime releated stuff """
@@ -29,6 +33,53 @@ class TestMime(unittest.TestCase):
         result = db.get_most_popular_applications_for_mimetype("text/html", only_uninstalled=True, num=2)
         self.assertEqual(len(result), 2)
 
+    def test_mimetype_table(self):
+        xdb = xapian.WritableDatabase("./data/test.db",
+                                      xapian.DB_CREATE_OR_OVERWRITE)
+        for (pkgname, popcon) in [("foo-viewer", 10), ("bar-viewer", 30),
+                                  ("baz-viewer", 20)]:
+            doc = xapian.Document()
+            doc.add_term("AMtext/x-test")
+            doc.add_value(XapianValues.APPNAME, pkgname.capitalize())
+            doc.add_value(XapianValues.PKGNAME, pkgname)
+            doc.add_value(XapianValues.POPCON,
+                          xapian.sortable_serialise(popcon))
+            xdb.add_document(doc)
+        set_mimetype_table(xdb)
+        xdb.flush()
+        db = StoreDatabase("./data/test.db", self.cache)
+        db.open(use_axi=False, use_agent=False)
+        # the table answers without a query
+        with patch.object(db, "_get_most_popular_applications_from_query"
+                          ) as query:
+            result = db.get_most_popular_applications_for_mimetypes(
+                ["text/x-test", "text/x-unknown"], only_uninstalled=False,
+                num=2)
+            self.assertFalse(query.called)
+        self.assertEqual([app.pkgname for app in result["text/x-test"]],
+                         ["bar-viewer", "baz-viewer"])
+        self.assertEqual(result["text/x-test"][0].appname, "Bar-viewer")
+        self.assertEqual(result["text/x-unknown"], [])
+        # packages that are not in the cache are not uninstalled
+        result = db.get_most_popular_applications_for_mimetype(
+            "text/x-test", only_uninstalled=True)
+        self.assertEqual(result, [])
+        # the mimetypes of the other databases are not in the table
+        other = xapian.inmemory_open()
+        doc = xapian.Document()
+        doc.add_term("AMtext/x-test")
+        doc.add_term("APqux-viewer")
+        doc.add_value(XapianValues.APPNAME, "Qux-viewer")
+        doc.add_value(XapianValues.PKGNAME, "qux-viewer")
+        doc.add_value(XapianValues.POPCON, xapian.sortable_serialise(40))
+        other.add_document(doc)
+        db.add_database(other)
+        result = db.get_most_popular_applications_for_mimetypes(
+            ["text/x-test"], only_uninstalled=False, num=4)
+        self.assertEqual(
+            set([app.pkgname for app in result["text/x-test"]]),
+            set(["foo-viewer", "bar-viewer", "baz-viewer", "qux-viewer"]))
+
 
 if __name__ == "__main__":
     import logging
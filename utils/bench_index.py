@@ -0,0 +1,308 @@
+#!/usr/bin/python
+# Copyright (C) 2012 Canonical
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+""" benchmark the index build with a synthetic catalog
+
+Generates desktop files, AppInfo tag files, AppStream XML and
+software-center-agent JSON with the given number of apps, runs
+rebuild_database() (and the indexing of the agent entries into their
+own database) against a fake PackageInfo and prints the docs/second,
+the peak RSS and the time of every stage as JSON, e.g.:
+
+  python utils/bench_index.py --sizes 1000,10000,100000 --jobs 4 \
+      -o bench.json
+"""
+
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import xapian
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from softwarecenter.db.pkginfo import PackageInfo
+from softwarecenter.db.update import (
+    BatchedWritableDatabase,
+    PackageMetadataSnapshot,
+    RateLimitedProgress,
+    SCAApplicationParser,
+    index_app_info_from_parser,
+    rebuild_database,
+    )
+
+# entries per AppInfo/AppStream file
+ENTRIES_PER_FILE = 5000
+
+CATEGORIES = ["AudioVideo", "Development", "Education", "Game", "Graphics",
+              "Network", "Office", "Science", "System", "Utility"]
+MIMETYPES = ["text/plain", "text/html", "image/png", "audio/ogg",
+             "video/mpeg", "application/pdf"]
+WORDS = ["editor", "viewer", "player", "browser", "manager", "tool",
+         "client", "server", "game", "library", "simple", "fast", "small"]
+
+
+class FakeOrigin(object):
+    def __init__(self, component):
+        self.archive = "precise"
+        self.component = component
+        self.label = "Ubuntu"
+        self.origin = "Ubuntu"
+        self.site = "archive.ubuntu.com"
+
+
+class FakeVersion(object):
+    def __init__(self, i):
+        self.summary = "synthetic package %i" % i
+        self.description = " ".join(
+            [WORDS[(i + j) % len(WORDS)] for j in range(40)])
+        self.origins = [FakeOrigin(("main", "universe")[i % 2])]
+
+
+class FakePackageInfo(PackageInfo):
+    """ a PackageInfo that knows every synthetic package """
+
+    def __init__(self, pkgnames):
+        PackageInfo.__init__(self)
+        self._candidates = {}
+        for (i, pkgname) in enumerate(pkgnames):
+            self._candidates[pkgname] = FakeVersion(i)
+
+    def __contains__(self, pkgname):
+        return pkgname in self._candidates
+
+    def is_installed(self, pkgname):
+        return False
+
+    def get_candidate(self, pkgname):
+        return self._candidates.get(pkgname)
+
+    def get_section(self, pkgname):
+        return "utils"
+
+    @property
+    def ready(self):
+        return True
+
+
+def _app(kind, i):
+    """ return the synthetic data of app number i of the given kind """
+    words = [WORDS[(i + j) % len(WORDS)] for j in range(3)]
+    return {"pkgname": "bench-%s-%i" % (kind, i),
+            "name": "Bench %s %s %i" % (kind.capitalize(), words[0], i),
+            "comment": "A %s %s" % (words[1], words[2]),
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "mimetype": MIMETYPES[i % len(MIMETYPES)],
+            "keywords": ";".join(words),
+            "popcon": i % 1000,
+           }
+
+
+def write_desktop_files(datadir, n):
+    for i in range(n):
+        app = _app("desktop", i)
+        with open(os.path.join(datadir, "%s.desktop" % app["pkgname"]),
+                  "w") as f:
+            f.write("[Desktop Entry]\n"
+                    "X-AppInstall-Package=%(pkgname)s\n"
+                    "X-AppInstall-Popcon=%(popcon)i\n"
+                    "X-AppInstall-Section=main\n"
+                    "Name=%(name)s\n"
+                    "Comment=%(comment)s\n"
+                    "Categories=%(category)s;\n"
+                    "MimeType=%(mimetype)s;\n"
+                    "Keywords=%(keywords)s;\n"
+                    "Icon=%(pkgname)s\n"
+                    "Type=Application\n" % app)
+
+
+def write_appinfo_files(listsdir, n):
+    for start in range(0, n, ENTRIES_PER_FILE):
+        path = os.path.join(listsdir, "bench_%i_AppInfo" % start)
+        with open(path, "w") as f:
+            for i in range(start, min(n, start + ENTRIES_PER_FILE)):
+                f.write("Package: %(pkgname)s\n"
+                        "Popcon: %(popcon)i\n"
+                        "Name: %(name)s\n"
+                        "Comment: %(comment)s\n"
+                        "Categories: %(category)s;\n"
+                        "MimeType: %(mimetype)s;\n"
+                        "Icon: %(pkgname)s\n"
+                        "Type: Application\n\n" % _app("appinfo", i))
+
+
+def write_appstream_files(xmldir, n):
+    for start in range(0, n, ENTRIES_PER_FILE):
+        path = os.path.join(xmldir, "bench_%i.xml" % start)
+        with open(path, "w") as f:
+            f.write('<?xml version="1.0"?>\n<applications version="0.1">\n')
+            for i in range(start, min(n, start + ENTRIES_PER_FILE)):
+                app = _app("appstream", i)
+                app["keywords"] = "".join(
+                    ["<keyword>%s</keyword>" % k
+                     for k in app["keywords"].split(";")])
+                f.write("<application>"
+                        '<id type="desktop">%(pkgname)s.desktop</id>'
+                        "<pkgname>%(pkgname)s</pkgname>"
+                        "<name>%(name)s</name>"
+                        "<summary>%(comment)s</summary>"
+                        "<keywords>%(keywords)s</keywords>"
+                        '<icon type="stock">%(pkgname)s</icon>'
+                        "<appcategories><appcategory>%(category)s"
+                        "</appcategory></appcategories>"
+                        "<mimetypes><mimetype>%(mimetype)s</mimetype>"
+                        "</mimetypes>"
+                        "</application>\n" % app)
+            f.write("</applications>\n")
+
+
+def write_sca_json(path, n):
+    available = []
+    for i in range(n):
+        app = _app("sca", i)
+        available.append({
+            "package_name": app["pkgname"],
+            "name": app["name"],
+            "description": "%s\n%s" % (app["comment"], app["keywords"]),
+            "categories": app["category"],
+            "archive_id": "commercial-ppa-uploaders/%s" % app["pkgname"],
+            "archive_root": "http://private-ppa.launchpad.net/",
+            "price": "2.99",
+            "series": {"precise": ["i386", "amd64"]},
+            "icon_url": "http://example.com/%s.png" % app["pkgname"],
+            "date_published": "2012-01-21 02:15:10.358926",
+            })
+    with open(path, "w") as f:
+        json.dump(available, f)
+
+
+def index_sca_json(db, cache, path):
+    """ index the entries the way update_from_software_center_agent()
+        does, but without talking to the network
+    """
+    from piston_mini_client import PistonResponseObject
+    for entry in json.load(open(path)):
+        parser = SCAApplicationParser(PistonResponseObject.from_dict(entry))
+        index_app_info_from_parser(parser, db, cache)
+
+
+def run_benchmark(n, jobs=1):
+    """ build the index for n apps of every kind in a temporary directory
+        with the given number of jobs and return the timings
+    """
+    tmpdir = tempfile.mkdtemp(prefix="bench-index-")
+    try:
+        paths = {}
+        for name in ("desktop", "lists", "xmls", "sca-xapian"):
+            paths[name] = os.path.join(tmpdir, name)
+            os.makedirs(paths[name])
+        paths["xapian"] = os.path.join(tmpdir, "xapian")
+        paths["sca"] = os.path.join(tmpdir, "available.json")
+        start = time.time()
+        write_desktop_files(paths["desktop"], n)
+        write_appinfo_files(paths["lists"], n)
+        write_appstream_files(paths["xmls"], n)
+        write_sca_json(paths["sca"], n)
+        generate_seconds = time.time() - start
+
+        pkgnames = [_app(kind, i)["pkgname"]
+                    for kind in ("desktop", "appinfo", "appstream", "sca")
+                    for i in range(n)]
+        cache = FakePackageInfo(pkgnames)
+        progress = RateLimitedProgress(callback=lambda nr_items, item: None)
+        result = {"apps_per_source": n,
+                  "jobs": jobs,
+                  "generate_seconds": generate_seconds,
+                  "stages": {},
+                 }
+
+        # the full pipeline: the sources, the workers of --jobs, the
+        # metadata tables and the publishing of the generation
+        start = time.time()
+        rebuild_database(paths["xapian"], appstream_sources=True, jobs=jobs,
+                         progress=progress, cache=cache,
+                         datadir=paths["desktop"], listsdir=paths["lists"],
+                         xmldir=paths["xmls"])
+        seconds = time.time() - start
+        docs = xapian.Database(paths["xapian"]).get_doccount()
+        result["stages"]["rebuild"] = {
+            "seconds": seconds,
+            "docs": docs,
+            "docs_per_second": docs / seconds if seconds else None,
+            }
+
+        # the agent entries go into a database of their own
+        db = BatchedWritableDatabase(paths["sca-xapian"],
+                                     xapian.DB_CREATE_OR_OVERWRITE)
+        start = time.time()
+        index_sca_json(db, PackageMetadataSnapshot(cache), paths["sca"])
+        db.flush()
+        seconds = time.time() - start
+        docs = db.get_doccount()
+        result["stages"]["sca"] = {
+            "seconds": seconds,
+            "docs": docs,
+            "docs_per_second": docs / seconds if seconds else None,
+            }
+
+        result["docs"] = sum([stage["docs"]
+                              for stage in result["stages"].values()])
+        result["index_seconds"] = sum([stage["seconds"]
+                                       for stage in result["stages"].values()])
+        result["docs_per_second"] = result["docs"] / result["index_seconds"]
+        # ru_maxrss is in kB on linux, the workers of --jobs are children
+        result["peak_rss_kb"] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss
+        result["peak_worker_rss_kb"] = resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss
+        return result
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--sizes", default="1000,10000,100000",
+                      help="comma separated number of apps per source kind")
+    parser.add_option("--jobs", default=1, type="int",
+                      help="number of indexing processes, 0 for one per cpu")
+    parser.add_option("-o", "--output", default=None,
+                      help="write the JSON report to this file")
+    (options, args) = parser.parse_args()
+
+    report = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "xapian_version": xapian.version_string(),
+              "runs": [],
+             }
+    for n in [int(size) for size in options.sizes.split(",")]:
+        # every size runs in a fresh process so that the peak RSS
+        # is not inherited from the previous (smaller) run
+        pool = multiprocessing.Pool(1)
+        report["runs"].append(pool.apply(run_benchmark, (n, options.jobs)))
+        pool.close()
+        pool.join()
+
+    out = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(out + "\n")
+    print out